@@ -1,7 +1,16 @@
 from __future__ import division
 import numpy as np
 import multiprocessing as mp
+from multiprocessing.queues import SimpleQueue
 import math
+import os
+import tempfile
+import contextlib
+import itertools
+import collections
+import time
+import threading
+import Queue
 from scipy import optimize
 import scipy
 import forward_diff
@@ -16,6 +25,10 @@ IMPORTANT: this code is based basically based on two references.
 #as it is used always in the sequential part of the code.
 NUM_WORKERS = None
 
+#Size of the ODE system from which the Jacobian estimations are matrix-free by default
+#(a dense N x N Jacobian would need N RHS evaluations and O(N^2) memory), see _MatrixFreeJacobian
+MATRIX_FREE_THRESHOLD = 10000
+
 def set_NUM_WORKERS(nworkers):
     '''
     Set number of parallel workers to be used to parallelize solver's operations
@@ -32,6 +45,596 @@ def set_NUM_WORKERS(nworkers):
     else: 
         NUM_WORKERS = max(nworkers, 1)
 
+#Time (in seconds) that a WorkerPool waits for a result before checking that its workers are alive
+_WORKER_POLL_TIME = 1
+
+def _worker_loop(worker, tasks, results):
+    '''
+    Main loop run by every worker (process or thread) of a WorkerPool. It waits for tasks (index, func, job) in its own
+    tasks queue, computes func(job) and puts (index, worker, success, result, busyTime) in the shared results queue,
+    where busyTime is the time (in seconds) spent computing func(job). The loop finishes when None is received.
+    
+    @param worker (int): index of the worker inside the pool
+    @param tasks (SimpleQueue or Queue): queue with the tasks to be done by this worker
+    @param results (SimpleQueue or Queue): queue shared by all workers where results are put
+    '''
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, func, job = task
+        start = time.time()
+        try:
+            success, result = True, func(job)
+        except Exception as e:
+            success, result = False, e
+        results.put((index, worker, success, result, time.time() - start))
+
+class WorkerPool(object):
+    '''
+    Long-lived pool of workers that can be reused across many solver calls, so that the cost
+    of starting the workers is only paid once (instead of once per call to the solver). 
+    
+    The workers can be processes (default) or threads. Threads avoid pickling the jobs and duplicating
+    memory, and they are the best choice when the RHS function releases the GIL (f2py Fortran code or
+    heavy NumPy/FFT code). Otherwise processes should be used. Each worker has its own preallocated
+    workspace for the stage computations (see _getWorkspace(..)).
+    
+    The pool can be passed to the solver functions (pool parameter) or activated for all the solver
+    calls inside a with block (see worker_pool(..) context manager). The workers are shut down 
+    deterministically (they are joined) when close() is called or when the with block is exited.
+    If a worker process dies (crash in compiled RHS code, killed by the OS...) the results of its job are
+    lost: the pool is then closed and a RuntimeError is raised instead of waiting forever.
+    
+    Example:
+        with WorkerPool(4) as pool:
+            for ...:
+                ys = extrapolation_parallel(method, func, grad, y0, t, pool=pool)
+    '''
+    
+    def __init__(self, nworkers=None, backend='processes'):
+        '''
+        @param nworkers (int): number of workers (if None it is set to the number 
+                of processors of computer, see set_NUM_WORKERS(..))
+        @param backend (string): type of workers, 'processes' or 'threads'
+        '''
+        if backend == 'processes':
+            Worker, WorkerQueue = mp.Process, SimpleQueue
+        elif backend == 'threads':
+            Worker, WorkerQueue = threading.Thread, Queue.Queue
+        else:
+            raise ValueError("Unknown backend: " + str(backend))
+        set_NUM_WORKERS(nworkers)
+        self.nworkers = NUM_WORKERS
+        self.backend = backend
+        self.lastWorkers = None
+        self.lastIdleTimes = None
+        #Measured time of a round trip through the pool (see _measureDispatchOverhead(..))
+        self.dispatchOverhead = None
+        self._affinity = {}
+        self._results = WorkerQueue()
+        self._tasks = []
+        self._workers = []
+        for worker in range(self.nworkers):
+            tasks = WorkerQueue()
+            process = Worker(target=_worker_loop, args=(worker, tasks, self._results))
+            process.daemon = True
+            process.start()
+            self._tasks.append(tasks)
+            self._workers.append(process)
+    
+    def map(self, func, jobs, affinity=None, costs=None):
+        '''
+        Computes func(job) for every job in jobs in parallel (equivalent to multiprocessing.Pool.map with
+        chunksize=1). Each job is sent to the first worker that is free, in the order of jobs (so the jobs
+        should be sorted largest first to balance the load dynamically).
+        
+        If affinity keys are given, a job is sent preferably to the worker that computed the last job with
+        the same key (so that the worker can reuse data it has cached), unless that worker is busy and another
+        one is free. If the costs of the jobs are given, a worker only prefers a job among the pending jobs of 
+        the largest cost, so that affinity doesn't undo the largest first order. A free worker never waits while 
+        there are pending jobs: once the free workers have got the jobs that prefer them, the rest of the free 
+        workers get the first pending jobs.
+        
+        After the call, lastWorkers has the worker that computed each job and lastIdleTimes the time (in
+        seconds) that each worker has been idle during the call.
+        
+        @param func (callable(job)): function to apply, it has to be picklable (defined at module level)
+        @param jobs (list): list of arguments of func
+        @param affinity (list): hashable key for every job (or None)
+        @param costs (list): estimated cost of every job (or None if they are not known)
+        
+        @return results (list): list with func(job) for every job (in the same order as jobs)
+        '''
+        if self._workers is None:
+            raise ValueError("Pool is closed")
+        jobs = list(jobs)
+        results = len(jobs)*[None]
+        workers = len(jobs)*[None]
+        busyTimes = self.nworkers*[0]
+        if affinity is None:
+            preferred = len(jobs)*[None]
+        else:
+            preferred = [self._affinity.get(key) for key in affinity]
+        start = time.time()
+        error = None
+        pending = list(range(len(jobs)))
+        free = list(range(self.nworkers))
+        busy = 0
+        while True:
+            #Once an error has happened do not send new jobs, just wait for the busy workers
+            if error is None:
+                #First the jobs preferring each free worker, then the first pending jobs to the other free workers
+                assignments = []
+                for worker in list(free):
+                    largest = None if costs is None or not pending else max(costs[i] for i in pending)
+                    choices = [i for i in pending 
+                               if preferred[i] == worker and (largest is None or costs[i] == largest)]
+                    if choices:
+                        assignments.append((worker, choices[0]))
+                        pending.remove(choices[0])
+                        free.remove(worker)
+                while free and pending:
+                    assignments.append((free.pop(0), pending.pop(0)))
+                for (worker, i) in assignments:
+                    self._tasks[worker].put((i, func, jobs[i]))
+                    busy += 1
+            if busy == 0:
+                break
+            i, worker, success, res, busyTime = self._getResult()
+            busy -= 1
+            free.append(worker)
+            if not success:
+                error = res
+            results[i] = res
+            workers[i] = worker
+            busyTimes[worker] += busyTime
+        if affinity is not None:
+            if len(self._affinity) > 1024:
+                self._affinity.clear()
+            for (key, worker) in zip(affinity, workers):
+                self._affinity[key] = worker
+        wallTime = time.time() - start
+        self.lastWorkers = workers
+        self.lastIdleTimes = [max(wallTime - busyTime, 0) for busyTime in busyTimes]
+        if error is not None:
+            raise error
+        return results
+    
+    def broadcast(self, func, arg):
+        '''
+        Computes func(arg) once in every worker of the pool (used to send data that all the workers
+        have to keep, see _registerProblem(..)).
+        
+        @param func (callable(arg)): function to apply, it has to be picklable (defined at module level)
+        @param arg: argument of func
+        
+        @return results (list): list with the result of func(arg) in each worker
+        '''
+        if self._workers is None:
+            raise ValueError("Pool is closed")
+        for worker in range(self.nworkers):
+            self._tasks[worker].put((worker, func, arg))
+        results = self.nworkers*[None]
+        error = None
+        for i in range(self.nworkers):
+            index, worker, success, res, busyTime = self._getResult()
+            if not success:
+                error = res
+            results[index] = res
+        if error is not None:
+            raise error
+        return results
+    
+    def _getResult(self):
+        '''
+        Waits for the next result of the workers, checking every _WORKER_POLL_TIME seconds that all of
+        them are alive. If one has died, the pool is closed (see _abort()).
+        
+        @return (index, worker, success, result, busyTime): next result put by a worker (see _worker_loop(..))
+        '''
+        while True:
+            if self.backend == 'threads':
+                try:
+                    return self._results.get(timeout=_WORKER_POLL_TIME)
+                except Queue.Empty:
+                    pass
+            #Only this process reads the results, so the result polled is still there when it is read
+            elif self._results._reader.poll(_WORKER_POLL_TIME):
+                return self._results.get()
+            dead = [worker for worker in range(self.nworkers) if not self._workers[worker].is_alive()]
+            if dead:
+                exitcode = getattr(self._workers[dead[0]], 'exitcode', None)
+                self._abort()
+                raise RuntimeError("Worker " + str(dead[0]) + " of the pool died (exit code " + str(exitcode) + 
+                                   "), the pool has been closed")
+    
+    def _abort(self):
+        '''
+        Stops all the workers without waiting for the jobs they are computing (which are lost).
+        '''
+        for tasks in self._tasks:
+            tasks.put(None)
+        if self.backend == 'processes':
+            for process in self._workers:
+                process.terminate()
+                process.join()
+        self._workers = None
+    
+    @property
+    def closed(self):
+        '''
+        Whether the pool has been closed (by close() or because a worker died).
+        '''
+        return self._workers is None
+    
+    def close(self):
+        '''
+        Stops all the workers and waits for them to finish.
+        '''
+        if self._workers is None:
+            return
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._workers:
+            process.join()
+        self._workers = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ExecutorPool(object):
+    '''
+    Adapts a concurrent.futures executor (for example a ThreadPoolExecutor or a ProcessPoolExecutor) so that 
+    it can be used as the pool of workers of the solver. Executors are used automatically through this 
+    class when passed as pool parameter.
+    '''
+    
+    def __init__(self, executor, nworkers=None):
+        '''
+        @param executor (concurrent.futures.Executor): executor to use
+        @param nworkers (int): number of workers of the executor (if None, it is taken from the executor)
+        '''
+        self.executor = executor
+        self.nworkers = nworkers if nworkers is not None else getattr(executor, '_max_workers', None)
+    
+    def map(self, func, jobs):
+        '''
+        Computes func(job) for every job in jobs with the executor (see WorkerPool.map(..)).
+        '''
+        return list(self.executor.map(func, jobs))
+
+#Pool used by default by the solvers (see worker_pool(..))
+_DEFAULT_POOL = None
+
+@contextlib.contextmanager
+def worker_pool(nworkers=None, backend='processes'):
+    '''
+    Context manager that creates a WorkerPool and makes it the default pool of all the solver
+    calls done inside the with block (unless a pool is passed explicitly to the solver).
+    The pool is closed when the with block is exited.
+    
+    Example:
+        with worker_pool(4):
+            for ...:
+                ys = extrapolation_parallel(method, func, grad, y0, t)
+    
+    @param nworkers (int): number of workers (see WorkerPool)
+    @param backend (string): type of workers, 'processes' or 'threads' (see WorkerPool)
+    
+    @return pool (WorkerPool): the pool created
+    '''
+    global _DEFAULT_POOL
+    previousPool = _DEFAULT_POOL
+    pool = WorkerPool(nworkers, backend)
+    _DEFAULT_POOL = pool
+    try:
+        yield pool
+    finally:
+        _DEFAULT_POOL = previousPool
+        pool.close()
+
+def _getPool(pool, nworkers):
+    '''
+    Gets the pool of workers to be used by one solver call. If pool is None, the default pool
+    (see worker_pool(..)) is used, and if there is no default pool a new WorkerPool is created
+    (which has to be closed by the solver once finished).
+    NUM_WORKERS is set to the number of workers of the pool used.
+    
+    @param pool (WorkerPool, concurrent.futures executor or object with a map(func, jobs) method): pool given 
+            by the user (can be None)
+    @param nworkers (int): number of workers if a new pool has to be created
+    
+    @return (pool, ownPool):
+        @return pool: pool of workers to use
+        @return ownPool (bool): whether the pool was created here (and thus has to be closed by the solver)
+    '''
+    if pool is None:
+        pool = _DEFAULT_POOL
+    if pool is None:
+        return (WorkerPool(nworkers), True)
+    if hasattr(pool, 'submit'):
+        pool = ExecutorPool(pool)
+    poolWorkers = getattr(pool, 'nworkers', None)
+    set_NUM_WORKERS(nworkers if poolWorkers is None else poolWorkers)
+    return (pool, False)
+
+class SerialPool(object):
+    '''
+    Computes the jobs in the calling process, one after the other. It is used instead of a pool of workers
+    when parallelism can't pay off, i.e. when sending the jobs of a step to the workers and getting back the
+    results costs more than computing them (tiny systems, see _parallelPaysOff(..)).
+    
+    It records the time spent in the last map call, so that it can be compared with the dispatch overhead
+    of a pool of workers.
+    '''
+    
+    def __init__(self):
+        self.lastMapTime = 0
+    
+    def map(self, func, jobs):
+        '''
+        Computes func(job) for every job in jobs (see WorkerPool.map(..)).
+        '''
+        start = time.time()
+        results = [func(job) for job in jobs]
+        self.lastMapTime = time.time() - start
+        return results
+
+def _getSerialPool(pool, nworkers):
+    '''
+    Gets a SerialPool to compute the jobs in the calling process. NUM_WORKERS is set as in _getPool(..)
+    (the load balancing, and thus the results, are the same whether the jobs are computed serially or not).
+    
+    @param pool (WorkerPool, concurrent.futures executor or object with a map(func, jobs) method): pool given 
+            by the user (can be None)
+    @param nworkers (int): number of workers if a new pool had to be created
+    
+    @return (pool, ownPool): SerialPool and False (there is nothing to close)
+    '''
+    if pool is None:
+        pool = _DEFAULT_POOL
+    poolWorkers = getattr(pool, 'nworkers', None)
+    set_NUM_WORKERS(nworkers if poolWorkers is None else poolWorkers)
+    return (SerialPool(), False)
+
+def _noop(job):
+    '''
+    Job that does nothing (used to measure the dispatch overhead of a pool, see _measureDispatchOverhead(..)).
+    '''
+    return None
+
+#Estimated time (in seconds) to send the jobs of one step to a pool of workers and get back the results.
+#It is updated every time a pool is measured (see _measureDispatchOverhead(..)), this initial (conservative)
+#value is only used if no pool has been measured yet.
+_dispatchOverhead = 1e-3
+
+def _measureDispatchOverhead(pool, yn):
+    '''
+    Measures the time of a round trip through the pool of NUM_WORKERS jobs carrying yn (the minimum
+    of three measures is taken) and stores it as the estimated dispatch overhead. It is also stored in
+    the pool (dispatchOverhead attribute), so that each pool is only measured once (see _parallelPaysOff(..)).
+    
+    @param pool: pool of workers (or concurrent.futures executor)
+    @param yn (array): solution value (used as job payload)
+    
+    @return overhead (float): measured time in seconds
+    '''
+    global _dispatchOverhead
+    jobs = NUM_WORKERS*[yn]
+    times = []
+    for i in range(3):
+        start = time.time()
+        (ExecutorPool(pool) if hasattr(pool, 'submit') else pool).map(_noop, jobs)
+        times.append(time.time() - start)
+    _dispatchOverhead = min(times)
+    try:
+        pool.dispatchOverhead = _dispatchOverhead
+    except AttributeError:
+        pass
+    return _dispatchOverhead
+
+def _parallelPaysOff(serialTime, pool, yn):
+    '''
+    Decides whether computing the stages of a step in parallel pays off, comparing the time saved by 
+    parallelizing (measured time to compute the stages serially, serialTime, times 1-1/workers, where workers
+    is NUM_WORKERS bounded by the number of CPUs) with the dispatch overhead of the pool. If the pool already exists
+    its overhead is measured the first time (and then reused in all the solver calls with the same pool), otherwise
+    the last measured overhead is used (so that no pool is created for tiny problems).
+    
+    @param serialTime (float): time in seconds to compute serially all the stages of a step
+    @param pool: pool given by the user (can be None, then the default pool is used if there is one)
+    @param yn (array): solution value
+    
+    @return (bool): True if the stages should be computed in parallel
+    '''
+    if pool is None:
+        pool = _DEFAULT_POOL
+    overhead = _dispatchOverhead
+    if pool is not None:
+        overhead = getattr(pool, 'dispatchOverhead', None)
+        if overhead is None:
+            overhead = _measureDispatchOverhead(pool, yn)
+    workers = min(NUM_WORKERS, mp.cpu_count())
+    return serialTime*(1-1/workers) > overhead
+
+#Problems registered in this worker, see _registerProblem(..)
+_workerProblems = {}
+_problemIds = itertools.count()
+
+def _registerProblem(pool, problem):
+    '''
+    Registers the definition of the problem in all the workers of the pool, so that it is sent once
+    per solver call instead of being pickled in the jobs of every step. If the pool can't send data to 
+    all its workers (it has no broadcast method, e.g. a multiprocessing.Pool) the problem is not registered
+    and it is sent with every job.
+    
+    func and grad are pickled by reference, so the worker processes run them with the module globals they
+    had when the pool was started. The data of the problem is the payload of args, which is registered
+    with the problem and passed by the workers to func and grad.
+    
+    @param pool (WorkerPool): pool of workers
+    @param problem (tuple): (method, methodargs, func, grad, args, smoothing, addSolverParam), see _compute_stages(..)
+    
+    @return problemRef: reference to the problem to be sent in the jobs, it is either the id of the
+            registered problem or the problem itself (if it could not be registered)
+    '''
+    if not hasattr(pool, 'broadcast'):
+        return problem
+    problemId = next(_problemIds)
+    pool.broadcast(_storeProblem, (problemId, problem))
+    return problemId
+
+def _releaseProblem(pool, problemRef):
+    '''
+    Removes from the workers of the pool a problem registered with _registerProblem(..).
+    
+    @param pool (WorkerPool): pool of workers
+    @param problemRef: reference returned by _registerProblem(..)
+    '''
+    #A pool closed because a worker died has nothing to release
+    if not isinstance(problemRef, tuple) and not getattr(pool, 'closed', False):
+        pool.broadcast(_forgetProblem, problemRef)
+
+def _storeProblem((problemId, problem)):
+    '''
+    Stores (in a worker) a problem definition, see _registerProblem(..).
+    '''
+    _workerProblems[problemId] = problem
+
+def _forgetProblem(problemId):
+    '''
+    Removes (in a worker) a problem definition, see _releaseProblem(..). The shared block of the solver call
+    (see _getSharedArray(..)) is closed too, so that its file is not kept mapped once it is removed.
+    '''
+    _workerProblems.pop(problemId, None)
+    _workerSharedArrays.clear()
+
+def _getProblem(problemRef):
+    '''
+    Gets (in a worker) the problem definition from its reference (see _registerProblem(..)).
+    '''
+    if isinstance(problemRef, tuple):
+        return problemRef
+    return _workerProblems[problemRef]
+
+#Workspace of this worker (each thread has its own), see _getWorkspace(..)
+_workspace = threading.local()
+
+def _getWorkspace(rows, cols, dtype):
+    '''
+    Gets an array from the workspace of the calling worker (each process or thread has its own workspace),
+    so that the stage arrays are not allocated at every step. The workspace is only reallocated when it is
+    not big enough.
+    
+    @param rows (int): number of rows needed
+    @param cols (int): number of columns (size of the ODE system)
+    @param dtype (numpy dtype): type of the values
+    
+    @return array (2D array): (rows, cols) array (its values are not initialized)
+    '''
+    dtype = np.dtype(dtype)
+    array = getattr(_workspace, 'array', None)
+    if(array is None or array.shape[0] < rows or array.shape[1] != cols or array.dtype != dtype):
+        array = np.empty((rows, cols), dtype=dtype)
+        _workspace.array = array
+    return array[:rows]
+
+#Directory where the shared memory blocks are created (/dev/shm is a RAM backed file system)
+_SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+class SharedBuffer(object):
+    '''
+    Memory block shared between the main process and the workers. The workers write the stage results
+    (see _compute_stages) directly into it, so that only small metadata has to be sent back through
+    the pool (instead of pickling the whole intermediate solutions and function evaluations).
+    
+    The block is a numpy memmap of a file in a RAM backed file system (/dev/shm), that the workers open
+    by name (see _getSharedArray(..)). It is owned by the main process: it grows when more rows are
+    needed and its file is removed when close() is called.
+    
+    When the stages are computed in the main process (SerialPool) nothing has to be shared, so a local
+    buffer is a plain numpy array, which is passed to _compute_stages as it is (no file is created).
+    '''
+    
+    def __init__(self, local=False):
+        '''
+        @param local (bool): whether the block is only used by the main process
+        '''
+        self.local = local
+        self.name = None
+        self.array = None
+    
+    def get(self, rows, cols, dtype):
+        '''
+        Gets a shared array with at least rows rows (and exactly cols columns and dtype type), 
+        reallocating the block if the current one is not big enough.
+        
+        @param rows (int): minimum number of rows needed
+        @param cols (int): number of columns (size of the ODE system)
+        @param dtype (numpy dtype): type of the values
+        
+        @return array (2D memmap): shared array
+        '''
+        dtype = np.dtype(dtype)
+        if(self.array is None or self.array.shape[0] < rows or self.array.shape[1] != cols 
+                or self.array.dtype != dtype):
+            self.close()
+            #Allocate with some extra room so that the block is not reallocated every time the order increases
+            if(self.local):
+                self.array = np.empty((2*rows, cols), dtype=dtype)
+            else:
+                fd, self.name = tempfile.mkstemp(prefix='ex_parallel_', dir=_SHARED_DIR)
+                os.close(fd)
+                self.array = np.memmap(self.name, dtype=dtype, mode='w+', shape=(2*rows, cols))
+        return self.array
+    
+    def descriptor(self):
+        '''
+        @return (name, dtype, shape): small (picklable) description of the block, so that the workers can open it
+                (the array itself for a local buffer)
+        '''
+        if(self.local):
+            return self.array
+        return (self.name, self.array.dtype.str, self.array.shape)
+    
+    def close(self):
+        '''
+        Releases the block and removes its file.
+        '''
+        if self.array is not None:
+            self.array = None
+            if(not self.local):
+                os.remove(self.name)
+            self.name = None
+
+#Shared arrays opened by this worker, see _getSharedArray(..)
+_workerSharedArrays = {}
+
+def _getSharedArray(descriptor):
+    '''
+    Opens (in a worker) the shared block described by descriptor (see SharedBuffer.descriptor()). 
+    The last opened block is kept open so that it is not reopened at every step, until the problem is
+    released (see _forgetProblem(..)). It is kept by its whole descriptor, so that a file name reused with
+    another layout is opened again.
+    
+    @param descriptor (3-tuple or 2D array): (name, dtype, shape) of the block, or the array of a local block
+    
+    @return array (2D memmap or array): shared array
+    '''
+    if(isinstance(descriptor, np.ndarray)):
+        return descriptor
+    name, dtype, shape = descriptor
+    array = _workerSharedArrays.get(descriptor)
+    if array is None:
+        _workerSharedArrays.clear()
+        array = np.memmap(name, dtype=np.dtype(dtype), mode='r+', shape=shape)
+        _workerSharedArrays[descriptor] = array
+    return array
+
 def _error_norm(y1, y2, atol, rtol):
     '''
     Error norm/measure between y1, y2.
@@ -76,6 +679,9 @@ def method_implicit/explicit/semi-implicit(f, grad, previousValues, previousTime
         @return je_tot (int): number of Jacobian evaluations done in this method
 '''''
 
+#Lock used to call MINPACK (optimize.fsolve) from only one thread at a time
+_minpackLock = threading.Lock()
+
 def _solve_implicit_step(zero_f, zero_grad, estimatedValue, addSolverParam):
     '''
     Find the root of the zero_f function using as initial approximation estimatedValueExplicit.
@@ -100,8 +706,11 @@ def _solve_implicit_step(zero_f, zero_grad, estimatedValue, addSolverParam):
     #https://github.com/scipy/scipy/issues/5369
     #TODO: add extra 2 function evaluations
     
-    x, infodict, ier, mesg = optimize.fsolve(zero_f,estimatedValue, 
-            fprime = zero_grad, full_output = True, xtol=addSolverParam['min_tol'])
+    #MINPACK wrappers are not reentrant (the Python callbacks are kept in global state),
+    #so calls from different threads of a WorkerPool have to be serialized
+    with _minpackLock:
+        x, infodict, ier, mesg = optimize.fsolve(zero_f,estimatedValue, 
+                fprime = zero_grad, full_output = True, xtol=addSolverParam['min_tol'])
 
     if("njev" in infodict):
         return (x, infodict["nfev"], infodict["njev"])
@@ -115,18 +724,24 @@ def _solve_implicit_step(zero_f, zero_grad, estimatedValue, addSolverParam):
 #     return (optObject.x, optObject.nfev)
 
 
-def _midpoint_semiimplicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam, J00, I, Isparse):
+def _midpoint_semiimplicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam, J00,
+                           factor=None, precond=None):
     '''
     Calculates solution at previousTime+step doing one step with a midpoint semiimplicit formula (linearly implicit midpoint)
     Based on IV.9.16a-b (ref II).
     
+    If factor (the factorization of I-step*J00, see _factorMatrix(..)) is given, it is used to solve the linear system.
+    If precond (preconditioner of I-step*J00, see _buildPreconditioner(..)) is given, it is used by the iterative solver.
+    If J00 is a _MatrixFreeJacobian, the products with J00 are approximated with RHS evaluations (counted in fe_tot).
+    
     '''
     
     previousPreviousValue, previousValue = previousValues
     je_tot=0
        
     if(previousPreviousValue is None):
-        return _euler_semiimplicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam, J00, I, Isparse)
+        return _euler_semiimplicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam, J00,
+                                   factor, precond)
     
     if(f_previousValue is None):
         f_yj = f(*(previousValue,previousTime)+args)
@@ -141,50 +756,637 @@ def _midpoint_semiimplicit(f, grad, previousValues, previousTime,f_previousValue
         xval, f_yj, fe_tot_,je_tot=_euler_explicit(f, grad, previousValues, previousTime, f_yj, step, args, addSolverParam)
         fe_tot += fe_tot_
 
-    b = np.dot(-(I+step*J00),(previousValue-previousPreviousValue)) + 2*step*f_yj
-    
-    if(scipy.sparse.issparse(J00)):
-        A=_calculateMatrix(Isparse,J00,step)
-        if(addSolverParam['iterative']):
-            sol, info= scipy.sparse.linalg.gmres(A, b, tol=addSolverParam['min_tol'],x0=xval, maxiter=100)                             
-            if info >0:
-                print("Info: maximum iterations reached for sparse system solver (GMRES).")
-        else:
-            sol = scipy.sparse.linalg.spsolve(A, b)
-            
+    B = _ShiftedJacobian(J00, -step, f, args)
+    b = -B.dot(previousValue-previousPreviousValue) + 2*step*f_yj
+    fe_tot += B.nfev
+    
+    A = _ShiftedJacobian(J00, step, f, args)
+    if(factor is not None):
+        sol = _solveFactored(factor, b)
+    elif(addSolverParam['iterative']):
+        sol, info= _gmres(A, b, xval, addSolverParam, precond)
+        fe_tot += A.nfev
+        if info >0:
+            print("Info: maximum iterations reached for system solver (GMRES).")
     else:
-        A=_calculateMatrix(I,J00,step)
-        if(not addSolverParam['iterative']):
-            sol = np.linalg.solve(A, b)
-        else:
-            sol, info= scipy.sparse.linalg.gmres(A, b, tol=addSolverParam['min_tol'],x0=xval, maxiter=100)    
+        sol = A.solve(b)
             
     x = previousValue + sol
     
     return (x, f_yj, fe_tot, je_tot)
 
 
-def _calculateMatrix(I,J00,step):
+def _gmres(A, b, xval, addSolverParam, precond=None):
+    '''
+    Solves the linear system A x = b with GMRES. If a preconditioner M (see _buildPreconditioner(..)) is given, 
+    the right preconditioned system A M z = b, x = M z, is solved instead, so that the stopping criterion is still 
+    the residual of A x = b (with left preconditioning GMRES checks the preconditioned residual, which is not as 
+    accurate and makes the step size control take too large steps).
+    
+    @param A (_ShiftedJacobian): system matrix, I-step*J00
+    @param b (array): right hand side
+    @param xval (array): initial guess
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+    @param precond (LinearOperator, matrix or None): preconditioner, approximation of the inverse of A
+    
+    @return (sol, info): solution and gmres convergence information (>0 if the maximum iterations were reached)
+    '''
+    _countStat('gmres_solves')
+    if(precond is None):
+        return scipy.sparse.linalg.gmres(A.linearOperator(), b, tol=addSolverParam['min_tol'], x0=xval, maxiter=100,
+                                         callback=_countGmresIteration)
+    M = scipy.sparse.linalg.aslinearoperator(precond)
+    AM = scipy.sparse.linalg.LinearOperator(A.shape, matvec=lambda z: A.dot(M.matvec(z)), dtype=float)
+    #M approximates the inverse of A, so A xval is a good initial guess for z
+    z0 = None if xval is None else A.dot(xval)
+    z, info = scipy.sparse.linalg.gmres(AM, b, tol=addSolverParam['min_tol'], x0=z0, maxiter=100,
+                                        callback=_countGmresIteration)
+    return M.matvec(z), info
+
+class _ShiftedJacobian(object):
+    '''
+    The matrix I-step*J00 of the linear systems of the semi implicit methods (and of the Newton iterations of the
+    midpoint implicit method), represented without building the identity matrix: its products and solves are 
+    delegated to the Jacobian, so that a sparse, banded (see _BandedJacobian), Hessenberg (see _HessenbergJacobian)
+    or matrix-free (see _MatrixFreeJacobian) J00 never needs O(N^2) memory. The products with a dense J00 are done 
+    with the matrix I-step*J00 (built once), as the products (I-step*J00) v were always computed.
+    '''
+    
+    def __init__(self, J00, step, f=None, args=()):
+        '''
+        @param J00 (2D array, sparse matrix, _BandedJacobian, _HessenbergJacobian or _MatrixFreeJacobian): Jacobian
+        @param step (float): step length
+        @param f (callable(y,t,args)): RHS of the ODE, only needed for a _MatrixFreeJacobian
+        @param args (tuple): extra arguments for f
+        '''
+        self.J00 = J00
+        self.step = step
+        self.f = f
+        self.args = args
+        self.shape = J00.shape
+        #RHS evaluations done by the products with a _MatrixFreeJacobian
+        self.nfev = 0
+        #I-step*J00 for the products with a dense J00
+        self._dense = None
+    
+    def dot(self, v):
+        '''
+        @return (array): (I-step*J00) v
+        '''
+        v = np.asarray(v, dtype=float).ravel()
+        if(isinstance(self.J00, _MatrixFreeJacobian)):
+            self.nfev += int(np.any(v))
+            return v - self.step*self.J00.dot(v, self.f, self.args)
+        if(isinstance(self.J00, np.ndarray)):
+            if(self._dense is None):
+                self._dense = self.matrix()
+            return np.dot(self._dense, v)
+        return v - self.step*np.asarray(self.J00.dot(v)).ravel()
+    
+    def linearOperator(self):
+        '''
+        @return (LinearOperator): I-step*J00 for the iterative solvers
+        '''
+        return scipy.sparse.linalg.LinearOperator(self.shape, matvec=self.dot, dtype=float)
+    
+    def matrix(self):
+        '''
+        @return A (2D array or sparse CSC matrix): I-step*J00 (sparse if J00 is sparse or banded), only for dense, 
+                sparse and banded J00
+        '''
+        if(isinstance(self.J00, _BandedJacobian)):
+            return (scipy.sparse.identity(self.shape[0], format='csc') - self.step*self.J00.tosparse()).tocsc()
+        if(scipy.sparse.issparse(self.J00)):
+            return (scipy.sparse.identity(self.shape[0], format='csc') - self.step*self.J00).tocsc()
+        if(isinstance(self.J00, (_MatrixFreeJacobian, _HessenbergJacobian, _BroydenJacobian))):
+            raise TypeError("I-step*J00 can't be built for a " + type(self.J00).__name__)
+        A = -self.step*np.asarray(self.J00, dtype=float)
+        A.flat[::self.shape[0]+1] += 1
+        return A
+    
+    def solve(self, b):
+        '''
+        Solves (I-step*J00) x = b with a direct solver (see _factorMatrix(..) to reuse the factorization).
+        
+        @param b (array): right hand side
+        
+        @return (array): solution
+        '''
+        if(scipy.sparse.issparse(self.J00)):
+            return scipy.sparse.linalg.spsolve(self.matrix(), b)
+        if(isinstance(self.J00, (_BandedJacobian, _HessenbergJacobian, _BroydenJacobian))):
+            return self.J00.factor(self.step).solve(b)
+        return np.linalg.solve(self.matrix(), b)
+
+class _MatrixFreeJacobian(object):
+    '''
+    Jacobian of the RHS at (y, t) that is never formed (Jacobian-free Newton-Krylov): its products with vectors
+    are approximated with directional finite differences, J v = (f(y+eps*v, t)-f(y, t))/eps. Only y and f(y, t)
+    are kept (O(N) memory instead of O(N^2), and no N RHS evaluations to estimate the Jacobian), so it can only be
+    used with the iterative linear solver.
+    
+    It is sent to the workers as J00, and the RHS (already registered in the workers) is bound in the semi 
+    implicit methods, see _ShiftedJacobian.
+    '''
+    
+    def __init__(self, y, t, f_y):
+        self.y = np.array(y, dtype=float)
+        self.t = t
+        self.f_y = np.array(f_y, dtype=float)
+        self.shape = (len(y), len(y))
+        self.scale = np.sqrt(np.finfo(float).eps)*(1 + np.linalg.norm(self.y))
+    
+    def dot(self, v, f, args):
+        '''
+        @param v (array): vector
+        @param f (callable(y,t,args)): RHS of the ODE
+        @param args (tuple): extra arguments for f
+        
+        @return (array): J v (one RHS evaluation)
+        '''
+        normv = np.linalg.norm(v)
+        if(normv == 0):
+            return np.zeros(len(v))
+        eps = self.scale/normv
+        return (f(*(self.y + eps*v, self.t) + args) - self.f_y)/eps
+
+def _factorMatrix(J00, step):
     '''
-    Calculates matrix needed for semi implicit methods.
+    Factors the matrix I-step*J00 of the linear systems solved by the semi implicit methods (LU decomposition), 
+    so that it can be reused by all the inner steps of a stage (they have the same step and J00).
     
-    @param I (2D array): identity matrix
-    @param J00 (2D array): Jacobian matrix
+    @param J00 (2D array, sparse matrix, _BandedJacobian, _HessenbergJacobian or _BroydenJacobian): Jacobian matrix
     @param step (float): step length
     
-    @return I-step*J00 (matrix).
+    @return factor: (lu, piv) from scipy.linalg.lu_factor for dense J00, a _SparseLU object for sparse 
+            J00, a _BandedLU object for a _BandedJacobian or a _HessenbergJacobian or a _WoodburyLU object for
+            a _BroydenJacobian (see _solveFactored(..))
+    '''
+    if(isinstance(J00, (_BandedJacobian, _HessenbergJacobian, _BroydenJacobian))):
+        return J00.factor(step)
+    if(scipy.sparse.issparse(J00)):
+        J00 = scipy.sparse.csc_matrix(J00, copy=True)
+        J00.sum_duplicates()
+        pattern = getattr(_sparsePattern, 'pattern', None)
+        if(pattern is None or not pattern.matches(J00)):
+            pattern = _sparsePattern.pattern = _SparsePattern(J00)
+        return pattern.factor(J00, step)
+    return scipy.linalg.lu_factor(_ShiftedJacobian(J00, step).matrix(), overwrite_a=True, check_finite=False)
+
+#Sparse structure of the last sparse matrix factored by each worker (process or thread), see _SparsePattern
+_sparsePattern = threading.local()
+
+class _SparsePattern(object):
+    '''
+    Structure of the sparse matrices I-step*J00 for a sparsity pattern of J00, which is usually fixed for the whole
+    integration. The structure (CSC indices of the matrix, positions of the J00 and diagonal values) and the 
+    fill-reducing column ordering (computed by SuperLU with COLAMD in the first factorization) are computed once,
+    so that each new factorization only assembles the values and does the numeric factorization of the already
+    ordered matrix (SuperLU doesn't allow to reuse its symbolic factorization, so it is repeated but it is cheap
+    with the matrix already ordered).
     '''
     
-    return I-step*J00
+    def __init__(self, J00):
+        '''
+        @param J00 (sparse CSC matrix): Jacobian matrix (without duplicates and with sorted indices)
+        '''
+        N = J00.shape[0]
+        self.J00indptr = J00.indptr.copy()
+        self.J00indices = J00.indices.copy()
+        #Pattern of I-step*J00 (pattern of J00 plus the diagonal)
+        pattern = scipy.sparse.csc_matrix((np.ones(J00.nnz), J00.indices, J00.indptr), shape=J00.shape)
+        pattern = (pattern + scipy.sparse.identity(N, format='csc')).tocsc()
+        pattern.sort_indices()
+        keys = np.repeat(np.arange(N), np.diff(pattern.indptr))*N + pattern.indices
+        self.J00positions = np.searchsorted(keys, np.repeat(np.arange(N), np.diff(J00.indptr))*N + J00.indices)
+        self.Ipositions = np.searchsorted(keys, np.arange(N)*(N+1))
+        self.indptr = pattern.indptr
+        self.indices = pattern.indices
+        self.shape = J00.shape
+        self.perm = None
+    
+    def matches(self, J00):
+        '''
+        @return (bool): whether J00 has this sparsity pattern
+        '''
+        return (J00.shape == self.shape and np.array_equal(J00.indptr, self.J00indptr) 
+                and np.array_equal(J00.indices, self.J00indices))
+    
+    def factor(self, J00, step):
+        '''
+        Factors I-step*J00 (see _factorMatrix(..)).
+        
+        @param J00 (sparse CSC matrix): Jacobian matrix with this sparsity pattern
+        @param step (float): step length
+        
+        @return (_SparseLU): factorization
+        '''
+        data = np.zeros(len(self.indices), dtype=np.result_type(J00.dtype, float))
+        data[self.J00positions] = -step*J00.data
+        data[self.Ipositions] += 1
+        if(self.perm is None):
+            lu = scipy.sparse.linalg.splu(scipy.sparse.csc_matrix((data, self.indices, self.indptr), shape=self.shape))
+            #Keep the column ordering (perm_c[i] is the new position of column i) and the structure of
+            #the matrix with its columns ordered
+            self.perm = np.argsort(lu.perm_c)
+            lengths = np.diff(self.indptr)[self.perm]
+            self.permIndptr = np.concatenate(([0], np.cumsum(lengths)))
+            self.permGather = (np.arange(self.permIndptr[-1]) - np.repeat(self.permIndptr[:-1], lengths) 
+                               + np.repeat(self.indptr[self.perm], lengths))
+            self.permIndices = self.indices[self.permGather]
+            return _SparseLU(lu, None)
+        permMatrix = scipy.sparse.csc_matrix((data[self.permGather], self.permIndices, self.permIndptr), shape=self.shape)
+        return _SparseLU(scipy.sparse.linalg.splu(permMatrix, permc_spec='NATURAL'), self.perm)
+
+class _SparseLU(object):
+    '''
+    LU factorization of a sparse matrix A, computed (see _SparsePattern) as the factorization of A[:,perm].
+    '''
+    
+    def __init__(self, lu, perm):
+        '''
+        @param lu (SuperLU): factorization of A[:,perm]
+        @param perm (array): column permutation (None if lu is the factorization of A)
+        '''
+        self.lu = lu
+        self.perm = perm
+    
+    def solve(self, b):
+        '''
+        @param b (array): right hand side
+        
+        @return (array): solution of A x = b
+        '''
+        y = self.lu.solve(np.asarray(b).ravel())
+        if(self.perm is None):
+            return y
+        x = np.empty_like(y)
+        x[self.perm] = y
+        return x
+
+class _HessenbergJacobian(object):
+    '''
+    Dense Jacobian reduced to upper Hessenberg form, J00 = Q H Q^T. The reduction is computed once for each Jacobian
+    in the main process (see _getJacobian(..)) and sent to the workers instead of J00. The matrices of all the 
+    stages are then I-step*J00 = Q (I-step*H) Q^T, and I-step*H (banded, with only one subdiagonal) is factored
+    in O(N^2) operations instead of the O(N^3) of the LU factorization of I-step*J00 (see factor(..)).
+    '''
+    
+    def __init__(self, J00):
+        self.H, self.Q = scipy.linalg.hessenberg(np.asarray(J00, dtype=float), calc_q=True, check_finite=False)
+        self.shape = self.H.shape
+    
+    def dot(self, v):
+        '''
+        @return (array): J00 v
+        '''
+        return self.Q.dot(self.H.dot(self.Q.T.dot(v)))
+    
+    def factor(self, step):
+        '''
+        Factors I-step*J00 (see _factorMatrix(..)).
+        
+        @param step (float): step length
+        
+        @return (_BandedLU): factorization
+        '''
+        N = self.shape[0]
+        A = -step*self.H
+        A.flat[::N+1] += 1
+        #LAPACK band storage with 1 subdiagonal and N-1 superdiagonals (A[i,j] is in ab[N+i-j,j],
+        #the first row is used by the factorization)
+        ab = np.zeros((N+2, N), order='F')
+        for j in range(N):
+            m = min(j+2, N)
+            ab[N-j:N-j+m, j] = A[:m, j]
+        lu, piv, info = scipy.linalg.lapack.dgbtrf(ab, 1, N-1, overwrite_ab=1)
+        return _BandedLU(lu, piv, 1, N-1, self.Q)
+
+class _BandedJacobian(object):
+    '''
+    Banded Jacobian with ml subdiagonals and mu superdiagonals, stored in LAPACK band form (as the banded Jacobians
+    of scipy.integrate.odeint): ab[mu+i-j, j] = J00[i, j]. Its products take O(N*(ml+mu+1)) operations and the 
+    matrices I-step*J00 of the stages are factored with banded LU in O(N*ml*(ml+mu+1)) operations (see factor(..)).
+    '''
+    
+    def __init__(self, ab, ml, mu):
+        '''
+        @param ab (2D array, shape (ml+mu+1, N)): Jacobian in band form
+        @param ml, mu (int): lower and upper bandwidths
+        '''
+        self.ab = np.asarray(ab, dtype=float)
+        self.ml = ml
+        self.mu = mu
+        N = self.ab.shape[1]
+        if(self.ab.shape[0] != ml+mu+1):
+            raise ValueError("The banded Jacobian must have shape (ml+mu+1, N) = " + str((ml+mu+1, N)) + 
+                             ", got " + str(self.ab.shape))
+        self.shape = (N, N)
+    
+    def dot(self, v):
+        '''
+        @return (array): J00 v
+        '''
+        v = np.asarray(v, dtype=float).ravel()
+        N = self.shape[0]
+        result = np.zeros(N)
+        for k in range(self.ml+self.mu+1):
+            #Diagonal i-j = k-mu
+            d = k-self.mu
+            if(d >= 0):
+                result[d:] += self.ab[k, :N-d]*v[:N-d]
+            else:
+                result[:N+d] += self.ab[k, -d:]*v[-d:]
+        return result
+    
+    def tosparse(self):
+        '''
+        @return (sparse CSC matrix): J00
+        '''
+        offsets = self.mu - np.arange(self.ml+self.mu+1)
+        return scipy.sparse.dia_matrix((self.ab, offsets), shape=self.shape).tocsc()
+    
+    def factor(self, step):
+        '''
+        Factors I-step*J00 (see _factorMatrix(..)).
+        
+        @param step (float): step length
+        
+        @return (_BandedLU): factorization
+        '''
+        #LAPACK band storage for the factorization (the first ml rows are used for the fill-in)
+        ab = np.zeros((2*self.ml+self.mu+1, self.shape[0]), order='F')
+        ab[self.ml:] = -step*self.ab
+        ab[self.ml+self.mu] += 1
+        lu, piv, info = scipy.linalg.lapack.dgbtrf(ab, self.ml, self.mu, overwrite_ab=1)
+        return _BandedLU(lu, piv, self.ml, self.mu)
+
+class _BandedLU(object):
+    '''
+    LU factorization of a banded matrix A, or of Q A Q^T if the orthogonal matrix Q is given (see _HessenbergJacobian).
+    '''
+    
+    def __init__(self, lu, piv, ml, mu, Q=None):
+        '''
+        @param lu, piv: band LU factorization of A (from LAPACK dgbtrf)
+        @param ml, mu (int): lower and upper bandwidths of A
+        @param Q (2D array): orthogonal matrix of the Hessenberg reduction
+        '''
+        self.lu = lu
+        self.piv = piv
+        self.ml = ml
+        self.mu = mu
+        self.Q = Q
+    
+    def solve(self, b):
+        '''
+        @param b (array): right hand side
+        
+        @return (array): solution of A x = b (or Q A Q^T x = b)
+        '''
+        b = np.asarray(b, dtype=float).ravel()
+        if(self.Q is not None):
+            b = self.Q.T.dot(b)
+        y, info = scipy.linalg.lapack.dgbtrs(self.lu, self.ml, self.mu, b, self.piv)
+        if(self.Q is not None):
+            return self.Q.dot(y)
+        return y
+
+class _BroydenJacobian(object):
+    '''
+    Jacobian estimation updated with Broyden's rank-1 updates (see _updateJ00(..)) instead of being estimated again:
+    J00 = J0 + U V^T, where J0 is the last estimated Jacobian (dense, sparse, _BandedJacobian or _HessenbergJacobian)
+    and each update adds a column to U and V. J0 keeps its structure, so the products cost the ones of J0 plus 
+    O(N*rank) operations, and the factorizations of I-step*J0 (cached with the version of J0, see 
+    _getStageMethodArgs(..)) are updated instead of factoring I-step*J00 again (see factor(..)).
+    '''
+    
+    def __init__(self, J0, J0version, U, V):
+        '''
+        @param J0 (2D array, sparse matrix, _BandedJacobian or _HessenbergJacobian): last estimated Jacobian
+        @param J0version (int): version of J0 (see _setJ00(..))
+        @param U, V (2D arrays, shape (N, rank)): low rank update of J0
+        '''
+        self.J0 = J0
+        self.J0version = J0version
+        self.U = U
+        self.V = V
+        self.shape = J0.shape
+        self.rank = U.shape[1]
+    
+    def dot(self, v):
+        '''
+        @return (array): J00 v
+        '''
+        return np.asarray(self.J0.dot(v)).ravel() + self.U.dot(self.V.T.dot(v))
+    
+    def update(self, u, v):
+        '''
+        @return (_BroydenJacobian): J00 + u v^T
+        '''
+        return _BroydenJacobian(self.J0, self.J0version, np.column_stack((self.U, u)), np.column_stack((self.V, v)))
+    
+    def factor(self, step, factor0=None):
+        '''
+        Factors I-step*J00 (see _factorMatrix(..)) updating the factorization of I-step*J0.
+        
+        @param step (float): step length
+        @param factor0: factorization of I-step*J0 (see _factorMatrix(..)), computed if not given
+        
+        @return (_WoodburyLU): factorization
+        '''
+        if(factor0 is None):
+            factor0 = _factorMatrix(self.J0, step)
+        return _WoodburyLU(factor0, step*self.U, self.V)
+
+class _WoodburyLU(object):
+    '''
+    Factorization of A = A0 - U V^T (U and V of shape (N, rank)) built from the factorization of A0 with the 
+    Sherman-Morrison-Woodbury formula:
+    
+        A^{-1} b = A0^{-1} b + W (I - V^T W)^{-1} V^T A0^{-1} b,   W = A0^{-1} U
+    
+    W takes rank solves with A0, so the factorization is updated in O(N^2*rank) operations for a dense A0 (instead 
+    of the O(N^3) of a new LU factorization) and keeps the cost of the sparse or banded solves for structured A0.
+    '''
+    
+    def __init__(self, factor0, U, V):
+        '''
+        @param factor0: factorization of A0 (see _factorMatrix(..))
+        @param U, V (2D arrays, shape (N, rank)): low rank update
+        '''
+        self.factor0 = factor0
+        self.W = np.column_stack([_solveFactored(factor0, u) for u in U.T])
+        self.V = V
+        self.capacitance = scipy.linalg.lu_factor(np.identity(V.shape[1]) - V.T.dot(self.W), check_finite=False)
+    
+    def solve(self, b):
+        '''
+        @param b (array): right hand side
+        
+        @return (array): solution of A x = b
+        '''
+        x = _solveFactored(self.factor0, b)
+        return x + self.W.dot(scipy.linalg.lu_solve(self.capacitance, self.V.T.dot(x), check_finite=False))
+
+def _solveFactored(factor, b):
+    '''
+    Solves the linear system with the factored matrix (see _factorMatrix(..)).
+    
+    @param factor: factorization of the matrix
+    @param b (array): right hand side
+    
+    @return (array): solution
+    '''
+    if(isinstance(factor, tuple)):
+        return scipy.linalg.lu_solve(factor, b, check_finite=False)
+    return factor.solve(b)
+
+def _countGmresIteration(residual):
+    '''
+    GMRES callback, counts the iterations done ('gmres_iters', see _countStat(..)).
+    '''
+    _countStat('gmres_iters')
 
-def _euler_semiimplicit(f, grad, previousValues, previousTime, f_previousValue,step, args, addSolverParam, J00, I, Isparse):
+def _buildPreconditioner(J00, step, addSolverParam):
+    '''
+    Builds the preconditioner for the GMRES iterations that solve the linear systems of the semi implicit methods,
+    whose matrix is I-step*J00. The preconditioner is chosen with addSolverParam['preconditioner']:
+        - 'ilu': incomplete LU factorization (scipy.sparse.linalg.spilu with addSolverParam['iluDropTol'] and 
+            addSolverParam['iluFillFactor']).
+        - 'jacobi': block Jacobi, inverse of the diagonal blocks of size addSolverParam['jacobiBlockSize'].
+        - 'auto': 'ilu' for sparse Jacobians ('jacobi' if the incomplete factorization fails) and 'jacobi' for
+            dense ones (the incomplete factorization of a dense matrix is almost as expensive as the full one).
+        - callable(A): user supplied, returns the preconditioner (LinearOperator, matrix or sparse matrix) for the 
+            matrix A.
+    
+    @param J00 (2D array or sparse matrix): Jacobian matrix
+    @param step (float): step length
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+    
+    @return M (LinearOperator or matrix): approximation of the inverse of I-step*J00
+    '''
+    preconditioner = addSolverParam['preconditioner']
+    sparse = scipy.sparse.issparse(J00)
+    A = _ShiftedJacobian(J00, step).matrix()
+    if(callable(preconditioner)):
+        return preconditioner(A)
+    auto = preconditioner == 'auto'
+    if(auto):
+        preconditioner = 'ilu' if sparse else 'jacobi'
+    N = A.shape[0]
+    if(preconditioner == 'ilu'):
+        try:
+            ilu = scipy.sparse.linalg.spilu(scipy.sparse.csc_matrix(A), drop_tol=addSolverParam['iluDropTol'],
+                                            fill_factor=addSolverParam['iluFillFactor'])
+            return scipy.sparse.linalg.LinearOperator((N, N), matvec=ilu.solve, dtype=float)
+        except RuntimeError:
+            #Exactly singular factor
+            if(not auto):
+                raise
+            preconditioner = 'jacobi'
+    if(preconditioner == 'jacobi'):
+        blockSize = addSolverParam['jacobiBlockSize']
+        if(blockSize == 1):
+            diagonal = np.asarray(A.diagonal()).ravel()
+            return scipy.sparse.diags(1/diagonal, 0, format='csr')
+        if(sparse):
+            A = scipy.sparse.csr_matrix(A)
+        blocks = [np.linalg.inv(_todense(A[i:i+blockSize, i:i+blockSize])) for i in range(0, N, blockSize)]
+        return scipy.sparse.block_diag(blocks, format='csr')
+    raise ValueError("Unknown preconditioner: " + str(preconditioner))
+
+def _todense(A):
+    '''
+    @return (2D array): dense array with the values of A (array, matrix or sparse matrix)
+    '''
+    return A.toarray() if scipy.sparse.issparse(A) else np.asarray(A)
+
+#Last factorizations computed by each worker (process or thread), see _getStageMethodArgs(..). The entries are
+#keyed by (step, J00version), so they can only be reused while the same Jacobian is kept between steps: every new
+#Jacobian estimation or evaluation gets a new version (see _setJ00(..)). A policy that estimates the Jacobian again
+#in every step (see _JacobianRefresh) makes every lookup miss.
+_factorCache = threading.local()
+
+def _getStageMethodArgs(methodargs, step, addSolverParam, J00version=None):
+    '''
+    Gets the solver method arguments for all the inner steps of a stage. For semi implicit methods solving the
+    linear systems with a direct solver, I-step*J00 is factored once (see _factorMatrix(..)) and used in all the 
+    inner steps and in the smoothing step, which turns O(nj*N^3) work per stage into O(N^3 + nj*N^2).
+    
+    Likewise, when the linear systems are solved iteratively, the preconditioner of I-step*J00 is built once 
+    (see _buildPreconditioner(..)) for all the inner steps of the stage.
+    
+    Each worker keeps its last addSolverParam['factorCache'] factorizations or preconditioners (least recently used
+    are discarded), keyed by (step, J00version), so that when a step is repeated with the same H and Jacobian (fixed
+    step size, smooth regions, frozen Jacobian) they are not computed again. The cache relies on the Jacobian 
+    outliving a step: it only hits when _JacobianRefresh keeps J00 (and thus its version) between steps. 
+    Stages are sent to the same worker as in the previous step when possible (see WorkerPool.map(..) 
+    affinity) to make the most of this cache. The factorizations computed ('nlu') and reused ('lu_hits') and the
+    preconditioners built ('nprec'), their build time ('prec_time') and the ones reused ('prec_hits') are counted
+    (see _countStat(..)).
+    
+    If J00 is a _BroydenJacobian, the factorization or preconditioner of its last estimated Jacobian is the one 
+    computed and cached: the factorization is then updated with the low rank update of the Jacobian (see 
+    _BroydenJacobian.factor(..)) and the preconditioner is used as it is.
+    
+    @param methodargs (dict): solver method arguments (J00 for semi implicit methods and for the midpoint implicit
+            method with Newton iterations)
+    @param step (float): inner step length of the stage, H/nj (the matrix is I-step*addSolverParam['matrixStepFactor']*J00)
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+    @param J00version (int): version of J00 (see _setJ00(..)), None to not use the cache
+    
+    @return methodargs (dict): solver method arguments, with the factorization ('factor') or the preconditioner 
+            ('precond') if needed
+    '''
+    iterative = addSolverParam['iterative']
+    if(methodargs.get('J00') is None or (iterative and addSolverParam.get('preconditioner') is None)):
+        return methodargs
+    #The matrix is I-step*J00 for the semi implicit methods and I-step/2*J00 for the Newton iterations of the
+    #midpoint implicit method
+    step = step*addSolverParam['matrixStepFactor']
+    J00 = methodargs['J00']
+    if(isinstance(J00, _BroydenJacobian)):
+        J00 = J00.J0
+        if(J00version is not None):
+            J00version = methodargs['J00'].J0version
+    cache = getattr(_factorCache, 'cache', None)
+    if(cache is None):
+        cache = _factorCache.cache = collections.OrderedDict()
+    key = (step, J00version)
+    value = cache.pop(key, None) if J00version is not None else None
+    if(value is not None):
+        _countStat('prec_hits' if iterative else 'lu_hits')
+    elif(iterative):
+        start = time.time()
+        value = _buildPreconditioner(J00, step, addSolverParam)
+        _countStat('nprec')
+        _countStat('prec_time', time.time() - start)
+    else:
+        value = _factorMatrix(J00, step)
+        _countStat('nlu')
+    if(J00version is not None and addSolverParam.get('factorCache', 0) > 0):
+        cache[key] = value
+        while(len(cache) > addSolverParam['factorCache']):
+            cache.popitem(last=False)
+    if(iterative):
+        return dict(methodargs, precond=value)
+    if(isinstance(methodargs['J00'], _BroydenJacobian)):
+        value = methodargs['J00'].factor(step, value)
+    return dict(methodargs, factor=value)
+
+def _euler_semiimplicit(f, grad, previousValues, previousTime, f_previousValue,step, args, addSolverParam, J00,
+                        factor=None, precond=None):
     '''
     Calculates solution at previousTime+step doing one step with a euler semiimplicit formula (linearly implicit euler)
     Based on IV.9.25 (ref II).
     
     Takes into account when solving the linearly implicit :
-        -Whether the Jacobian (J00) is sparse or not
+        -Whether the Jacobian (J00) is sparse, dense or matrix-free (see _MatrixFreeJacobian), the products and 
+            solves of I-step*J00 are done by its backend (see _ShiftedJacobian)
         -Whether the linear solver should be iterative (gmres) or exact
+        -Whether the matrix I-step*J00 is already factored (factor, see _factorMatrix(..))
+        -Whether there is a preconditioner for the iterative solver (precond, see _buildPreconditioner(..))
     
     IMPORTANT: changes in this function will be probably also wanted in midpoint_semiimplicit code (beware!).
     '''
@@ -209,36 +1411,34 @@ def _euler_semiimplicit(f, grad, previousValues, previousTime, f_previousValue,s
     
     b=step*f_yj
     
-    #TODO: change this checking of the sparsity type of the matrix only once
-    # at the beginning of the ODE solving 
-    if(scipy.sparse.issparse(J00)):
-        A=_calculateMatrix(Isparse,J00,step)
-        if(addSolverParam['iterative']):
-            #TODO: choose an appropriate maxiter parameter to distribute work between taking more steps and having a
-            #more accurate solution
-            sol, info= scipy.sparse.linalg.gmres(A, b, tol=addSolverParam['min_tol'],x0=xval, maxiter=100)                             
-            if info >0:
-                print("Info: maximum iterations reached for sparse system solver (GMRES).")
-        else:
-            sol = scipy.sparse.linalg.spsolve(A, b)
-            
+    A = _ShiftedJacobian(J00, step, f, args)
+    if(factor is not None):
+        sol = _solveFactored(factor, b)
+    elif(addSolverParam['iterative']):
+        #TODO: choose an appropriate maxiter parameter to distribute work between taking more steps and having a
+        #more accurate solution
+        sol, info= _gmres(A, b, xval, addSolverParam, precond)
+        fe_tot += A.nfev
+        if info >0:
+            print("Info: maximum iterations reached for system solver (GMRES).")
     else:
-        A=_calculateMatrix(I,J00,step)
-        if(not addSolverParam['iterative']):
-            sol = np.linalg.solve(A, b)
-        else:
-            sol, info= scipy.sparse.linalg.gmres(A, b, tol=addSolverParam['min_tol'],x0=xval, maxiter=100)                             
+        sol = A.solve(b)
     
     x = previousValue + sol
 
     return (x, f_yj, fe_tot, je_tot)
 
 
-def _midpoint_implicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam):
+def _midpoint_implicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam, J00=None,
+                       factor=None):
     '''
     Calculates solution at previousTime+step doing one step with a midpoint implicit
     Based on IV.9.2 (ref II).
     
+    If factor (the factorization of I-step/2*J00, see _getStageMethodArgs(..)) is given, the nonlinear system is
+    solved with simplified Newton iterations (see _solve_newton(..)), otherwise with scipy's fsolve 
+    (see _solve_implicit_step(..)).
+    
     '''
     previousPreviousValue, previousValue = previousValues
     
@@ -246,7 +1446,10 @@ def _midpoint_implicit(f, grad, previousValues, previousTime,f_previousValue, st
         return x-previousValue-step*f(*((previousValue+x)/2, previousTime+step/2) + args)
     
     def zero_grad(x):
-        return np.matrix(np.identity(len(x), dtype=float) - step*grad(x,previousTime+step/2))
+        J = grad(*(x, previousTime+step/2) + args)
+        if(addSolverParam['ml'] is not None):
+            J = _BandedJacobian(J, addSolverParam['ml'], addSolverParam['mu']).tosparse().toarray()
+        return np.matrix(np.identity(len(x), dtype=float) - step*J)
 
     
     if(grad is None):
@@ -259,15 +1462,82 @@ def _midpoint_implicit(f, grad, previousValues, previousTime,f_previousValue, st
     else:
         #Estimation of the value as the starting point for the zero solver 
         estimatedValue, f_yj, fe_tot, je_tot=_euler_explicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam)
-        
-    x, fe_tot_, je_tot_ = _solve_implicit_step(zero_func, zero_grad, estimatedValue, addSolverParam)
-    fe_tot +=fe_tot_
-    je_tot += je_tot_
     
-    f_yj= f(*(previousValue,previousTime)+args)
-    fe_tot += 1
+    if(factor is not None):
+        if(not addSolverParam['initialGuess'] and previousPreviousValue is not None):
+            #Linear extrapolation of the previous inner steps (the explicit estimation is usually 
+            #too far from the solution for stiff problems)
+            estimatedValue = 2*previousValue - previousPreviousValue
+        x, fe_tot_, converged = _solve_newton(zero_func, factor, estimatedValue, addSolverParam)
+        fe_tot += fe_tot_
+        if(not converged):
+            #The Jacobian is too far from the actual one, solve it without it
+            x, fe_tot_, je_tot_ = _solve_implicit_step(zero_func, zero_grad, estimatedValue, addSolverParam)
+            fe_tot += fe_tot_
+            je_tot += je_tot_
+    else:
+        x, fe_tot_, je_tot_ = _solve_implicit_step(zero_func, zero_grad, estimatedValue, addSolverParam)
+        fe_tot +=fe_tot_
+        je_tot += je_tot_
+    
+    if(f_previousValue is None):
+        f_yj= f(*(previousValue,previousTime)+args)
+        fe_tot += 1
+    else:
+        f_yj = f_previousValue
     return (x, f_yj, fe_tot, je_tot)
 
+def _solve_newton(zero_f, factor, estimatedValue, addSolverParam):
+    '''
+    Finds the root of zero_f with simplified Newton iterations: the Jacobian of zero_f is approximated by the
+    factored matrix (I-step/2*J00 for the midpoint implicit method, J00 being the Jacobian at the beginning of 
+    the step) in all the iterations. The iterations stop when the estimated error of the solution, 
+    theta/(1-theta)*||dx|| (theta is the convergence rate, see IV.8 ref II), or ||dx|| in the first iteration, 
+    is below addSolverParam['newtonTol'] in the error norm of the solver (see _error_norm(..)). They are stopped
+    as soon as the convergence rate shows that they won't converge in addSolverParam['newtonMaxIter'] iterations.
+    The solves ('newton_solves'), the sum of their last convergence rates ('newton_rate') and the failed solves 
+    ('newton_fails') are counted (see _countStat(..)) to decide when the Jacobian is estimated again (see
+    _JacobianRefresh).
+    
+    @param zero_f (callable zero_f(x)): function to find the root of
+    @param factor: factorization of the approximate Jacobian of zero_f (see _solveFactored(..))
+    @param estimatedValue (array): initial value of the iterations
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+            Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
+    
+    @return (x, fe_tot, converged):
+        @return x (array): root of zero_f
+        @return fe_tot (int): number of function evaluations done (one per iteration)
+        @return converged (bool): False if the iterations diverge or don't converge in 
+                addSolverParam['newtonMaxIter'] iterations
+    '''
+    atol, rtol, tol = addSolverParam['atol'], addSolverParam['rtol'], addSolverParam['newtonTol']
+    x = np.array(estimatedValue, dtype=float)
+    previousNorm = None
+    for iteration in range(addSolverParam['newtonMaxIter']):
+        dx = _solveFactored(factor, -zero_f(x))
+        xNew = x + dx
+        norm = _error_norm(xNew, x, atol, rtol)
+        x = xNew
+        if(previousNorm is None):
+            error = norm
+            theta = 0
+        else:
+            theta = norm/previousNorm
+            #Stop if the iterations diverge or are too slow to converge in the remaining iterations
+            remaining = addSolverParam['newtonMaxIter'] - iteration - 1
+            if(theta >= 1 or theta**remaining/(1-theta)*norm > tol):
+                _countStat('newton_fails')
+                return (x, iteration+1, False)
+            error = theta/(1-theta)*norm
+        if(error <= tol):
+            _countStat('newton_solves')
+            _countStat('newton_rate', theta)
+            return (x, iteration+1, True)
+        previousNorm = norm
+    _countStat('newton_fails')
+    return (x, addSolverParam['newtonMaxIter'], False)
+
 
 def _midpoint_explicit(f, grad, previousValues, previousTime,f_previousValue, step, args, addSolverParam):
     '''
@@ -307,81 +1577,178 @@ def _euler_explicit(f, grad, previousValues, previousTime,f_previousValue, step,
 END BLOCK 1: ODE numerical methods formulas (explicit, implicit and semi-implicit)
 '''''
 
-def _compute_stages((method, methodargs, func, grad, tn, yn, f_yn, args, h, k_nj_lst, smoothing, addSolverParam)):
+#Counters of the stage that each worker (process or thread) is computing, see _countStat(..)
+_stageStats = threading.local()
+
+def _countStat(name, value=1):
+    '''
+    Adds value to the counter name of the stage that the calling worker is computing. The counters of every
+    stage are sent back to the main process and added up in the solver's infodict (see _compute_stages(..)),
+    so that any function called while computing a stage can report the work done.
+    
+    @param name (string): name of the counter
+    @param value (number): value to add
+    '''
+    stats = getattr(_stageStats, 'stats', None)
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+def _addStats(total, stats):
+    '''
+    Adds the counters in stats to the counters in total (see _countStat(..)).
+    '''
+    for name in stats:
+        total[name] = total.get(name, 0) + stats[name]
+
+def _compute_stages((problemRef, tn, yn, f_yn, h, J00, J00version, k_nj_lst, shared)):
     '''
     Compute extrapolation tableau values with the order specified and number of steps specified in k_nj_lst.
     It calculates the T_{k,1} values for the k's in k_nj_lst.  
     
     Based on II.9.2 (Definition of the Method ref I)
     
-    @param method: ODE solver method to solve one step (midpoint,euler/implicit,semiimplicit,explicit)
-    @param methodargs: extra arguments to be passed to the solver method
-    @param func (callable func(y,t,args)): derivative of u(t) (ODE RHS, f(u,t))
-    @param grad (callable grad(y,t,args)): Jacobian of f.
+    @param problemRef: reference to the problem definition (see _registerProblem(..)), that is a tuple with:
+        @param method: ODE solver method to solve one step (midpoint,euler/implicit,semiimplicit,explicit)
+        @param methodargs: extra arguments to be passed to the solver method
+        @param func (callable func(y,t,args)): derivative of u(t) (ODE RHS, f(u,t))
+        @param grad (callable grad(y,t,args)): Jacobian of f.
+        @param args (tuple): extra arguments for func
+        @param smoothing (string): specifies if a smoothing step should be performed:
+            -'no': no smoothing step performed
+            -'gbs': three point smoothing step (based on GBS method), II.9.13c ref I and IV.9.9 ref II.
+            -'semiimp': two point smoothing step (for semiimplicit midpoint), IV.9.16c ref II.
+        @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+            Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
     @param tn (float): initial time
     @param yn (array): solution value at tn
     @param f_yn (array): function evaluation (func) at yn,tn
-    @param args (tuple): extra arguments for func
     @param h (float): big step to take to obtain T_{k,1}
+    @param J00 (2D array): Jacobian estimation at yn,tn for semi-implicit methods (None otherwise), 
+        it replaces methodargs['J00']
+    @param J00version (int): version of J00, it only changes when J00 changes (see _setJ00(..)). It is used to
+        reuse the factorizations of previous steps (see _getStageMethodArgs(..))
     @param k_nj_lst (array of 2-tuples): array with (k,nj) pairs indicating which y_{h_j}(tn+h) are calculated  
-    @param smoothing (string): specifies if a smoothing step should be performed:
-        -'no': no smoothing step performed
-        -'gbs': three point smoothing step (based on GBS method), II.9.13c ref I and IV.9.9 ref II.
-        -'semiimp': two point smoothing step (for semiimplicit midpoint), IV.9.16c ref II.
-    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
-        Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
+    @param shared (2-tuple): (descriptor, layout) where descriptor describes the shared block (see SharedBuffer)
+        and layout is a dictionary with, for each k, the rows of the block assigned to the stage and which 
+        intermediate solutions and function evaluations are needed by the main process (see _getStageLayout(..)).
+    
+    T_{k,1} and the needed intermediate solutions (Y) and function evaluations (f_yj) are written in the shared block,
+    so that only small metadata is returned (and pickled back to the main process).
     
     @return list of tuples. Each value is represents all information regarding one value of the extrapolation tableau
     first column of values T_{k,1}. the list contains:
         @return k: order of T
         @return nj: number of steps to calculate T
-        @return Tj1: T_{k,1}
-        @return y_half (array): intermediate solution at half the interval to T (for symmetric interpolation)
-        @return f_yj (array of arrays(f_yj)): all function evaluations done at intermediate solution points (for symmetric interpolation)
-        @return Y (array of arrays(yj)): all intermediate solution points (yj) calculated to obtain T (for non-symmetric interpolation)
         @return fe_tot (int): number of total function evaluations done to calculate this T
         @return je_tot (int): number of total jacobian evaluations done to calculate this T
+        @return nsteps (int): number of calls to the solver method (inner steps plus smoothing step), each one
+                with one linear (semi implicit) or nonlinear (implicit) system solve
+        @return elapsed (float): wall time (in seconds) taken to calculate this T (see StageCostModel)
+        @return stats (dict): counters of the work done to calculate this T (see _countStat(..))
     '''
+    method, methodargs, func, grad, args, smoothing, addSolverParam = _getProblem(problemRef)
+    if J00 is not None:
+        methodargs = dict(methodargs, J00=J00)
+        methodargs.pop('J00version', None)
+    descriptor, layout = shared
+    sharedArray = _getSharedArray(descriptor)
     res = []
     for (k,nj) in k_nj_lst:
+        start = time.time()
+        _stageStats.stats = {}
         fe_tot=0
         je_tot=0
         nj = int(nj)
-        Y = np.zeros((nj+1, len(yn)), dtype=(type(yn[0])))
-        f_yj = np.zeros((nj+1, len(yn)), dtype=(type(yn[0])))
+        workspace = _getWorkspace(2*(nj+1), len(yn), type(yn[0]))
+        Y = workspace[:nj+1]
+        f_yj = workspace[nj+1:]
         Y[0] = yn
+        #The last function evaluation is not computed here (it is computed if needed for interpolation)
+        f_yj[nj] = 0
         step = h/nj
+        stageargs = _getStageMethodArgs(methodargs, step, addSolverParam, J00version)
 
-        Y[1], f_yj[0], fe_tot_, je_tot_ = method(func, grad, (None, Y[0]), tn, f_yn, step, args, addSolverParam, **methodargs)
+        Y[1], f_yj[0], fe_tot_, je_tot_ = method(func, grad, (None, Y[0]), tn, f_yn, step, args, addSolverParam, **stageargs)
         fe_tot += fe_tot_
         je_tot += je_tot_
         for j in range(2,nj+1):
-            Y[j], f_yj[j-1], fe_tot_ , je_tot_= method(func, grad, (Y[j-2], Y[j-1]), tn + (j-1)*(h/nj), None, step, args, addSolverParam, **methodargs)
+            Y[j], f_yj[j-1], fe_tot_ , je_tot_= method(func, grad, (Y[j-2], Y[j-1]), tn + (j-1)*(h/nj), None, step, args, addSolverParam, **stageargs)
             fe_tot += fe_tot_
             je_tot += je_tot_
         
-        #TODO: this y_half value is already returned inside Y, remove and when needed (interpolation) extract form Y
-        y_half = Y[nj/2]
-        
         #Perform smoothing step
         Tj1 = Y[nj]
         if(not smoothing == 'no'):
             #TODO: this f_yj_unused can be used in the case of interpolation, it should be adequately saved in
             #f_yj so function evaluations are not repeated.
-            nextStepSolution, f_yj_unused, fe_tot_, je_tot_ = method(func, grad, (Y[nj-1], Y[nj]), tn + h, None, step, args, addSolverParam, **methodargs)
+            nextStepSolution, f_yj_unused, fe_tot_, je_tot_ = method(func, grad, (Y[nj-1], Y[nj]), tn + h, None, step, args, addSolverParam, **stageargs)
             fe_tot += fe_tot_
             je_tot += je_tot_
             if(smoothing == 'gbs'):
                 Tj1 = 1/4*(Y[nj-1]+2*Y[nj]+nextStepSolution)
             elif(smoothing == 'semiimp'):
                 Tj1 = 1/2*(Y[nj-1]+nextStepSolution)
-        res += [(k, nj, Tj1, y_half, f_yj,Y, fe_tot, je_tot)]
+        
+        #Only write in the shared block the data that the main process needs
+        (y_lo, y_hi), (f_lo, f_hi) = layout[k][1:]
+        Y_rows, f_yj_rows, Tj1_row = _getStageRows(sharedArray, layout[k])
+        Y_rows[:] = Y[y_lo:y_hi]
+        f_yj_rows[:] = f_yj[f_lo:f_hi]
+        Tj1_row[:] = Tj1
+        nsteps = nj if smoothing == 'no' else nj+1
+        stats, _stageStats.stats = _stageStats.stats, None
+        res += [(k, nj, fe_tot, je_tot, nsteps, time.time() - start, stats)]
 
     return res
 
+def _getStageLayout(k, nj, dense, symmetric):
+    '''
+    Chooses which intermediate solutions (Y) and function evaluations (f_yj) of the stage (k, nj) are needed
+    by the main process in this step (so that the workers only send back that data, see _compute_stages):
+        - if dense output is not needed: none of them (only T_{k,1} is used).
+        - if dense output is needed and the method is symmetric: the solution at half the interval, Y[nj/2], and
+            all f_yj (the centered differences of _centered_finite_diff(..) go up to order 2k-1 around nj/2, which
+            with the dense output sequence {2,6,10...} covers all the interval).
+        - if dense output is needed and the method is non symmetric: the k last intermediate solutions (used by
+            the backward differences of _backward_finite_diff(..)).
+    
+    @param k (int): stage index (T_{k,1})
+    @param nj (int): number of steps of the stage
+    @param dense (bool): whether dense output is needed in this step
+    @param symmetric (bool): whether the method used is symmetric
+    
+    @return (Y_rows, f_yj_rows):
+        @return Y_rows (2-tuple): range (first, last+1) of the needed rows of Y
+        @return f_yj_rows (2-tuple): range (first, last+1) of the needed rows of f_yj
+    '''
+    if not dense:
+        return ((0, 0), (0, 0))
+    if symmetric:
+        return ((nj//2, nj//2+1), (0, nj+1))
+    return ((nj+1-k, nj+1), (0, 0))
+
+def _getStageRows(sharedArray, stageLayout):
+    '''
+    Gets the views of the shared array where the results of a stage are stored (see _compute_stages).
+    
+    @param sharedArray (2D array): shared block
+    @param stageLayout (3-tuple): (offset, Y_rows, f_yj_rows) with the first row of the block assigned to the stage
+            and the ranges of Y and f_yj that are stored (see _getStageLayout(..))
+    
+    @return (Y, f_yj, Tj1):
+        @return Y (2D array): rows for the needed intermediate solutions
+        @return f_yj (2D array): rows for the needed function evaluations
+        @return Tj1 (array): row for T_{k,1}
+    '''
+    offset, (y_lo, y_hi), (f_lo, f_hi) = stageLayout
+    f_offset = offset + y_hi - y_lo
+    Tj1_offset = f_offset + f_hi - f_lo
+    return (sharedArray[offset:f_offset], sharedArray[f_offset:Tj1_offset], sharedArray[Tj1_offset])
+
 def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), full_output=False,
         rtol=1.0e-8, atol=1.0e-8, h0=0.5, mxstep=10e4, robustness_factor=2, p=4,
-        nworkers=None, smoothing='no', symmetric=True, seq=None, adaptative="order", addSolverParam={}):   
+        nworkers=None, smoothing='no', symmetric=True, seq=None, adaptative="order", addSolverParam={}, pool=None,
+        parallel='auto', schedule='static'):   
     '''
     Solves the system of IVPs dy/dt = func(y, t0, ...) with parallel extrapolation. 
     
@@ -393,7 +1760,9 @@ def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), fu
     @param y0 (array): initial condition on y (can be a vector).
     @param t (array): a sequence of time points for which to solve for y. The initial value point should be the first 
             element of this sequence. And the last one the final time.
-    @param args (tuple): extra arguments to pass to function.
+    @param args (tuple): extra arguments to pass to func and grad. They are sent to the workers once per call with
+            the problem (see _registerProblem(..)), so the data of the problem (e.g. large read-only matrices) should
+            be passed here: the worker processes only see module globals as they were when the pool was started.
     @param full_output (bool): true if user wants a dictionary of optional outputs as the second output.
     @param rtol, atol (float): the input parameters rtol (relative tolerance) and atol (absolute tolerance)
             determine the error control performed by the solver. See  function _error_norm(y1, y2, atol, rtol).
@@ -411,12 +1780,27 @@ def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), fu
         -'semiimp': two point smoothing step (for semiimplicit midpoint), IV.9.16c ref II. 
     @param symmetric (bool): whether the method to solve one step is symmetric (midpoint/trapezoidal)
             or non-symmetric (euler).
-    @param seq (callable(i), int i>=1): the step-number sequence (examples II.9.1 , 9.6, 9.35 ref I).
+    @param seq (StepSequence or callable(i), int i>=1): the step-number sequence (examples II.9.1 , 9.6, 9.35 ref I),
+            see StepSequence.
     @param adaptive (string): specifies the strategy of integration. Can take three values:
         - "fixed" = use fixed step size and order strategy.
         - "order" or any other string = use adaptive step size and adaptive order strategy (recommended).
     @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
             Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
+    @param pool (WorkerPool or concurrent.futures executor): pool of workers to use. If None, the default pool 
+            (see worker_pool(..)) is used or, if there isn't one, a new pool with nworkers processes is created 
+            (and closed) in this call.
+    @param parallel (bool or string): whether the stages are computed in parallel (True), serially in this process 
+            (False), or 'auto': the first step is computed serially and the rest in parallel only if the time saved
+            by parallelizing would be larger than the overhead of sending the jobs to the workers (see 
+            _parallelPaysOff(..)), otherwise no pool is used at all (recommended, tiny systems are faster serially).
+    @param schedule (string): how the stages of each step are distributed between the workers:
+        - 'static': fixed split with the same sum of inner steps for every worker (recommended for explicit methods).
+        - 'dynamic': stages are sent largest first to the first worker that is free (better when the cost per inner
+            step changes between stages, as with iterative linear solvers in semi implicit methods).
+        - 'feedback' (or a StageCostModel to reuse between calls): the stages are split between the workers with a 
+            cost model fitted with the timings measured in the previous steps (see StageCostModel).
+        See _balance_load(..).
 
     @return: 
         @return ys (2D-array, shape (len(t), len(y0))): array containing the value of y for each desired time in t, with 
@@ -426,23 +1810,45 @@ def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), fu
             'fe_seq'    cumulative number of sequential derivative evaluations
             'nfe'       cumulative number of total derivative evaluations
             'nst'       cumulative number of successful time steps
+            'nrej'      cumulative number of rejected time steps
             'nje'       cumulative number of either Jacobian evaluations (when 
                         analytic Jacobian is provided) or Jacobian estimations
                         (when no analytic Jacobian is provided)
             'h_avg'     average step size
             'k_avg'     average extrapolation order
+            'parallel'  whether the stages were computed in parallel (True) or serially (False)
+            'idle_time' cumulative time (in seconds) that each worker has been idle while the stages were 
+                        computed (None if the pool doesn't report it, see WorkerPool.map(..))
+            'nlu'       number of LU factorizations computed (semi implicit methods with direct solver)
+            'lu_hits'   number of LU factorizations reused from previous steps (see _getStageMethodArgs(..))
+            'lu_hit_rate' lu_hits/(nlu+lu_hits)
+            'gmres_iters' number of GMRES iterations (semi implicit methods with iterative solver)
+            'nprec'     number of preconditioners built for GMRES (see _buildPreconditioner(..))
+            'prec_hits' number of preconditioners reused from previous steps
+            'prec_time' time (in seconds) spent building preconditioners (added up over all the workers)
 
     '''
     
-    #Initialize pool of workers to parallelize extrapolation table calculations
-    set_NUM_WORKERS(nworkers)  
-    pool = mp.Pool(NUM_WORKERS)
-
-    
     assert len(t) > 1, ("the array t must be of length at least 2, " + 
     "the initial value time should be the first element of t and the last " +
     "element of t the final time")
 
+    if(schedule == 'feedback'):
+        schedule = StageCostModel()
+
+    #Get pool of workers to parallelize extrapolation table calculations (in 'auto' mode the
+    #first step is computed serially to decide whether parallelism pays off)
+    userPool = pool
+    if(parallel is True):
+        pool, ownPool = _getPool(userPool, nworkers)
+    else:
+        pool, ownPool = _getSerialPool(userPool, nworkers)
+    #Memory shared with the workers to return the stage results
+    sharedBuffer = SharedBuffer(local=isinstance(pool, SerialPool))
+    #Send the problem definition (which doesn't change between steps) only once to the workers
+    problem = (method, methodargs, func, grad, args, smoothing, addSolverParam)
+    problemRef = _registerProblem(pool, problem)
+
     # ys contains the solutions at the times specified by t
     ys = np.zeros((len(t), len(y0)), dtype=(type(y0[0])))
     ys[0] = y0
@@ -453,6 +1859,7 @@ def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), fu
     fe_tot = 0
     je_tot = 0
     nstp = 0
+    nrej = 0
     cur_stp = 0
 
     t_max = t[-1]
@@ -463,90 +1870,217 @@ def __extrapolation_parallel (method, methodargs, func, grad, y0, t, args=(), fu
     h = min(h0, t_max-t0)
 
     sum_ks, sum_hs = 0, 0
+    idle_time = None
+    stats = {}
     
-    #Initialize rejectStep so that Jacobian is updated
-    rejectStep = True
+    #Initialize refreshJacobian so that the Jacobian is estimated in the first step
+    refreshJacobian = True
+    jacobianRefresh = _JacobianRefresh(addSolverParam)
     previousStepSolution=()
 
-    #Iterate until you reach final time
-    while t_curr < t_max:
-        rejectStep, y_temp, ysolution,f_yn, h, k, h_new, k_new, (fe_seq_, fe_tot_, je_tot_) = _solve_one_step(
-                method, methodargs, func, grad, t_curr, t, t_index, yn, args, h, k, 
-                atol, rtol, pool, smoothing, symmetric, seq, adaptative, rejectStep, previousStepSolution,addSolverParam)
-        #previousStepSolution is used for Jacobian updating
-        previousStepSolution=(yn,f_yn)
-
-        #Store values if step is not rejected
-        if(not rejectStep):
-            yn = 1*y_temp
-            #ysolution includes all intermediate solutions in interval
-            if(len(ysolution)!=0):
-                ys[t_index:(t_index+len(ysolution))] = ysolution
+    try:
+        #Iterate until you reach final time
+        while t_curr < t_max:
+            rejectStep, y_temp, ysolution,f_yn, h, k, h_new, k_new, (fe_seq_, fe_tot_, je_tot_, stats_) = _solve_one_step(
+                    method, methodargs, func, grad, t_curr, t, t_index, yn, args, h, k, 
+                    atol, rtol, pool, sharedBuffer, problemRef, smoothing, symmetric, seq, adaptative, schedule, refreshJacobian, previousStepSolution,
+                    addSolverParam)
+            #previousStepSolution is used for Jacobian updating
+            previousStepSolution=(yn,f_yn)
             
-            #Update time
-            t_curr += h
-            t_index += len(ysolution)
-            #add last solution if matches an asked time (in t)
-            if(t[t_index]==t_curr):
-                ys[t_index] = yn
-                t_index+=1
-
-        #Update function evaluations
-        fe_seq += fe_seq_
-        fe_tot += fe_tot_
-        je_tot += je_tot_
+            lastIdleTimes = getattr(pool, 'lastIdleTimes', None)
+            if(lastIdleTimes is not None):
+                idle_time = np.array(lastIdleTimes) + (0 if idle_time is None else idle_time)
+            
+            #Decide (only once, after the first step) whether to go on serially or in parallel
+            if(parallel == 'auto'):
+                parallel = _parallelPaysOff(pool.lastMapTime, userPool, yn)
+                if(parallel):
+                    pool, ownPool = _getPool(userPool, nworkers)
+                    if(ownPool):
+                        _measureDispatchOverhead(pool, yn)
+                    problemRef = _registerProblem(pool, problem)
+                    sharedBuffer.close()
+                    sharedBuffer = SharedBuffer()
+
+            #Store values if step is not rejected
+            if(not rejectStep):
+                yn = 1*y_temp
+                #ysolution includes all intermediate solutions in interval
+                if(len(ysolution)!=0):
+                    ys[t_index:(t_index+len(ysolution))] = ysolution
+            
+                #Update time
+                t_curr += h
+                t_index += len(ysolution)
+                #add last solution if matches an asked time (in t)
+                if(t[t_index]==t_curr):
+                    ys[t_index] = yn
+                    t_index+=1
+            else:
+                nrej += 1
 
-        sum_ks += k
-        sum_hs += h
-        nstp += 1
-        cur_stp += 1
+            #Update function evaluations
+            fe_seq += fe_seq_
+            fe_tot += fe_tot_
+            je_tot += je_tot_
+            _addStats(stats, stats_)
+            refreshJacobian = jacobianRefresh.refresh(rejectStep, k, k_new, stats_)
 
-        if cur_stp > mxstep:
-            raise Exception('Reached Max Number of Steps. Current t = ' 
-                + str(t_curr))
+            sum_ks += k
+            sum_hs += h
+            nstp += 1
+            cur_stp += 1
+
+            if cur_stp > mxstep:
+                raise Exception('Reached Max Number of Steps. Current t = ' 
+                    + str(t_curr))
         
-        #Sometimes step can be NaN due to overflows of the RHS 
-        if(math.isnan(h_new)):
-            h_new = h/robustness_factor
-        #Update to new step (limit the change of h_new by a robustness_factor)
-        elif(h_new>h and h_new/h>robustness_factor):
-            h_new = h*robustness_factor
-        elif(h_new<h and h_new/h<1/robustness_factor):
-            h_new = h/robustness_factor
-        #Check that h_new doesn't step after t_max
-        h = min(h_new, t_max - t_curr)
-        #Keeps the code from taking a close to machine precision step
-        if (adaptative=="fixed" and (t_max-(t_curr+h))/t_max<1e-12):
-            h=t_max-t_curr
+            #Sometimes step can be NaN due to overflows of the RHS 
+            if(math.isnan(h_new)):
+                h_new = h/robustness_factor
+            #Update to new step (limit the change of h_new by a robustness_factor)
+            elif(h_new>h and h_new/h>robustness_factor):
+                h_new = h*robustness_factor
+            elif(h_new<h and h_new/h<1/robustness_factor):
+                h_new = h/robustness_factor
+            #Check that h_new doesn't step after t_max
+            h = min(h_new, t_max - t_curr)
+            #Keeps the code from taking a close to machine precision step
+            if (adaptative=="fixed" and (t_max-(t_curr+h))/t_max<1e-12):
+                h=t_max-t_curr
             
-        k = k_new
+            k = k_new
 
-    #Close pool of workers and return results
-    pool.close()
+    finally:
+        _releaseProblem(pool, problemRef)
+        sharedBuffer.close()
+        #Close pool of workers (only if it was created for this call)
+        if ownPool:
+            pool.close()
 
     if full_output:
-        infodict = {'fe_seq': fe_seq, 'nfe': fe_tot, 'nst': nstp, 'nje': je_tot,
-                    'h_avg': sum_hs/nstp, 'k_avg': sum_ks/nstp}
+        infodict = {'fe_seq': fe_seq, 'nfe': fe_tot, 'nst': nstp, 'nrej': nrej, 'nje': je_tot,
+                    'h_avg': sum_hs/nstp, 'k_avg': sum_ks/nstp, 'parallel': not isinstance(pool, SerialPool),
+                    'idle_time': idle_time, 'nlu': stats.get('nlu', 0), 'lu_hits': stats.get('lu_hits', 0),
+                    'gmres_iters': stats.get('gmres_iters', 0), 'nprec': stats.get('nprec', 0),
+                    'prec_hits': stats.get('prec_hits', 0), 'prec_time': stats.get('prec_time', 0)}
+        nfactor = infodict['nlu'] + infodict['lu_hits']
+        infodict['lu_hit_rate'] = infodict['lu_hits']/nfactor if nfactor > 0 else 0
         return (ys, infodict)
     else:
         return ys
 
-def _balance_load(k, seq=(lambda t: 2*t)):
+class StageCostModel(object):
+    '''
+    Cost model of the stages (each T_{j,1} computation) of a problem, fitted with the measured wall time of the 
+    stages computed so far (feedback load balancing, see _balance_load(..)). The time of a stage is modelled as
+    
+        elapsed = c_f*fe + c_j*je + c_s*nsteps
+    
+    where fe, je and nsteps are the RHS evaluations, Jacobian evaluations and calls to the solver method of the
+    stage, so c_f is the RHS cost, c_j the Jacobian cost and c_s the cost of the linear (semi implicit) or nonlinear
+    (implicit) solve done in each call (plus the overhead per inner step). The coefficients are fitted with 
+    nonnegative least squares over the last measured stages, and the work of each stage (fe, je and nsteps per inner
+    step) is taken from its last measure. Thus the model follows the changes of cost between stages and along the 
+    integration (for example, iterative solvers needing more iterations with larger inner steps).
+    
+    The same model can be passed (schedule parameter) to several solver calls of the same problem.
+    '''
+    
+    def __init__(self, window=100):
+        '''
+        @param window (int): number of last measured stages used to fit the model
+        '''
+        self.window = window
+        self._features = []
+        self._times = []
+        self._work = {}
+        self._coefficients = None
+    
+    def record(self, k, nj, fe, je, nsteps, elapsed):
+        '''
+        Adds the measure of one stage to the model.
+        
+        @param k (int): stage (T_{k,1})
+        @param nj (int): number of inner steps of the stage
+        @param fe (int): number of RHS evaluations done
+        @param je (int): number of Jacobian evaluations done
+        @param nsteps (int): number of calls to the solver method
+        @param elapsed (float): wall time (in seconds) taken to compute the stage
+        '''
+        self._features.append((fe, je, nsteps))
+        self._times.append(elapsed)
+        del self._features[:-self.window]
+        del self._times[:-self.window]
+        self._work[k] = (fe/nj, je/nj, nsteps/nj)
+        self._coefficients = None
+    
+    def coefficients(self):
+        '''
+        @return (array): fitted (c_f, c_j, c_s) coefficients in seconds, None if there are not enough measures
+        '''
+        if self._coefficients is None and len(self._times) >= 3:
+            self._coefficients = optimize.nnls(np.array(self._features, dtype=float), np.array(self._times))[0]
+        return self._coefficients
+    
+    def cost(self, k, nj):
+        '''
+        Predicts the cost of a stage. If the stage hasn't been measured yet, the average work per inner step of 
+        the measured stages is used. If the model can't be fitted yet, the cost is nj (as static scheduling assumes).
+        
+        @param k (int): stage (T_{k,1})
+        @param nj (int): number of inner steps of the stage
+        
+        @return (float): predicted cost
+        '''
+        coefficients = self.coefficients()
+        if coefficients is None or not coefficients.any():
+            return nj
+        work = self._work.get(k)
+        if work is None:
+            work = np.mean(self._work.values(), axis=0)
+        return nj*np.dot(coefficients, work)
+
+def _balance_load(k, seq=(lambda t: 2*t), schedule='static'):
     '''
     Distributes the work load for the different processors. The tasks to be parallelized are the calculation
-    of each T_{j,1} for j=1...k. As the number of steps (and thus the work load) is determined for each j (seq(j))
-    load balancing is better to be fixed than dynamically distributed.
+    of each T_{j,1} for j=1...k. 
     
-    Each processor is given a list of 2-tuples (k,nj) so that the sum of nj's (work loads) is equal (or with a 
-    minimized difference) between all processors.
+    With static scheduling each processor is given a list of 2-tuples (k,nj) so that the sum of nj's (work loads) 
+    is equal (or with a minimized difference) between all processors. This assumes that the cost of each T_{j,1}
+    is proportional to nj, which is true for explicit methods.
+    
+    With dynamic scheduling each T_{j,1} is a job on its own and the jobs are sorted largest first (by nj), so that
+    the pool sends each one to the first worker that is free (see WorkerPool.map(..)). This balances the load
+    when the cost per inner step changes between stages (for example, iterative solvers in semi implicit methods).
+    
+    With feedback scheduling (schedule is a StageCostModel) the cost of each T_{j,1} is predicted with the 
+    timings measured in the previous steps, and the T_{j,1} are assigned (most expensive first) to the least
+    loaded processor.
     
     @param k (int): order of extrapolation
     @param seq  (callable(i), int i>=1): sequence of steps to take
+    @param schedule (string or StageCostModel): 'static', 'dynamic' or the cost model for feedback scheduling
     
-    @return k_nj_lst (list of lists of 2-tuples): the list contains NUM_WORKERS lists each one containing which
-            T_{j,1} each processor has to calculate (each T_{j,1} is specified by the tuple (k,nj)).
+    @return k_nj_lst (list of lists of 2-tuples): the list contains the jobs to send to the pool, each one containing
+            which T_{j,1} have to be calculated (each T_{j,1} is specified by the tuple (k,nj)). With static and 
+            feedback scheduling there is one job for each processor, with dynamic scheduling there are k jobs.
     '''
 #     return [(i,seq(i)) for i in range(k, 0, -1)]
+    if isinstance(schedule, StageCostModel):
+        stages = sorted([(schedule.cost(i, seq(i)), i) for i in range(k, 0, -1)], reverse=True)
+        k_nj_lst = [[] for i in range(min(NUM_WORKERS, k))]
+        loads = len(k_nj_lst)*[0]
+        for (cost, i) in stages:
+            worker = loads.index(min(loads))
+            k_nj_lst[worker] += [(i, seq(i))]
+            loads[worker] += cost
+        return k_nj_lst
+    if schedule == 'dynamic':
+        return sorted([[(i,seq(i))] for i in range(k, 0, -1)], key=lambda job: -job[0][1])
+    elif schedule != 'static':
+        raise ValueError("Unknown schedule: " + str(schedule))
     if k <= NUM_WORKERS:
         k_nj_lst = [[(i,seq(i))] for i in range(k, 0, -1)]
     else:
@@ -569,44 +2103,236 @@ def _balance_load(k, seq=(lambda t: 2*t)):
      
     return k_nj_lst
 
-def _updateJ00(previousJ00,func, yn, tn, yn_1, f_yn_1, args):
+def _updateJ00(previousJ00, J0version, func, yn, tn, yn_1, f_yn_1, args, addSolverParam):
     '''
-    Updates the previous Jacobian estimation without doing just one extra function evaluation
-    (which will be reused for next step calculations). It uses the update formula suggested for
-    Broyden's method.
+    Updates the previous Jacobian estimation doing just one extra function evaluation (which will be reused for next
+    step calculations). It uses the update formula suggested for Broyden's method:
+    
+        updatedJ00 = previousJ00 + (incf_yn - previousJ00 incyn) incyn^T / (incyn^T incyn)
+    
+    The update is kept as a low rank update of the last estimated Jacobian (see _BroydenJacobian), so that it keeps
+    its structure and the factorizations of the last estimated Jacobian are updated instead of computed again.
 
-    @param previousJ00 (2D-array): Jacobian approximation at the previous time 
+    @param previousJ00 (2D array, sparse matrix, _BandedJacobian, _HessenbergJacobian or _BroydenJacobian): Jacobian
+            approximation at the previous time 
+    @param J0version (int): version of the last estimated Jacobian (see _setJ00(..))
     @param func (callable(y,t,...)):RHS of the ODE
     @param yn (array): solution at tn (current time)
     @param tn (array): current time
     @param yn_1 (array): solution at tn-1 (previous stage time)
     @param f_yn_1 (array): function evaluation at yn_1,tn_1
     @param args (tuple): extra arguments for func
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior 
+            (addSolverParam['jacUpdateMaxRank'] is the maximum rank of the update)
     
     @return (updatedJ00,f_yn):
-        @return updatedJ00(2D-array): Jacobian approximation updated 
-        @return f_yn(array): function evaluation at yn,tn
+        @return updatedJ00(_BroydenJacobian): Jacobian approximation updated, None if the update already has the 
+            maximum rank (the Jacobian has to be estimated again)
+        @return f_yn(array): function evaluation at yn,tn (None if updatedJ00 is None)
     
     '''
-    #TODO: check if this updating is effective and if so, remove the next
-    #two lines of code
-    updatedJ00 = previousJ00
-    return (updatedJ00,None)
-
+    if(isinstance(previousJ00, _BroydenJacobian) and previousJ00.rank >= addSolverParam['jacUpdateMaxRank']):
+        return (None, None)
+    
     f_yn = func(*(yn,tn)+args)
     incf_yn = f_yn-f_yn_1
     incyn = yn-yn_1
-    updatedJ00 = previousJ00 +np.outer((incf_yn-np.dot(previousJ00,incyn))/np.linalg.norm(incyn, 2),incyn)
-    return (updatedJ00,f_yn)
+    norm2 = np.dot(incyn, incyn)
+    if(norm2 == 0):
+        return (previousJ00, f_yn)
+    u = (incf_yn-np.asarray(previousJ00.dot(incyn)).ravel())/norm2
+    if(isinstance(previousJ00, _BroydenJacobian)):
+        return (previousJ00.update(u, incyn), f_yn)
+    return (_BroydenJacobian(previousJ00, J0version, u[:,np.newaxis], incyn[:,np.newaxis]), f_yn)
 
 previousJ00 = 0
-def _getJacobian(func, args, yn, tn, grad, methodargs, rejectPreviousStep, previousStepSolution,addSolverParam): 
+
+def _reduceJacobian(J00, addSolverParam):
+    '''
+    @return J00 as a _BandedJacobian if addSolverParam['ml'] is not None (J00 is given in band form), J00 reduced
+            to Hessenberg form (see _HessenbergJacobian) if addSolverParam['hessenberg'] and J00 is a dense matrix,
+            J00 otherwise
+    '''
+    if(addSolverParam['ml'] is not None and not isinstance(J00, _MatrixFreeJacobian)):
+        return _BandedJacobian(J00, addSolverParam['ml'], addSolverParam['mu'])
+    if(addSolverParam['hessenberg'] and not scipy.sparse.issparse(J00) and not isinstance(J00, _MatrixFreeJacobian)):
+        return _HessenbergJacobian(J00)
+    return J00
+
+def _estimateJacobian(func, args, yn, tn, f_yn, addSolverParam, pool=None, problemRef=None):
+    '''
+    Estimates the Jacobian at yn,tn with forward differences (see forward_diff.Jacobian), perturbing together
+    the columns of each group (see forward_diff.columnGroups): one column per group for dense Jacobians, the
+    columns ml+mu+1 apart for banded ones, or the columns that don't share any row for sparse Jacobians with 
+    the sparsity pattern addSolverParam['jacSparsity']. If the pattern is 'auto', it is detected by probing func
+    in the first estimation (see forward_diff.detectSparsity). The pattern and its column groups 
+    (addSolverParam['jacColors']) are computed once and kept in addSolverParam for the next estimations.
+    
+    If the stages are computed by a pool of workers, the groups are split between the workers (see 
+    _jacobianDifferences(..)) and the Jacobian is assembled from their differences, so that the sequential
+    function evaluations are divided by NUM_WORKERS. If addSolverParam['vectorized'], func evaluates blocks of 
+    states and the differences of all the groups (of each worker) are computed with one call. If 
+    addSolverParam['jacMethod'] is 'complex', complex-step differentiation is used instead of forward
+    differences (see forward_diff.differences).
+    
+    @param func (callable(y,t,args)): RHS of the ODE
+    @param args (tuple): extra arguments for func
+    @param yn (array): solution at tn (current time)
+    @param tn (float): current time
+    @param f_yn (array): function evaluation at yn,tn
+    @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
+    @param pool: pool of workers that computes the stages (None or a SerialPool to estimate it serially)
+    @param problemRef: reference to the problem definition in the workers (see _registerProblem(..))
+    
+    @return (J00, fe_tot, fe_seq): Jacobian estimation (dense array, band form or CSR matrix), number of function
+            evaluations and number of sequential function evaluations
+    '''
+    def func_at_tn(y, args):
+        return func(*(y,tn)+args)
+    fe_tot = 0
+    sparsity = addSolverParam['jacSparsity']
+    colors = None
+    if(sparsity is not None):
+        if(isinstance(sparsity, str)):
+            sparsity, fe_tot = forward_diff.detectSparsity(func_at_tn, yn, args, addSolverParam['vectorized'])
+            addSolverParam['jacSparsity'] = sparsity
+        if(addSolverParam.get('jacColors') is None):
+            addSolverParam['jacColors'] = forward_diff.colorColumns(sparsity)
+        colors = addSolverParam['jacColors']
+    groups = forward_diff.columnGroups(len(yn), addSolverParam['ml'], addSolverParam['mu'], colors)
+    fe_seq = fe_tot
+    nchunks = 1 if pool is None or isinstance(pool, SerialPool) else min(NUM_WORKERS, len(groups))
+    if(nchunks > 1):
+        chunks = np.array_split(np.arange(len(groups)), nchunks)
+        jobs = [(problemRef, tn, yn, f_yn, [groups[g] for g in chunk]) for chunk in chunks]
+        df = np.vstack(pool.map(_jacobianDifferences, jobs))
+        fe_tot += len(groups)
+        fe_seq += max(len(chunk) for chunk in chunks)
+    else:
+        df, fe_tot_ = forward_diff.differences(func_at_tn, yn, f_yn, groups, args, addSolverParam['vectorized'],
+                                               addSolverParam['jacMethod'])
+        fe_tot += fe_tot_
+        fe_seq += fe_tot_
+    J00 = forward_diff.assemble(df, len(yn), addSolverParam['ml'], addSolverParam['mu'], sparsity, colors)
+    return (J00, fe_tot, fe_seq)
+
+def _jacobianDifferences((problemRef, tn, yn, f_yn, groups)):
+    '''
+    Computes (in a worker) the forward differences of some column groups of the Jacobian, see _estimateJacobian(..).
+    
+    @return df (2D array): differences of each group (see forward_diff.differences)
+    '''
+    method, methodargs, func, grad, args, smoothing, addSolverParam = _getProblem(problemRef)
+    def func_at_tn(y, args):
+        return func(*(y,tn)+args)
+    #yn is perturbed in place, and with threads it is shared with the other workers
+    df, fe_tot = forward_diff.differences(func_at_tn, np.array(yn), f_yn, groups, args, addSolverParam['vectorized'],
+                                          addSolverParam['jacMethod'])
+    return df
+
+class _JacobianRefresh(object):
+    '''
+    Decides when the frozen Jacobian (addSolverParam['freezeJac'], see _getJacobian(..)) is estimated again, as
+    LSODE does, from the statistics of the steps taken with it. The Jacobian is reused while the steps are accepted
+    and the solvers keep converging well, and it is estimated again for the next step when:
+        - the step is rejected
+        - the order is decreased (k_new < k)
+        - the Newton iterations of the midpoint implicit method fail or their mean convergence rate is above
+            addSolverParam['jacRefreshRate'] (see _solve_newton(..))
+        - the GMRES iterations per linear solve grow more than addSolverParam['jacRefreshGmresGrowth'] times the
+            ones of the first step taken with the Jacobian
+        - it has been used in addSolverParam['jacMaxAge'] steps
+        - estimating it again takes at most addSolverParam['jacRefreshCost'] times the RHS evaluations of the
+            stages of the step, unless it is None (the Jacobian of a small system costs a few RHS evaluations, so
+            it is estimated in each step: a frozen Jacobian makes the stages of small stiff problems less accurate)
+    A Jacobian that is kept between steps keeps its version (see _setJ00(..)), so its factorizations are reused
+    from the cache of the workers (see _getStageMethodArgs(..)).
+    '''
+
+    def __init__(self, addSolverParam):
+        '''
+        @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior
+                (see _getAdditionalSolverParameters(..))
+        '''
+        self.addSolverParam = addSolverParam
+        self.age = 0
+        self.gmresIters = None
+        #RHS evaluations of the last Jacobian estimation
+        self.jacobianCost = None
+
+    def refresh(self, rejectStep, k, k_new, stats):
+        '''
+        Records a step taken with the current Jacobian.
+
+        @param rejectStep (bool): whether the step was rejected
+        @param k (int): order of the step
+        @param k_new (int): order chosen for the next step
+        @param stats (dict): counters of the work done in the step (see _countStat(..)), with the RHS evaluations
+                of the Jacobian estimation ('jac_fe', only if it was estimated) and of the stages ('stage_fe')
+
+        @return (bool): whether the Jacobian has to be estimated again in the next step
+        '''
+        self.age += 1
+        gmresIters = None
+        if(stats.get('gmres_solves', 0) > 0):
+            gmresIters = stats.get('gmres_iters', 0)/stats['gmres_solves']
+        if(self.age == 1):
+            self.gmresIters = gmresIters
+
+        refresh = rejectStep or k_new < k or self.age >= self.addSolverParam['jacMaxAge']
+        newtonSolves = stats.get('newton_solves', 0)
+        if(stats.get('newton_fails', 0) > 0 or
+           (newtonSolves > 0 and stats['newton_rate']/newtonSolves > self.addSolverParam['jacRefreshRate'])):
+            refresh = True
+        if(gmresIters is not None and self.gmresIters is not None and
+           gmresIters > self.addSolverParam['jacRefreshGmresGrowth']*max(self.gmresIters, 1)):
+            refresh = True
+        if('jac_fe' in stats):
+            self.jacobianCost = stats['jac_fe']
+        refreshCost = self.addSolverParam['jacRefreshCost']
+        if(self.jacobianCost is not None and refreshCost is not None and
+           self.jacobianCost <= refreshCost*stats.get('stage_fe', 0)):
+            refresh = True
+
+        if(refresh):
+            self.age = 0
+        return refresh
+
+#Versions of the Jacobian estimations, see _setJ00(..)
+_jacobianVersions = itertools.count()
+
+def _setJ00(methodargs, J00):
+    '''
+    Sets the Jacobian estimation in methodargs['J00']. When it changes, a new version number is set in
+    methodargs['J00version'] (the factorizations computed with a Jacobian version can be reused while
+    the version doesn't change, see _getStageMethodArgs(..)).
+    
+    @param methodargs (dict): contains solver methods' additional parameters
+    @param J00 (2D array): Jacobian estimation
+    '''
+    if(J00 is not methodargs.get('J00') or 'J00version' not in methodargs):
+        methodargs['J00version'] = next(_jacobianVersions)
+    methodargs['J00'] = J00
+
+def _getJacobian(func, args, yn, tn, grad, methodargs, refreshJacobian, previousStepSolution,addSolverParam, pool=None,
+                 problemRef=None): 
     '''
     Obtains the Jacobian approximation at yn,tn of func. Different possibilities:
         - If grad (analytical Jacobian) is available grad is used to obtain the Jacobian at yn,tn
-        - Otherwise (if not freeze) the Jacobian is estimated with a forward difference formula (see forward_diff.Jacobian)
-        - Otherwise (if freeze) the last Jacobian approximation is used (unless the previous step was rejected).
-            This freezing idea was taken from LSODE solver.
+        - If addSolverParam['hessenberg'], the dense Jacobians are reduced to Hessenberg form (see _HessenbergJacobian)
+        - If addSolverParam['ml'] (or 'mu') is not None, the Jacobians are banded and given in band form, both by grad
+            and by the forward difference formula, which then only needs ml+mu+1 function evaluations 
+            (see _BandedJacobian)
+        - If addSolverParam['jacSparsity'] is not None, the Jacobian is estimated as a sparse matrix with one function
+            evaluation for each group of columns that don't share rows (see _estimateJacobian(..))
+        - Otherwise (if not freeze) the Jacobian is estimated with a forward difference formula, split between
+            the workers of the pool (see _estimateJacobian(..)), or, if addSolverParam['matrixFree'], only the 
+            point where its products are estimated is kept (see _MatrixFreeJacobian)
+        - Otherwise (if freeze) the last Jacobian approximation is used, unless refreshJacobian (the previous 
+            step was rejected or the solver statistics show that the Jacobian is outdated, see _JacobianRefresh).
+            This freezing idea was taken from LSODE solver. If addSolverParam['jacUpdate'] is 'broyden', it is
+            updated with Broyden's rank-1 update (see _updateJ00(..)) and it is estimated again when the update 
+            reaches rank addSolverParam['jacUpdateMaxRank'].
     
     freeze is a parameter in dictionary addSolverParam with the name freezeJac
     
@@ -617,18 +2343,25 @@ def _getJacobian(func, args, yn, tn, grad, methodargs, rejectPreviousStep, previ
     @param grad (callable(y,t,args)): computes analytically the Jacobian of the func function parameter.
     @param methodargs (dict): contains solver methods' additional parameters.
             In this function methodargs['J00'] is updated with the Jacobian estimation at yn,tn
-    @param rejectPreviousStep (bool): whether previously taken step was rejected or not 
+    @param refreshJacobian (bool): whether a frozen Jacobian has to be estimated again (see _JacobianRefresh)
     @param previousStepSolution (2-tuple): tuple containing the solution at the previous step (tn-1) and its
             function evaluation, (yn_1, f_yn_1)    
-    @return (f_yn, fe_tot,je_tot):
+    @param pool: pool of workers that computes the stages, used to estimate the Jacobian (see _estimateJacobian(..))
+    @param problemRef: reference to the problem definition in the workers (see _registerProblem(..))
+    @return (f_yn, fe_tot,je_tot, fe_seq):
         @return f_yn (array): function evaluation at yn,tn
-        @return fe_tot (int): number of function evaluations (0 if analytical Jacobian, N if estimated Jacobian)
+        @return fe_tot (int): number of function evaluations (0 if analytical Jacobian, N+1 if estimated Jacobian,
+            ml+mu+2 if estimated banded Jacobian, number of column groups+1 if estimated sparse Jacobian, 1 if 
+            matrix-free or Broyden update)
         @return je_tot (int): number of Jacobian evaluations (1 if analytical Jacobian) 
             or Jacobian estimations (1 if estimated Jacobian)
+        @return fe_seq (int): number of sequential function evaluations (fe_tot unless the estimation is split
+            between the workers)
     
     '''
     je_tot=0
     fe_tot=0
+    fe_seq=0
     f_yn=None
     #methodargs is an empty dictionary if a Jacobian estimation/evaluation is needed (semi implicit methods)
     if(not methodargs=={}):
@@ -637,28 +2370,43 @@ def _getJacobian(func, args, yn, tn, grad, methodargs, rejectPreviousStep, previ
         if(grad is None):
             
             global previousJ00
-            if(addSolverParam['freezeJac'] and not rejectPreviousStep):
+            if(addSolverParam['freezeJac'] and not refreshJacobian):
                 yn_1, f_yn_1 = previousStepSolution
-                updatedJ00, f_yn = _updateJ00(previousJ00,func, yn, tn, yn_1, f_yn_1, args)
-                methodargs['J00']=updatedJ00
-                return (f_yn, fe_tot,je_tot)
+                if(addSolverParam['jacUpdate'] != 'broyden' or f_yn_1 is None):
+                    _setJ00(methodargs, previousJ00)
+                    return (f_yn, fe_tot,je_tot, fe_seq)
+                J0version = (previousJ00.J0version if isinstance(previousJ00, _BroydenJacobian) 
+                             else methodargs.get('J00version'))
+                updatedJ00, f_yn = _updateJ00(previousJ00, J0version, func, yn, tn, yn_1, f_yn_1, args, addSolverParam)
+                if(updatedJ00 is not None):
+                    fe_tot += 1
+                    fe_seq += 1
+                    _setJ00(methodargs, updatedJ00)
+                    previousJ00 = updatedJ00
+                    return (f_yn, fe_tot,je_tot, fe_seq)
     
             f_yn = func_at_tn(yn,args)
             fe_tot += 1
-            J00,fe_tot_ = forward_diff.Jacobian(func_at_tn,yn, f_yn, args)
-            fe_tot += fe_tot_
+            fe_seq += 1
+            if(addSolverParam['matrixFree']):
+                J00 = _MatrixFreeJacobian(yn, tn, f_yn)
+            else:
+                J00,fe_tot_,fe_seq_ = _estimateJacobian(func, args, yn, tn, f_yn, addSolverParam, pool, problemRef)
+                fe_tot += fe_tot_
+                fe_seq += fe_seq_
             je_tot=1
-            methodargs['J00'] =J00 
+            J00 = _reduceJacobian(J00, addSolverParam)
+            _setJ00(methodargs, J00)
             previousJ00 = J00
         else:            
-            J00 = grad(yn, tn)
+            J00 = grad(*(yn, tn) + args)
             je_tot = 1
             fe_tot = 0
-            methodargs['J00'] =J00 
-    return (f_yn, fe_tot,je_tot) 
+            _setJ00(methodargs, _reduceJacobian(J00, addSolverParam))
+    return (f_yn, fe_tot,je_tot, fe_seq) 
 
-def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h, k, pool, 
-                            rejectPreviousStep,previousStepSolution, seq, smoothing, symmetric, addSolverParam):
+def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h, k, pool, sharedBuffer, problemRef,
+                            refreshJacobian,previousStepSolution, seq, smoothing, symmetric, dense, schedule, addSolverParam):
     '''
     Computes the extrapolation tableau for a given big step, order and step sequence. It parallelizes the computation
     of each T_{1,i} taking all the inner steps necessary and then extrapolates the final value at tn+h.
@@ -675,9 +2423,13 @@ def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h
             This value matches with the value H in ref I and ref II.
     @param k (int): order of extrapolation to take in this step (determines the number of extrapolations performed
             to achieve a better integration output, equivalent to the size of the extrapolation tableau).
-    @param pool: multiprocessing pool of workers (with as many workers as processors) that will parallelize the
+    @param pool (WorkerPool): pool of workers (with NUM_WORKERS workers) that will parallelize the
             calculation of each of the initial values of the extrapolation tableau (T_{i,1} i=1...k).
-    @param rejectPreviousStep (bool): whether previously taken step was rejected or not 
+    @param sharedBuffer (SharedBuffer): memory block shared with the workers where they write the stage results.
+            The returned y_half, f_yj and yj arrays are views of this block (valid until the next step is computed).
+    @param problemRef: reference to the problem definition registered in the workers (see _registerProblem(..)).
+            Only the step data (tn, yn, f_yn, h, J00 and the stages to compute) is sent in each job.
+    @param refreshJacobian (bool): whether a frozen Jacobian has to be estimated again (see _JacobianRefresh)
     @param previousStepSolution (2-tuple): tuple containing the solution at the previous step (tn-1) and its
             function evaluation, (yn_1, f_yn_1) 
     @param seq (callable(i), int i>=1): the step-number sequence (examples II.9.1 , 9.6, 9.35 ref I).
@@ -687,18 +2439,22 @@ def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h
         -'semiimp': two point smoothing step (for semiimplicit midpoint), IV.9.16c ref II. 
     @param symmetric (bool): whether the method to solve one step is symmetric (midpoint/trapezoidal)
             or non-symmetric (euler).
+    @param dense (bool): whether dense output is needed in this step. If not, y_half, f_yj and yj are not
+            returned by the workers (see _getStageLayout(..)).
+    @param schedule (string or StageCostModel): how the stages are distributed between the workers, 'static', 
+            'dynamic' or the cost model for feedback scheduling (see _balance_load(..))
     @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
             Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
     
-    @return (T, y_half, f_yj, yj, f_yn, hs,(fe_seq, fe_tot, je_tot)):
+    @return (T, y_half, f_yj, yj, f_yn, hs,(fe_seq, fe_tot, je_tot, stats)):
         @return T (2D array): filled extrapolation tableau (size k) with all the T_{i,j} values in the lower 
                 triangular side
         @return y_half (2D array): array containing for each extrapolation value (1...k) an array with the intermediate (at half
-                the integration interval) solution value.
+                the integration interval) solution value (only for dense output with symmetric methods).
         @return f_yj (3D array): array containing for each extrapolation value (1...k) an array with all the function evaluations
-                done at the intermediate solution values.
-        @return yj (3D array): array containing for each extrapolation value (1...k) an array with all the intermediate solution 
-                values obtained to calculate each T_{i,1}.
+                done at the intermediate solution values (only for dense output with symmetric methods).
+        @return yj (3D array): array containing for each extrapolation value (1...k) an array with the last k intermediate 
+                solution values obtained to calculate each T_{i,1} (only for dense output with non symmetric methods).
         @return f_yn (array): function (RHS) evaluation at yn,tn
         @return hs (array): array containing for each extrapolation value (1...k) the inner step taken, H/nj (ref I)
         @return (fe_seq,fe_tot,je_tot):
@@ -707,22 +2463,45 @@ def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h
             @return je_tot (int): cumulative number of either Jacobian evaluations (when analytic Jacobian is 
                     provided) or Jacobian estimations (when no analytic Jacobian is provided) performed 
                     for this step
+            @return stats (dict): other counters of the work done in this step (see _countStat(..))
 
     '''
     T = np.zeros((k+1,k+1, len(yn)), dtype=(type(yn[0])))
-    k_nj_lst = _balance_load(k, seq=seq)
-    
-    f_yn, fe_tot, je_tot = _getJacobian(func, args, yn, tn, grad, methodargs, rejectPreviousStep, previousStepSolution,addSolverParam)
-    
-    jobs = [(method, methodargs, func, grad, tn, yn, f_yn, args, h, k_nj, smoothing, addSolverParam) for k_nj in k_nj_lst]
-    results = pool.map(_compute_stages, jobs, chunksize=1)
-
-#     res = _compute_stages((method, methodargs, func, grad, tn, yn, f_yn, args, h, k_nj_lst, smoothing))
-    
-    #At this stage fe_tot has only counted the function evaluations for the jacobian estimation
-    #(which are not parallelized)
-    fe_seq = 1*fe_tot
-    fe_tot_stage_max=0
+    k_nj_lst = _balance_load(k, seq=seq, schedule=schedule)
+    
+    f_yn, fe_tot, je_tot, fe_seq = _getJacobian(func, args, yn, tn, grad, methodargs, refreshJacobian, previousStepSolution,
+                                                addSolverParam, pool, problemRef)
+    
+    #Assign to each stage its rows of the shared block (where the workers write the results that will be needed)
+    layout = {}
+    rows = 0
+    for k_nj in k_nj_lst:
+        for (k_, nj_) in k_nj:
+            (y_lo, y_hi), (f_lo, f_hi) = _getStageLayout(k_, int(nj_), dense, symmetric)
+            layout[k_] = (rows, (y_lo, y_hi), (f_lo, f_hi))
+            rows += (y_hi - y_lo) + (f_hi - f_lo) + 1
+    sharedArray = sharedBuffer.get(rows, len(yn), type(yn[0]))
+    shared = (sharedBuffer.descriptor(), layout)
+    
+    J00 = methodargs.get('J00')
+    J00version = methodargs.get('J00version')
+    jobs = [(problemRef, tn, yn, f_yn, h, J00, J00version, k_nj, shared) for k_nj in k_nj_lst]
+    if(isinstance(pool, WorkerPool)):
+        #Send each job to the worker that computed its (first) stage in the previous step (see _getStageMethodArgs(..)),
+        #but not before larger jobs (their cost is estimated with their number of inner steps)
+        results = pool.map(_compute_stages, jobs, affinity=[(problemRef, k_nj[0][0]) for k_nj in k_nj_lst],
+                           costs=[sum(nj_ for (k_, nj_) in k_nj) for k_nj in k_nj_lst])
+    else:
+        results = pool.map(_compute_stages, jobs)
+
+    #At this stage fe_tot and fe_seq have only counted the function evaluations for the jacobian estimation
+    #(see _estimateJacobian(..))
+    fe_tot_stages = []
+    stats = {}
+    #The cost of the Jacobian estimations is used to decide when to estimate it again (see _JacobianRefresh),
+    #without the evaluation at yn that the step needs anyway
+    if(je_tot > 0 and fe_tot > 0):
+        stats['jac_fe'] = fe_tot - 1
     # process the returned results from the pool 
     y_half = (k+1)*[None]
     f_yj = (k+1)*[None]
@@ -732,24 +2511,147 @@ def _compute_extrapolation_table(method, methodargs, func, grad, tn, yn, args, h
     for res in results:
 #     for i in range(1,2):
         fe_tot_stage = 0
-        for (k_, nj_, Tk_, y_half_, f_yj_, yj_, fe_tot_, je_tot_) in res:
+        for (k_, nj_, fe_tot_, je_tot_, nsteps_, elapsed_, stats_) in res:
+            _addStats(stats, stats_)
+            if(isinstance(schedule, StageCostModel)):
+                schedule.record(k_, nj_, fe_tot_, je_tot_, nsteps_, elapsed_)
+            yj_, f_yj_, Tk_ = _getStageRows(sharedArray, layout[k_])
             T[k_, 1] = Tk_
-            y_half[k_] = y_half_
+            if(dense and symmetric):
+                y_half[k_] = yj_[0]
             f_yj[k_] = f_yj_
             yj[k_] = yj_
             hs[k_] = h/nj_
             fe_tot += fe_tot_
             je_tot += je_tot_
             fe_tot_stage += fe_tot_
-        #Count the maximum number of sequential 
-        #function evaluations taken
-        if(fe_tot_stage_max<fe_tot_stage):
-            fe_tot_stage_max = fe_tot_stage 
+        fe_tot_stages.append(fe_tot_stage)
     
-    fe_seq += fe_tot_stage_max
+    #Count the maximum number of sequential 
+    #function evaluations taken
+    fe_seq += _sequential_evaluations(fe_tot_stages, getattr(pool, 'lastWorkers', None))
+    stats['stage_fe'] = sum(fe_tot_stages)
     _fill_extrapolation_table(T, k, 0, seq, symmetric)
     
-    return (T, y_half, f_yj, yj, f_yn, hs,(fe_seq, fe_tot, je_tot))
+    return (T, y_half, f_yj, yj, f_yn, hs,(fe_seq, fe_tot, je_tot, stats))
+
+def _sequential_evaluations(fe_jobs, workers=None):
+    '''
+    Gets the number of sequential function evaluations of the stages of a step, i.e. the maximum (over all the 
+    workers) of the function evaluations done by each worker.
+    
+    @param fe_jobs (list): number of function evaluations done in each job (in the order the jobs were sent)
+    @param workers (list): worker that computed each job (see WorkerPool.map(..)). If None (the pool doesn't
+            report it) each job is assigned, as the pool would, to the first free worker.
+    
+    @return (int): number of sequential function evaluations
+    '''
+    loads = max(NUM_WORKERS, len(fe_jobs) if workers is None else max(workers)+1)*[0]
+    for (i, fe_job) in enumerate(fe_jobs):
+        worker = loads.index(min(loads)) if workers is None else workers[i]
+        loads[worker] += fe_job
+    return max(loads)
+
+class StepSequence(object):
+    '''
+    Step-number sequence {n_1, n_2, n_3, ...} used to compute the first column of the extrapolation tableau 
+    (II.9.6, II.9.7 and II.9.35 ref I). It can be used wherever a sequence callable is expected (seq(i) returns n_i),
+    and it caches:
+        - its values,
+        - the cumulative work A_k = n_1 + ... + n_k (see _estimate_next_step_and_order(..)),
+        - the denominators of the extrapolation formulas (see _getExtrapolationDenominators(..)).
+    
+    Unlike lambdas, sequences can be pickled (only their definition is pickled, not the cached tables) so they
+    can be sent to the workers cheaply.
+    
+    The values are n_i = scale*m_i + shift, where m_i is one of these sequences:
+        - 'harmonic': 1,2,3,4,5,...
+        - 'romberg': 1,2,4,8,16,...
+        - 'bulirsch': 1,2,3,4,6,8,12,16,24,...
+        - 'BD1983': 2,6,10,14,22,34,50,70,98,138,194 (Bader & Deuflhard, 1983)
+        - a list with the values m_1, m_2, ...
+    
+    For example, StepSequence('harmonic', 2) is {2,4,6,8,...} and StepSequence('harmonic', 4, -2) is {2,6,10,14,...}.
+    '''
+    
+    _finiteSequences = {'BD1983': [2,6,10,14,22,34,50,70,98,138,194]}
+    
+    def __init__(self, kind='harmonic', scale=1, shift=0):
+        '''
+        @param kind (string or list): 'harmonic', 'romberg', 'bulirsch', 'BD1983' or list of values
+        @param scale (int): factor that multiplies the sequence values
+        @param shift (int): value added to the (scaled) sequence values
+        '''
+        if isinstance(kind, (list, tuple)):
+            kind = list(kind)
+        elif kind not in ('harmonic', 'romberg', 'bulirsch') and kind not in StepSequence._finiteSequences:
+            raise ValueError("Unknown step sequence: " + str(kind))
+        self.kind = kind
+        self.scale = scale
+        self.shift = shift
+        self._clearCache()
+    
+    def _clearCache(self):
+        self._values = [None]
+        self._work = [0]
+        self._denominators = {}
+    
+    def _base(self, i):
+        if isinstance(self.kind, list) or self.kind in StepSequence._finiteSequences:
+            values = self.kind if isinstance(self.kind, list) else StepSequence._finiteSequences[self.kind]
+            if i > len(values):
+                raise ValueError("Step sequence " + repr(self) + " only has " + str(len(values)) + " values")
+            return values[i-1]
+        elif self.kind == 'harmonic':
+            return i
+        elif self.kind == 'romberg':
+            return 2**(i-1)
+        else:
+            return i if i <= 3 else 2*self._base(i-2)
+    
+    def __call__(self, i):
+        '''
+        @param i (int): index of the value, i >= 1
+        
+        @return (int): n_i
+        '''
+        if i < 1:
+            raise ValueError("Step sequence index should be >= 1")
+        while len(self._values) <= i:
+            self._values.append(self.scale*self._base(len(self._values)) + self.shift)
+        return self._values[i]
+    
+    def work(self, k):
+        '''
+        @param k (int): number of values
+        
+        @return (int): A_k = n_1 + ... + n_k, the number of inner steps to compute k lines of the extrapolation tableau
+        '''
+        while len(self._work) <= k:
+            self._work.append(self._work[-1] + self(len(self._work)))
+        return self._work[k]
+    
+    def denominators(self, k, j_initshift, symmetric):
+        '''
+        Gets the (cached) denominators of the extrapolation formulas, see _getExtrapolationDenominators(..).
+        '''
+        key = (k, j_initshift, symmetric)
+        if key not in self._denominators:
+            self._denominators[key] = _computeExtrapolationDenominators(k, j_initshift, self, symmetric)
+        return self._denominators[key]
+    
+    def __getstate__(self):
+        return (self.kind, self.scale, self.shift)
+    
+    def __setstate__(self, state):
+        self.kind, self.scale, self.shift = state
+        self._clearCache()
+    
+    def __repr__(self):
+        return "StepSequence(" + repr(self.kind) + ", " + str(self.scale) + ", " + str(self.shift) + ")"
+
+#{2,6,10,14,...} sequence for dense output
+_denseSeq = StepSequence('harmonic', 4, -2)
 
 def _fill_extrapolation_table(T, k, j_initshift, seq, symmetric):
     '''
@@ -769,14 +2671,60 @@ def _fill_extrapolation_table(T, k, j_initshift, seq, symmetric):
     @param seq (callabel(i) int i>=1): step sequence of the first column values
     @param symmetric (bool): whether the method used to compute the first column of T is symmetric or not.
     
+    Each column is computed at once (in place) from the previous one, with the denominators of the formula
+    cached for the given step sequence (see _getExtrapolationDenominators(..)).
+    
     '''
+    denominators = _getExtrapolationDenominators(k, j_initshift, seq, symmetric)
     # compute extrapolation table 
     for i in range(2, k+1):
-        for j in range(i, k+1):
-            if(symmetric):
-                T[j,i] = T[j,i-1] + (T[j,i-1] - T[j-1,i-1])/((seq(j+j_initshift)/seq(j+j_initshift-i+1))**2 - 1)
-            else:
-                T[j,i] = T[j,i-1] + (T[j,i-1] - T[j-1,i-1])/((seq(j+j_initshift)/seq(j+j_initshift-i+1)) - 1)        
+        column = T[i:k+1,i]
+        np.subtract(T[i:k+1,i-1], T[i-1:k,i-1], out=column)
+        column /= denominators[i].reshape(denominators[i].shape + (column.ndim-1)*(1,))
+        column += T[i:k+1,i-1]
+
+#Cache of the extrapolation tableau denominators, see _getExtrapolationDenominators(..)
+_extrapolationDenominators = {}
+
+def _getExtrapolationDenominators(k, j_initshift, seq, symmetric):
+    '''
+    Gets the denominators of the formula used to fill the extrapolation tableau (II.9.5 ref I for non symmetric
+    methods, II.9.10 ref I for symmetric methods), see _fill_extrapolation_table(..). They only depend on the 
+    step sequence, so they are computed once for each (seq, k, j_initshift, symmetric) and cached.
+    
+    @param k (int): table size
+    @param j_initshift (int): step sequence index matching the number of steps taken to compute the first
+            value T_{1,1} of this extrapolation tableau (see _fill_extrapolation_table(..))
+    @param seq (callabel(i) int i>=1): step sequence of the first column values (StepSequence objects keep their
+            own cache, see StepSequence.denominators(..))
+    @param symmetric (bool): whether the method used to compute the first column of T is symmetric or not.
+    
+    @return denominators (list of arrays): denominators[i] (i=2...k) contains the denominators of T_{j,i} for j=i...k
+    '''
+    if isinstance(seq, StepSequence):
+        return seq.denominators(k, j_initshift, symmetric)
+    key = (seq, k, j_initshift, symmetric)
+    denominators = _extrapolationDenominators.get(key)
+    if denominators is None:
+        #Avoid growing forever when new sequences are created for every call
+        if len(_extrapolationDenominators) > 256:
+            _extrapolationDenominators.clear()
+        denominators = _computeExtrapolationDenominators(k, j_initshift, seq, symmetric)
+        _extrapolationDenominators[key] = denominators
+    return denominators
+
+def _computeExtrapolationDenominators(k, j_initshift, seq, symmetric):
+    '''
+    Computes the denominators of the extrapolation formulas (see _getExtrapolationDenominators(..)).
+    '''
+    denominators = (k+1)*[None]
+    for i in range(2, k+1):
+        ratios = [seq(j+j_initshift)/seq(j+j_initshift-i+1) for j in range(i, k+1)]
+        if(symmetric):
+            denominators[i] = np.array([ratio**2 - 1 for ratio in ratios])
+        else:
+            denominators[i] = np.array([ratio - 1 for ratio in ratios])
+    return denominators
             
 def _centered_finite_diff(j, f_yj, hj):
     '''
@@ -847,7 +2795,7 @@ def _backward_finite_diff(j, yj, hj, lam):
 
     return rj
 
-def _compute_rs(yj, hs, k, seq=(lambda t: 4*t-2)):
+def _compute_rs(yj, hs, k, seq=_denseSeq):
     '''
     Computes through the backward differentiation formula and using extrapolation, different order derivatives
     of y. In other words, it delegates VI.5.43 ref II (step 1) to _backward_finite_diff(.) function and here it 
@@ -893,7 +2841,7 @@ def _compute_rs(yj, hs, k, seq=(lambda t: 4*t-2)):
 
     return rs 
 
-def _compute_ds(y_half, f_yj, hs, k, seq=(lambda t: 4*t-2)):
+def _compute_ds(y_half, f_yj, hs, k, seq=_denseSeq):
     '''
     Computes through the centered differentiation formula and using extrapolation, different order derivatives
     of y. In other words, it delegates II.9.39 ref I (step 1) to _backward_finite_diff(.) function and here it 
@@ -989,7 +2937,7 @@ def _getPolynomial(a_u,a_u_1,H,degree,pol_shift,atol,rtol):
     return poly
 
 def _interpolate_nonsym(y0, Tkk, yj, hs, H, k, atol, rtol,
-        seq=(lambda t: 4*t-2)):
+        seq=_denseSeq):
     '''
     Non symmetrical formula (for example used for euler's method) to interpolate dense output values. It
     calculates a polynomial to interpolate any value from t0 (time at y0) to t0+H (time at Tkk). Based on
@@ -1038,7 +2986,7 @@ def _interpolate_nonsym(y0, Tkk, yj, hs, H, k, atol, rtol,
     
 
 def _interpolate_sym(y0, Tkk, f_Tkk, y_half, f_yj, hs, H, k, atol, rtol,
-        seq=(lambda t: 4*t-2)):
+        seq=_denseSeq):
     '''
     Symmetrical formula (for example used for midpoint's method) to interpolate dense output values. It
     calculates a polynomial to interpolate any value from t0 (time at y0) to t0+H (time at Tkk). Based on
@@ -1181,7 +3129,7 @@ def _getDenseAndSequence(t_final, t, t_index, seq, symmetric):
         dense=False
     
     if dense and symmetric:
-        seq = lambda t: 2*(2*t-1)     # {2,6,10,14,...} sequence for dense output
+        seq = _denseSeq
         
     return (dense,seq)
 
@@ -1233,9 +3181,12 @@ def _estimate_next_step_and_order(T, k, h, atol, rtol, seq, adaptative, addSolve
            Expected time to compute k lines of the extrapolation table,
            in units of RHS evaluations.
         """
-        sum_ = 0
-        for i in range(k):
-            sum_ += seq(i+1)
+        if isinstance(seq, StepSequence):
+            sum_ = seq.work(k)
+        else:
+            sum_ = 0
+            for i in range(k):
+                sum_ += seq(i+1)
         #sizeODE is the length of the ODE
         return max(seq(k), sum_/NUM_WORKERS)+sizeODE # The second value is only an estimate
 
@@ -1296,7 +3247,7 @@ def _estimate_next_step_and_order(T, k, h, atol, rtol, seq, adaptative, addSolve
 
 
 def _solve_one_step(method, methodargs, func, grad, t_curr, t, t_index, yn, args, h, k, atol, rtol, 
-                   pool, smoothing, symmetric, seq, adaptative, rejectPreviousStep, previousStepSolution, addSolverParam):
+                   pool, sharedBuffer, problemRef, smoothing, symmetric, seq, adaptative, schedule, refreshJacobian, previousStepSolution, addSolverParam):
     '''
     Solves one 'big' H step of the ODE (with all its inner H/nj steps and the extrapolation). In other words, 
     solve one full stage of the problem (one step of parallel extrapolation) and interpolates all the dense 
@@ -1321,8 +3272,10 @@ def _solve_one_step(method, methodargs, func, grad, t_curr, t, t_index, yn, args
             to achieve a better integration output, equivalent to the size of the extrapolation tableau).
     @param rtol, atol (float): the input parameters rtol (relative tolerance) and atol (absolute tolerance)
             determine the error control performed by the solver. See  function _error_norm(y1, y2, atol, rtol).
-    @param pool: multiprocessing pool of workers (with as many workers as processors) that will parallelize the
+    @param pool (WorkerPool): pool of workers (with NUM_WORKERS workers) that will parallelize the
             calculation of each of the initial values of the extrapolation tableau (T_{i,1} i=1...k).
+    @param sharedBuffer (SharedBuffer): memory block shared with the workers where they write the stage results.
+    @param problemRef: reference to the problem definition registered in the workers (see _registerProblem(..))
     @param smoothing (string): specifies if a smoothing step should be performed:
         -'no': no smoothing step performed
         -'gbs': three point smoothing step (based on GBS method), II.9.13c ref I and IV.9.9 ref II.
@@ -1333,13 +3286,15 @@ def _solve_one_step(method, methodargs, func, grad, t_curr, t, t_index, yn, args
     @param adaptive (string): specifies the strategy of integration. Can take three values:
         - "fixed" = use fixed step size and order strategy.
         - "order" or any other string = use adaptive step size and adaptive order strategy (recommended).
-    @param rejectPreviousStep (bool): whether previously taken step was rejected or not 
+    @param schedule (string or StageCostModel): how the stages are distributed between the workers, 'static', 
+            'dynamic' or the cost model for feedback scheduling (see _balance_load(..))
+    @param refreshJacobian (bool): whether a frozen Jacobian has to be estimated again (see _JacobianRefresh)
     @param previousStepSolution (2-tuple): tuple containing the solution at the previous step (tn-1) and its
             function evaluation, (yn_1, f_yn_1)
     @param addSolverParam (dict): extra arguments needed to define completely the solver's behavior.
             Should not be empty, for more information see _getAdditionalSolverParameters(..) function.
     
-    @return (rejectStep, y, y_solution,f_yn, h, k, h_new, k_new, (fe_seq, fe_tot, je_tot)):
+    @return (rejectStep, y, y_solution,f_yn, h, k, h_new, k_new, (fe_seq, fe_tot, je_tot, stats)):
         @return rejectStep (bool): whether this step should be rejected or not. True when this step was not successful
                 (estimated error of the final solution or the interpolation solutions too large for the tolerances 
                 required) and has to be recalculated (with a new step size h_new and order k_new).
@@ -1369,8 +3324,9 @@ def _solve_one_step(method, methodargs, func, grad, t_curr, t, t_index, yn, args
         k_min = 3
         k = min(k_max, max(k_min, k))
 
-    T, y_half, f_yj,yj, f_yn, hs, (fe_seq, fe_tot, je_tot) = _compute_extrapolation_table(method, methodargs, func, grad, 
-                t_curr, yn, args, h, k, pool, rejectPreviousStep, previousStepSolution, seq, smoothing, symmetric,addSolverParam)
+    T, y_half, f_yj,yj, f_yn, hs, (fe_seq, fe_tot, je_tot, stats) = _compute_extrapolation_table(method, methodargs, func, grad, 
+                t_curr, yn, args, h, k, pool, sharedBuffer, problemRef, refreshJacobian, previousStepSolution, seq, smoothing, symmetric, dense,
+                schedule, addSolverParam)
     
     rejectStep, y, h_new, k_new = _estimate_next_step_and_order(T, k, h, atol, rtol, seq, adaptative, addSolverParam)
     
@@ -1390,7 +3346,7 @@ def _solve_one_step(method, methodargs, func, grad, t_curr, t, t_index, yn, args
                 h_new = 1*h_int
             
 
-    return (rejectStep, y, y_solution,f_yn, h, k, h_new, k_new, (fe_seq, fe_tot, je_tot))
+    return (rejectStep, y, y_solution,f_yn, h, k, h_new, k_new, (fe_seq, fe_tot, je_tot, stats))
 
 
 def _interpolate_values_at_t(func, args, T, k, t_curr, t, t_index, h, hs, y_half, f_yj,yj, yn,
@@ -1496,7 +3452,9 @@ def _interpolate_values_at_t(func, args, T, k, t_curr, t, t_index, h, hs, y_half
     rejectStep=False
     return (rejectStep, y_solution, h_int, (fe_tot, fe_seq))
 
-def _getAdditionalSolverParameters(N,atol,rtol,addWork):
+def _getAdditionalSolverParameters(N,atol,rtol,addWork,preconditioner='auto',matrixFree=False,linearSolver='auto',
+                                   ml=None,mu=None,jacSparsity=None,vectorized=False,jacMethod='forward',
+                                   jacUpdate=None):
     '''
     Set additional parameters that change slightly the behavior of the solver.
     See each parameter use to understand their behavior.
@@ -1508,15 +3466,50 @@ def _getAdditionalSolverParameters(N,atol,rtol,addWork):
     @param addWork (bool): whether to add extra work to the work estimation used to compute
             next step to take. Should only be True when some form of Jacobian estimation
             or evaluation is performed.
+    @param preconditioner (string or callable): preconditioner for the iterative linear solver,
+            see _buildPreconditioner(..)
+    @param matrixFree (bool or string): whether to use a matrix-free Jacobian when it is estimated (see 
+            _MatrixFreeJacobian), 'auto' to use it when N >= MATRIX_FREE_THRESHOLD (unless linearSolver is direct)
+    @param linearSolver (string): linear solver for the semi implicit methods: 'iterative' (GMRES), 'direct' (LU
+            factorization), 'hessenberg' (direct, with the Jacobian reduced to Hessenberg form, see 
+            _HessenbergJacobian) or 'auto' (iterative if N>15, direct otherwise, direct for banded Jacobians)
+    @param ml, mu (int): lower and upper bandwidths of the Jacobian if it is banded (see _BandedJacobian), None 
+            otherwise (if only one of them is given the other one is 0)
+    @param jacSparsity (2D array, sparse matrix or string): sparsity pattern of the Jacobian to estimate it as a sparse
+            matrix (see _estimateJacobian(..)), 'auto' to detect it or None to estimate it as a dense matrix
+    @param vectorized (bool): whether the RHS can evaluate blocks of states (see _estimateJacobian(..))
+    @param jacMethod (string): differentiation method of the Jacobian estimations, 'forward' or 'complex'
+            (see forward_diff.differences)
+    @param jacUpdate (string): how the Jacobian is updated between estimations, 'broyden' (rank-1 updates, see
+            _updateJ00(..)) or None (frozen Jacobians are not updated)
                         
     @return addSolverParam (dict):
              KEY            MEANING
             'min_tol'      minimum tolerance, see BLOCK 1 functions, used in implicit and semi implicit methods
             'addWork'      add extra work to work estimation, see _estimate_next_step_and_order(..)
             'freezeJac'    whether to freeze Jacobian estimation, see _getJacobian(..)
+            'jacMaxAge', 'jacRefreshRate', 'jacRefreshGmresGrowth', 'jacRefreshCost' when the frozen Jacobian is
+                                estimated again, see _JacobianRefresh
             'iterative'    whether system solver should be iterative or exact, 
                                 see BLOCK 1 functions, used in semi implicit methods
             'initialGuess' 
+            'factorCache'  number of factorizations kept by each worker to reuse them in next steps,
+                                see _getStageMethodArgs(..)
+            'preconditioner' preconditioner for the iterative solver ('ilu', 'jacobi', 'auto', callable(A)
+                                or None), see _buildPreconditioner(..)
+            'iluDropTol', 'iluFillFactor', 'jacobiBlockSize' parameters of the preconditioners
+            'matrixFree'   whether the estimated Jacobian is matrix-free, see _getJacobian(..)
+            'hessenberg'   whether the dense Jacobians are reduced to Hessenberg form, see _getJacobian(..)
+            'ml', 'mu'     bandwidths of banded Jacobians (None if not banded), see _getJacobian(..)
+            'jacSparsity', 'jacColors' sparsity pattern of the estimated Jacobians and its column groups,
+                                see _estimateJacobian(..)
+            'vectorized'   whether the RHS evaluates blocks of states, see _estimateJacobian(..)
+            'jacMethod'    differentiation method of the Jacobian estimations, see _estimateJacobian(..)
+            'jacUpdate', 'jacUpdateMaxRank' update of the frozen Jacobian and maximum rank of the update before
+                                estimating the Jacobian again, see _getJacobian(..)
+            'matrixStepFactor' the stage matrices are I-matrixStepFactor*step*J00, see _getStageMethodArgs(..)
+            'atol', 'rtol' tolerances required, used by the Newton iterations, see _solve_newton(..)
+            'newtonTol', 'newtonMaxIter' stopping criterion of the Newton iterations, see _solve_newton(..)
 
     '''
     
@@ -1532,13 +3525,86 @@ def _getAdditionalSolverParameters(N,atol,rtol,addWork):
     
     addSolverParam['initialGuess'] = False
     
-    #TODO: check this 15 threshold to see it's viability
-    #as it was chosen empirically with not enough examples
-    if(N>15):
-        addSolverParam['freezeJac'] = True
+    addSolverParam['matrixStepFactor'] = 1
+    addSolverParam['atol'] = atol
+    addSolverParam['rtol'] = rtol
+    #The Newton errors of the stages are not smooth in the step size, so the extrapolation doesn't remove them: they
+    #have to be well below the error of the extrapolated solution, which is usually much smaller than rtol. The
+    #iterations can't get below the roundoff of the error norm, eps/rtol (as in RADAU5)
+    addSolverParam['newtonTol'] = max(np.finfo(float).eps/rtol, 1e-5)
+    addSolverParam['newtonMaxIter'] = 20
+    
+    addSolverParam['factorCache'] = 8
+    
+    if(linearSolver not in ('auto', 'iterative', 'direct', 'hessenberg')):
+        raise ValueError("Unknown linear solver: " + str(linearSolver))
+    banded = ml is not None or mu is not None
+    addSolverParam['ml'] = (ml or 0) if banded else None
+    addSolverParam['mu'] = (mu or 0) if banded else None
+    if(banded and linearSolver == 'hessenberg'):
+        raise ValueError("A banded Jacobian can't be reduced to Hessenberg form")
+    #Banded Jacobians are factored with banded LU (as cheap as a few GMRES iterations for narrow bands)
+    direct = linearSolver in ('direct', 'hessenberg') or (banded and linearSolver == 'auto')
+    addSolverParam['hessenberg'] = linearSolver == 'hessenberg'
+    
+    if(jacSparsity is not None and banded):
+        raise ValueError("A banded Jacobian can't have a sparsity pattern")
+    if(isinstance(jacSparsity, str)):
+        if(jacSparsity != 'auto'):
+            raise ValueError("Unknown Jacobian sparsity: " + jacSparsity)
+    elif(jacSparsity is not None):
+        jacSparsity = scipy.sparse.csr_matrix(jacSparsity, dtype=bool)
+        if(jacSparsity.shape != (N, N)):
+            raise ValueError("The Jacobian sparsity pattern must have shape " + str((N, N)))
+    addSolverParam['jacSparsity'] = jacSparsity
+    addSolverParam['jacColors'] = None
+    addSolverParam['vectorized'] = vectorized
+    if(jacMethod not in ('forward', 'complex')):
+        raise ValueError("Unknown Jacobian differentiation method: " + str(jacMethod))
+    addSolverParam['jacMethod'] = jacMethod
+    if(jacUpdate not in (None, 'broyden')):
+        raise ValueError("Unknown Jacobian update: " + str(jacUpdate))
+    addSolverParam['jacUpdate'] = jacUpdate
+    addSolverParam['jacUpdateMaxRank'] = 10
+    
+    if(matrixFree == 'auto'):
+        matrixFree = (N >= MATRIX_FREE_THRESHOLD and not direct and not banded and jacSparsity is None 
+                      and jacUpdate is None)
+    if(matrixFree and direct):
+        raise ValueError("A matrix-free Jacobian can only be used with the iterative linear solver")
+    if(matrixFree and (banded or jacSparsity is not None)):
+        raise ValueError("A matrix-free Jacobian can't be banded or have a sparsity pattern")
+    if(matrixFree and jacUpdate is not None):
+        raise ValueError("A matrix-free Jacobian can't be updated")
+    addSolverParam['matrixFree'] = matrixFree
+    
+    #There is no matrix to build the preconditioners from with a matrix-free Jacobian
+    if(matrixFree and preconditioner == 'auto'):
+        preconditioner = None
+    if(matrixFree and preconditioner is not None):
+        raise ValueError("A matrix-free Jacobian can't be used with a preconditioner")
+    addSolverParam['preconditioner'] = preconditioner
+    addSolverParam['iluDropTol'] = 1e-4
+    addSolverParam['iluFillFactor'] = 10
+    addSolverParam['jacobiBlockSize'] = 1
+    
+    #The Jacobian is frozen and only estimated again when the solver statistics show that it is outdated or that
+    #estimating it is cheap compared with the step (see _JacobianRefresh)
+    addSolverParam['freezeJac'] = True
+    addSolverParam['jacMaxAge'] = 20
+    addSolverParam['jacRefreshRate'] = 0.3
+    addSolverParam['jacRefreshGmresGrowth'] = 2
+    addSolverParam['jacRefreshCost'] = 1
+    #The updated Jacobian is used instead of estimating it again in each step
+    if(jacUpdate is not None):
+        addSolverParam['jacRefreshCost'] = None
+    #The systems of small problems are solved faster with an LU factorization than with GMRES iterations
+    addSolverParam['iterative'] = N>15
+    
+    #Matrix-free Jacobians can only be used by the iterative solver
+    if(matrixFree or linearSolver == 'iterative'):
         addSolverParam['iterative'] = True
-    else:
-        addSolverParam['freezeJac'] = False
+    elif(direct):
         addSolverParam['iterative'] = False
     
     return addSolverParam
@@ -1560,7 +3626,9 @@ All this functions have the same structure, and their names explicitly say the t
     @param y0 (array): initial condition on y (can be a vector).
     @param t (array): a sequence of time points for which to solve for y. The initial value point should be the first 
             element of this sequence. And the last one the final time.
-    @param args (tuple): extra arguments to pass to function.
+    @param args (tuple): extra arguments to pass to func and grad. They are sent to the workers once per call with
+            the problem (see _registerProblem(..)), so the data of the problem (e.g. large read-only matrices) should
+            be passed here: the worker processes only see module globals as they were when the pool was started.
     @param full_output (bool): true if user wants a dictionary of optional outputs as the second output.
     @param rtol, atol (float): the input parameters rtol (relative tolerance) and atol (absolute tolerance)
             determine the error control performed by the solver. See  function _error_norm(y1, y2, atol, rtol).
@@ -1576,12 +3644,22 @@ All this functions have the same structure, and their names explicitly say the t
     @param p (int): the order of extrapolation if order is fixed, or the starting order otherwise.
     @param nworkers (int): the number of workers working in parallel. If nworkers==None, then 
         the the number of workers is set to the number of CPUs on the running machine.
-    @param seq (callable(i), int i>=1): the step-number sequence (examples II.9.1 , 9.6, 9.35 ref I).
+    @param seq (StepSequence or callable(i), int i>=1): the step-number sequence (examples II.9.1 , 9.6, 9.35 ref I).
+        StepSequence objects are recommended (they cache the sequence tables and can be pickled, see StepSequence).
         The step number sequence can be changed forcefully in some cases for interpolation purposes.
         See _getDenseAndSequence(.) function.
     @param adaptive (string): specifies the strategy of integration. Can take three values:
         - "fixed" = use fixed step size and order strategy.
         - "order" or any other string = use adaptive step size and adaptive order strategy (recommended).
+    @param pool (WorkerPool or concurrent.futures executor): long-lived pool of workers (processes or threads) to
+            reuse across solver calls (see WorkerPool and worker_pool(..)). If None, the default pool is used or a new
+            pool of processes is created for this call.
+    @param parallel (bool or string): True to compute the stages in parallel, False to compute them serially or
+            'auto' to decide it by measuring the stage computation time against the pool overhead (recommended).
+    @param schedule (string or StageCostModel): 'static' to split the stages between the workers by their number 
+            of inner steps, 'dynamic' to send them largest first to the first worker that is free or 'feedback' (or
+            a StageCostModel) to split them with a cost model fitted with the measured stage timings 
+            (see _balance_load(..)).
 
     @return: 
         @return ys (2D-array, shape (len(t), len(y0))): array containing the value of y for each desired time in t, with 
@@ -1591,11 +3669,22 @@ All this functions have the same structure, and their names explicitly say the t
             'fe_seq'    cumulative number of sequential derivative evaluations
             'nfe'       cumulative number of total derivative evaluations
             'nst'       cumulative number of successful time steps
+            'nrej'      cumulative number of rejected time steps
             'nje'       cumulative number of either Jacobian evaluations (when 
                         analytic Jacobian is provided) or Jacobian estimations
                         (when no analytic Jacobian is provided)
             'h_avg'     average step size
             'k_avg'     average extrapolation order
+            'parallel'  whether the stages were computed in parallel (True) or serially (False)
+            'idle_time' cumulative time (in seconds) that each worker has been idle while the stages were 
+                        computed (None if the pool doesn't report it)
+            'nlu'       number of LU factorizations computed (semi implicit methods with direct solver)
+            'lu_hits'   number of LU factorizations reused from previous steps
+            'lu_hit_rate' lu_hits/(nlu+lu_hits)
+            'gmres_iters' number of GMRES iterations (semi implicit methods with iterative solver)
+            'nprec'     number of preconditioners built for GMRES
+            'prec_hits' number of preconditioners reused from previous steps
+            'prec_time' time (in seconds) spent building preconditioners (added up over all the workers)
 
 
     CHECK THIS:
@@ -1606,8 +3695,8 @@ All this functions have the same structure, and their names explicitly say the t
 '''
 
 def ex_midpoint_explicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=(lambda t: 2*t), p=4, 
-        nworkers=None, adaptative="order"):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=StepSequence('harmonic', 2), p=4, 
+        nworkers=None, adaptative="order", pool=None, parallel='auto', schedule='static'):
     ''' 
     Parallel extrapolation with midpoint explicit method
     
@@ -1622,13 +3711,14 @@ def ex_midpoint_explicit_parallel(func, grad, y0, t, args=(), full_output=0, rto
     return __extrapolation_parallel(method,  {}, func, grad, y0, t, args=args,
         full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, robustness_factor=robustness,
          p=k, nworkers=nworkers, smoothing=smoothing, symmetric=True, seq=seq, adaptative=adaptative,
-         addSolverParam=addSolverParam)
+         addSolverParam=addSolverParam, pool=pool, parallel=parallel, schedule=schedule)
 
 
 
 def ex_midpoint_implicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'gbs', seq=(lambda t: 2*(2*t-1)), p=4,
-        nworkers=None, adaptative="order"):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'gbs', seq=StepSequence('harmonic', 4, -2), p=4,
+        nworkers=None, adaptative="order", pool=None, parallel='auto', schedule='static', nonlinear_solver='newton',
+        ml=None, mu=None, jac_sparsity=None, vectorized=False, jac_method='forward'):
     ''' 
     Parallel extrapolation with midpoint implicit method
     
@@ -1638,17 +3728,33 @@ def ex_midpoint_implicit_parallel(func, grad, y0, t, args=(), full_output=0, rto
     
     k=p//2
     
-    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True)
+    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True, preconditioner=None, ml=ml, mu=mu,
+                                                    jacSparsity=jac_sparsity, vectorized=vectorized, jacMethod=jac_method)
+    
+    methodargs = {}
+    if(nonlinear_solver == 'newton'):
+        #The Jacobian of each step is used in the Newton iterations of all the stages (factored once for 
+        #each inner step size, see _getStageMethodArgs(..)) 
+        methodargs["J00"] = None
+        addSolverParam['matrixStepFactor'] = 0.5
+        addSolverParam['iterative'] = False
+        #With fixed steps the tolerances don't bound the error, so the stages are solved down to roundoff
+        if(adaptative == 'fixed'):
+            addSolverParam['newtonTol'] = np.finfo(float).eps/rtol
+    elif(nonlinear_solver != 'fsolve'):
+        raise ValueError("Unknown nonlinear solver: " + str(nonlinear_solver))
 
-    return __extrapolation_parallel(method, {}, func, grad, y0, t, args=args,
+    return __extrapolation_parallel(method, methodargs, func, grad, y0, t, args=args,
         full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, robustness_factor=robustness,
          p=k, nworkers=nworkers, smoothing=smoothing, symmetric=True, seq=seq, adaptative=adaptative,
-         addSolverParam=addSolverParam)
+         addSolverParam=addSolverParam, pool=pool, parallel=parallel, schedule=schedule)
 
 
 def ex_midpoint_semi_implicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'semiimp', seq=(lambda t: 2*(2*t-1)), p=4,
-        nworkers=None, adaptative="order"):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'semiimp', seq=StepSequence('harmonic', 4, -2), p=4,
+        nworkers=None, adaptative="order", pool=None, parallel='auto', schedule='static', preconditioner='auto',
+        matrix_free='auto', linear_solver='auto', ml=None, mu=None, jac_sparsity=None, vectorized=False,
+        jac_method='forward', jac_update=None):
     ''' 
     Parallel extrapolation with midpoint semi-implicit method
     
@@ -1658,23 +3764,25 @@ def ex_midpoint_semi_implicit_parallel(func, grad, y0, t, args=(), full_output=0
     
     k=p//2
     
-    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True)
+    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True, preconditioner=preconditioner,
+                                                    matrixFree=matrix_free if grad is None else False,
+                                                    linearSolver=linear_solver, ml=ml, mu=mu, jacSparsity=jac_sparsity,
+                                                    vectorized=vectorized, jacMethod=jac_method,
+                                                    jacUpdate=jac_update)
     
     methodargs = {}
+    #The matrices I-step*J00 are never built with an identity matrix (see _ShiftedJacobian)
     methodargs["J00"] = None
-    
-    methodargs["I"] = np.identity(len(y0), dtype=float)
-    methodargs["Isparse"] = np.identity(len(y0), dtype=float)  
 
     return __extrapolation_parallel(method, methodargs, func, grad, y0, t, args=args,
         full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, robustness_factor=robustness,
          p=k, nworkers=nworkers, smoothing=smoothing, symmetric = True, seq=seq, adaptative=adaptative,
-         addSolverParam=addSolverParam)
+         addSolverParam=addSolverParam, pool=pool, parallel=parallel, schedule=schedule)
 
 
 def ex_euler_explicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=(lambda t: t), p=4,
-        nworkers=None, adaptative="order"):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=StepSequence('harmonic'), p=4,
+        nworkers=None, adaptative="order", pool=None, parallel='auto', schedule='static'):
     ''' 
     Parallel extrapolation with euler explicit method
     
@@ -1688,12 +3796,14 @@ def ex_euler_explicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1
     return __extrapolation_parallel(method, {}, func, grad, y0, t, args=args,
         full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, robustness_factor=robustness,
          p=p, nworkers=nworkers, smoothing=smoothing, symmetric = False, seq=seq, adaptative=adaptative,
-         addSolverParam=addSolverParam)
+         addSolverParam=addSolverParam, pool=pool, parallel=parallel, schedule=schedule)
     
     
 def ex_euler_semi_implicit_parallel(func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=(lambda t: 2*(2*t-1)), p=4,
-        nworkers=None, adaptative="order"):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, robustness=2, smoothing = 'no', seq=StepSequence('harmonic', 4, -2), p=4,
+        nworkers=None, adaptative="order", pool=None, parallel='auto', schedule='static', preconditioner='auto',
+        matrix_free='auto', linear_solver='auto', ml=None, mu=None, jac_sparsity=None, vectorized=False,
+        jac_method='forward', jac_update=None):
     ''' 
     Parallel extrapolation with euler semi-implicit method
     
@@ -1701,21 +3811,20 @@ def ex_euler_semi_implicit_parallel(func, grad, y0, t, args=(), full_output=0, r
     
     method = _euler_semiimplicit
     
-    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True)
+    addSolverParam = _getAdditionalSolverParameters(len(y0), atol, rtol, addWork=True, preconditioner=preconditioner,
+                                                    matrixFree=matrix_free if grad is None else False,
+                                                    linearSolver=linear_solver, ml=ml, mu=mu, jacSparsity=jac_sparsity,
+                                                    vectorized=vectorized, jacMethod=jac_method,
+                                                    jacUpdate=jac_update)
     
     methodargs = {}
+    #The matrices I-step*J00 are never built with an identity matrix (see _ShiftedJacobian)
     methodargs["J00"] = None
-    
-    #The identity matrices are created here so that they can be reused (and are not 
-    #recalculated), and also because global variables cause problems with multiprocessing
-    #(processes would lock on the I or Isparse global variable)
-    methodargs["I"] = np.identity(len(y0), dtype=float)
-    methodargs["Isparse"] = np.identity(len(y0), dtype=float)  
 
     return __extrapolation_parallel(method, methodargs, func, grad, y0, t, args=args,
         full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, robustness_factor=robustness,
          p=p, nworkers=nworkers, smoothing=smoothing, symmetric = False, seq=seq, adaptative=adaptative,
-         addSolverParam=addSolverParam)
+         addSolverParam=addSolverParam, pool=pool, parallel=parallel, schedule=schedule)
 
 '''
 END BLOCK 2: General extrapolation solvers' functions. These functions can be used to solve any ODE.
@@ -1744,7 +3853,9 @@ parameters are set to the 'optimal').
     @param y0 (array): initial condition on y (can be a vector).
     @param t (array): a sequence of time points for which to solve for y. The initial value point should be the first 
             element of this sequence. And the last one the final time.
-    @param args (tuple): extra arguments to pass to function.
+    @param args (tuple): extra arguments to pass to func and grad. They are sent to the workers once per call with
+            the problem (see _registerProblem(..)), so the data of the problem (e.g. large read-only matrices) should
+            be passed here: the worker processes only see module globals as they were when the pool was started.
     @param full_output (bool): true if user wants a dictionary of optional outputs as the second output.
     @param rtol, atol (float): the input parameters rtol (relative tolerance) and atol (absolute tolerance)
             determine the error control performed by the solver. See  function _error_norm(y1, y2, atol, rtol).
@@ -1757,6 +3868,56 @@ parameters are set to the 'optimal').
     @param adaptive (string): specifies the strategy of integration. Can take three values:
         - "fixed" = use fixed step size and order strategy.
         - "order" or any other string = use adaptive step size and adaptive order strategy (recommended).
+    @param pool (WorkerPool or concurrent.futures executor): long-lived pool of workers (processes or threads) to
+            reuse across solver calls (see WorkerPool and worker_pool(..)). If None, the default pool is used or a new
+            pool of processes is created for this call.
+    @param parallel (bool or string): True to compute the stages in parallel, False to compute them serially or
+            'auto' to decide it by measuring the stage computation time against the pool overhead (recommended).
+    @param schedule (string or StageCostModel): 'static' to split the stages between the workers by their number 
+            of inner steps, 'dynamic' to send them largest first to the first worker that is free or 'feedback' (or
+            a StageCostModel) to split them with a cost model fitted with the measured stage timings 
+            (see _balance_load(..)).
+    @param preconditioner (string or callable): preconditioner of the iterative linear solver used by the semi implicit
+            methods for large systems: 'ilu', 'jacobi', 'auto' (ilu for sparse Jacobians, jacobi for dense ones), None
+            or a function that takes the matrix I-step*J and returns the preconditioner (see _buildPreconditioner(..)).
+    @param matrix_free (bool or string): only for semi implicit methods without grad. If True, the Jacobian is not
+            estimated: its products with vectors are approximated with directional finite differences in the 
+            iterative linear solver (see _MatrixFreeJacobian), which can't be preconditioned. 'auto' to use it when
+            len(y0) >= MATRIX_FREE_THRESHOLD.
+    @param nonlinear_solver (string): only for the midpoint implicit method, 'newton' to solve the nonlinear systems
+            with simplified Newton iterations that reuse the Jacobian of the step (see _solve_newton(..)), or 
+            'fsolve' to solve them with scipy.optimize.fsolve.
+    @param linear_solver (string): linear solver of the semi implicit methods: 'iterative' (GMRES), 'direct' (LU
+            factorization of each stage matrix I-step*J), 'hessenberg' (direct, the Jacobian is reduced once to 
+            Hessenberg form and then each stage matrix is factored in O(N^2), recommended for mid-size dense 
+            stiff problems) or 'auto' (iterative if len(y0)>15, direct otherwise).
+    @param ml, mu (int): only for implicit and semi implicit methods, lower and upper bandwidths of the Jacobian if it
+            is banded (as in scipy.integrate.odeint). grad must then return the Jacobian in band form, an array of shape
+            (ml+mu+1, len(y0)) with jac[mu+i-j, j] = df_i/dy_j. Without grad, the Jacobian is estimated with ml+mu+1
+            function evaluations instead of len(y0), and the linear systems are solved with banded LU by default 
+            (see _BandedJacobian). If only one of them is given the other one is 0.
+    @param jac_sparsity (2D array, sparse matrix or string): only for implicit and semi implicit methods without grad,
+            sparsity pattern of the Jacobian (nonzero where df_i/dy_j can be nonzero). The Jacobian is then estimated 
+            as a sparse matrix with one function evaluation for each group of columns that don't share any row 
+            (see _estimateJacobian(..)). 'auto' to detect the pattern by probing func (len(y0) function evaluations
+            done only once). None (default) to estimate it as a dense matrix.
+    @param vectorized (bool): only for implicit and semi implicit methods without grad, whether func can evaluate
+            a block of states at once: func(Y, t, args) with Y of shape (len(y0), m) returns an array of the same
+            shape (as the vectorized RHS of scipy.integrate.solve_ivp). The perturbed states of the Jacobian
+            estimations are then evaluated with one call instead of one call per column (or column group).
+    @param jac_method (string): only for implicit and semi implicit methods without grad, how the Jacobian is
+            estimated: 'forward' (forward differences) or 'complex' (complex-step differentiation, exact to machine 
+            precision with the same number of function evaluations, but func must be real-analytic and accept
+            complex states, see forward_diff.differences).
+    @param jac_update (string): only for semi implicit methods without grad, how the Jacobian is updated
+            between estimations: 'broyden' (Broyden's rank-1 updates with one function evaluation per step, which
+            is reused by the step; the Jacobian is still estimated again when it is outdated or every 10 updates,
+            and the factorizations of the last estimated Jacobian are updated in O(N^2) instead of computed again.
+            The midpoint implicit method doesn't take it: its Newton iterations already correct an outdated
+            Jacobian, and the updated one only made them converge slower and reject more steps) or None (the Jacobian
+            is reused as it is until it is outdated, and estimated in each step when that is cheap compared with 
+            the step, as for small systems). The Jacobian is outdated when a step is rejected, the order decreases
+            or the Newton or GMRES iterations converge slowly (as in LSODE).
 
     @return: 
         @return ys (2D-array, shape (len(t), len(y0))): array containing the value of y for each desired time in t, with 
@@ -1766,37 +3927,56 @@ parameters are set to the 'optimal').
             'fe_seq'    cumulative number of sequential derivative evaluations
             'nfe'       cumulative number of total derivative evaluations
             'nst'       cumulative number of successful time steps
+            'nrej'      cumulative number of rejected time steps
             'nje'       cumulative number of either Jacobian evaluations (when 
                         analytic Jacobian is provided) or Jacobian estimations
                         (when no analytic Jacobian is provided)
             'h_avg'     average step size
             'k_avg'     average extrapolation order
+            'parallel'  whether the stages were computed in parallel (True) or serially (False)
+            'idle_time' cumulative time (in seconds) that each worker has been idle while the stages were 
+                        computed (None if the pool doesn't report it)
+            'nlu'       number of LU factorizations computed (semi implicit methods with direct solver)
+            'lu_hits'   number of LU factorizations reused from previous steps
+            'lu_hit_rate' lu_hits/(nlu+lu_hits)
+            'gmres_iters' number of GMRES iterations (semi implicit methods with iterative solver)
+            'nprec'     number of preconditioners built for GMRES
+            'prec_hits' number of preconditioners reused from previous steps
+            'prec_time' time (in seconds) spent building preconditioners (added up over all the workers)
 
 '''
 
 def extrapolation_parallel(method, func, grad, y0, t, args=(), full_output=0, rtol=1.0e-8,
-        atol=1.0e-8, h0=0.5, mxstep=10e4, p=4, nworkers=None, adaptative = 'order'):
+        atol=1.0e-8, h0=0.5, mxstep=10e4, p=4, nworkers=None, adaptative = 'order', pool=None, parallel='auto', schedule='static',
+        preconditioner='auto', matrix_free='auto', linear_solver='auto', nonlinear_solver='newton', ml=None, mu=None,
+        jac_sparsity=None, vectorized=False, jac_method='forward', jac_update=None):
         
         if(method == 'midpoint explicit'):
             return  ex_midpoint_explicit_parallel(func, grad, y0, t, args=args,
                 full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, p=p, 
-                nworkers=nworkers, adaptative=adaptative)
+                nworkers=nworkers, adaptative=adaptative, pool=pool, parallel=parallel, schedule=schedule)
         elif(method == 'midpoint implicit'):
             return ex_midpoint_implicit_parallel(func, grad, y0, t, args=args,
                 full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, p=p, 
-                nworkers=nworkers, adaptative=adaptative)
+                nworkers=nworkers, adaptative=adaptative, pool=pool, parallel=parallel, schedule=schedule,
+                nonlinear_solver=nonlinear_solver, ml=ml, mu=mu, jac_sparsity=jac_sparsity, vectorized=vectorized,
+                jac_method=jac_method)
         elif(method == 'midpoint semi implicit'):
             return ex_midpoint_semi_implicit_parallel(func, grad, y0, t, args=args,
                 full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, p=p, 
-                nworkers=nworkers, adaptative=adaptative)
+                nworkers=nworkers, adaptative=adaptative, pool=pool, parallel=parallel, schedule=schedule,
+                preconditioner=preconditioner, matrix_free=matrix_free, linear_solver=linear_solver, ml=ml, mu=mu,
+                jac_sparsity=jac_sparsity, vectorized=vectorized, jac_method=jac_method, jac_update=jac_update)
         elif(method == 'euler explicit'):
             return ex_euler_explicit_parallel(func, grad, y0, t, args=args,
                 full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, p=p, 
-                nworkers=nworkers, adaptative=adaptative)
+                nworkers=nworkers, adaptative=adaptative, pool=pool, parallel=parallel, schedule=schedule)
         
         return ex_euler_semi_implicit_parallel(func, grad, y0, t, args=args,
                 full_output=full_output, rtol=rtol, atol=atol, h0=h0, mxstep=mxstep, p=p, 
-                nworkers=nworkers, adaptative=adaptative)
+                nworkers=nworkers, adaptative=adaptative, pool=pool, parallel=parallel, schedule=schedule,
+                preconditioner=preconditioner, matrix_free=matrix_free, linear_solver=linear_solver, ml=ml, mu=mu,
+                jac_sparsity=jac_sparsity, vectorized=vectorized, jac_method=jac_method, jac_update=jac_update)
             
             
     
\ No newline at end of file
@@ -1,28 +1,209 @@
 
 import numpy as np
+import scipy.sparse
 
-def Jacobian(func,y,fev=None, args=()):
+def Jacobian(func,y,fev=None, args=(), ml=None, mu=None, vectorized=False, method='forward'):
     '''
     Forward differentiation formula to estimate the jacobian.
     func: R^n --> R^n
-    '''    
+
+    If the lower (ml) or upper (mu) bandwidth is given, the Jacobian is banded and it is returned in LAPACK
+    band form (as scipy.integrate.odeint's banded Jacobians): J[mu+i-j, j] holds the derivative of func_i
+    with respect to y_j. The columns that are ml+mu+1 apart don't share any row, so they are perturbed
+    together and only ml+mu+1 evaluations of func are needed instead of n.
+
+    The estimation is split in columnGroups, differences and assemble so that the differences of the groups
+    can be computed in parallel.
+
+    If vectorized, func evaluates a block of states at once (func(Y,args) with Y of shape (n,m) returns an
+    array of shape (n,m), as the vectorized RHS of scipy.integrate.solve_ivp), and all the perturbations are
+    evaluated in one call (see differences).
+
+    With method 'complex' the derivatives are estimated with complex-step differentiation (see differences).
+    '''
     fe_tot = 0
     if(fev is None):
         fev=func(y,args)
         fe_tot +=1
-    
+
     n=len(y)
-    J= np.zeros((n,n))
+    df, fe_tot_ = differences(func, y, fev, columnGroups(n, ml, mu), args, vectorized, method)
+    return (assemble(df, n, ml, mu),fe_tot+fe_tot_)
+
+def columnGroups(n, ml=None, mu=None, colors=None):
+    '''
+    Groups of columns of the jacobian that are perturbed together (with one evaluation of func): one group
+    per column for dense jacobians, the columns ml+mu+1 apart for banded ones (see Jacobian) or the columns
+    of the same color for sparse ones (see colorColumns).
+
+    Returns the list of groups (arrays of column indices).
+    '''
+    if(colors is not None):
+        ncolors = colors.max()+1 if len(colors) > 0 else 0
+        return [np.flatnonzero(colors == color) for color in range(ncolors)]
+    if(ml is not None or mu is not None):
+        width = (ml or 0)+(mu or 0)+1
+        return [np.arange(group, n, width) for group in range(min(width,n))]
+    return [np.array([i]) for i in range(n)]
+
+def differences(func,y,fev,groups,args=(),vectorized=False,method='forward'):
+    '''
+    Forward differences of func perturbing together the columns of each group. If vectorized, the perturbed
+    states of all the groups are evaluated in one call of func (see Jacobian).
+
+    With method 'complex', complex-step differentiation is used instead: df[g] = Im(func(y+i*h*e_g))/h. There
+    is no subtraction, so h can be tiny and the derivatives are exact to machine precision (instead of having
+    the truncation and cancellation errors of the forward differences, whose best step is problem dependent),
+    with the same number of evaluations of func. func must be real-analytic and accept complex states (no
+    abs, comparisons or casts to float of the state, see Martins, Sturdza and Alonso, "The complex-step
+    derivative approximation", ACM TOMS 2003).
+
+    Returns (df, fe_tot), df[g] being (func(y+h*e_g)-fev)/h, e_g the sum of the unit vectors of group g, and
+    fe_tot the number of states evaluated.
+    '''
+    if(method == 'complex'):
+        h = 1e-20
+        if(vectorized):
+            Y = np.repeat(np.asarray(y, dtype=complex)[:,np.newaxis], len(groups), axis=1)
+            for g, columns in enumerate(groups):
+                Y[columns,g] += 1j*h
+            df = np.imag(np.asarray(func(Y,args)).reshape(Y.shape)).T/h
+            return (np.ascontiguousarray(df),len(groups))
+        yc = np.asarray(y, dtype=complex)
+        df = np.zeros((len(groups),len(y)))
+        for g, columns in enumerate(groups):
+            ycolumns = yc[columns].copy()
+            yc[columns] += 1j*h
+            df[g] = np.imag(func(yc,args))/h
+            yc[columns] = ycolumns
+        return (df,len(groups))
+    if(method != 'forward'):
+        raise ValueError("Unknown differentiation method: " + str(method))
     # The step is the machine precision * 10^2
     # It is problem dependent... (add as ~tolerance)
     # Even better, copy how h is chosen by scipy/integrate/odepack/prja.f (lines 80-100)
     # Explained in section 3.4.5 of Description and Use of LSODE, the Livermore Solver for ODEs
     h = np.finfo(np.dtype(type(y[0]))).eps*1e2
-    for i in range(n):
-        yi = y[i]
-        y[i] += h
-        J[:,i] = 1/h*(func(y,args)-fev)
-        y[i]=yi
+    if(vectorized):
+        Y = np.repeat(np.asarray(y, dtype=float)[:,np.newaxis], len(groups), axis=1)
+        for g, columns in enumerate(groups):
+            Y[columns,g] += h
+        F = np.asarray(func(Y,args)).reshape(Y.shape)
+        df = 1/h*(F-np.asarray(fev)[:,np.newaxis]).T
+        return (np.ascontiguousarray(df),len(groups))
+    df = np.zeros((len(groups),len(y)))
+    fe_tot = 0
+    for g, columns in enumerate(groups):
+        ycolumns = y[columns].copy()
+        y[columns] += h
+        df[g] = 1/h*(func(y,args)-fev)
+        y[columns] = ycolumns
         fe_tot +=1
-        
-    return (J,fe_tot)
\ No newline at end of file
+    return (df,fe_tot)
+
+def assemble(df, n, ml=None, mu=None, sparsity=None, colors=None):
+    '''
+    Assembles the jacobian from the differences of all its column groups (see columnGroups and differences):
+    a dense array, a banded jacobian in band form (see Jacobian) or a CSR matrix with the given sparsity
+    (and colors, see SparseJacobian).
+    '''
+    if(sparsity is not None):
+        sparsity = sparsity.tocoo()
+        values = df[colors[sparsity.col], sparsity.row]
+        return scipy.sparse.csr_matrix((values, (sparsity.row, sparsity.col)), shape=sparsity.shape)
+    if(ml is not None or mu is not None):
+        ml = ml or 0
+        mu = mu or 0
+        width = ml+mu+1
+        J = np.zeros((width,n))
+        for group in range(min(width,n)):
+            columns = np.arange(group, n, width)
+            for k in range(width):
+                #J[k,j] is the derivative of func_i with i = j+k-mu
+                rows = columns+k-mu
+                valid = (rows >= 0) & (rows < n)
+                J[k,columns[valid]] = df[group,rows[valid]]
+        return J
+    return np.ascontiguousarray(df.T)
+
+def detectSparsity(func,y,args=(),vectorized=False):
+    '''
+    Detects the sparsity pattern of the jacobian by probing func: each component is perturbed at a time (n
+    evaluations of func, done only once) and the outputs that change are its nonzeros. The probing point is
+    a random perturbation of y so that the entries that happen to be zero at y (e.g. y_j*y_k with y_j=0)
+    are also detected. If vectorized (see Jacobian), the perturbations are evaluated in blocks of states
+    (of about 10^6 values, so that the memory used stays O(n)).
+
+    Returns (sparsity, fe_tot), sparsity being a boolean CSR matrix.
+    '''
+    n=len(y)
+    yprobe = y + 1e-3*(1+np.abs(y))*np.random.RandomState(0).rand(n)
+    fprobe = func(yprobe,args)
+    fe_tot = 1
+    # The perturbation is much larger than the one used to estimate the jacobian, so that the small
+    # derivatives also change the output (beyond its rounding)
+    h = 1e-4*(1+np.abs(yprobe))
+    indices = []
+    indptr = [0]
+    if(vectorized):
+        block = max(1, 10**6//max(n,1))
+        for start in range(0, n, block):
+            columns = np.arange(start, min(start+block, n))
+            Y = np.repeat(yprobe[:,np.newaxis], len(columns), axis=1)
+            Y[columns,np.arange(len(columns))] += h[columns]
+            changed = np.asarray(func(Y,args)).reshape(Y.shape) != fprobe[:,np.newaxis]
+            fe_tot += len(columns)
+            for c in range(len(columns)):
+                rows = np.flatnonzero(changed[:,c])
+                indices.append(rows)
+                indptr.append(indptr[-1]+len(rows))
+    else:
+        for i in range(n):
+            yi = yprobe[i]
+            yprobe[i] += h[i]
+            rows = np.flatnonzero(func(yprobe,args) != fprobe)
+            yprobe[i] = yi
+            fe_tot +=1
+            indices.append(rows)
+            indptr.append(indptr[-1]+len(rows))
+    indices = np.concatenate(indices) if n > 0 else np.zeros(0, dtype=int)
+    sparsity = scipy.sparse.csc_matrix((np.ones(len(indices), dtype=bool), indices, indptr), shape=(n,n))
+    return (sparsity.tocsr(), fe_tot)
+
+def colorColumns(sparsity):
+    '''
+    Groups the columns of the jacobian with the given sparsity pattern so that the columns of each group don't
+    share any nonzero row (greedy coloring of the column intersection graph, largest columns first). The columns
+    of a group can then be estimated with one evaluation of func (see SparseJacobian).
+
+    Returns colors (array), colors[j] being the group of column j.
+    '''
+    sparsity = scipy.sparse.csr_matrix(sparsity, dtype=bool)
+    columns = sparsity.tocsc()
+    n = sparsity.shape[1]
+    colors = -np.ones(n, dtype=int)
+    for j in np.argsort(-np.diff(columns.indptr), kind='mergesort'):
+        rows = columns.indices[columns.indptr[j]:columns.indptr[j+1]]
+        neighbours = np.concatenate([sparsity.indices[sparsity.indptr[r]:sparsity.indptr[r+1]] for r in rows]) \
+                        if len(rows) > 0 else np.zeros(0, dtype=int)
+        used = colors[neighbours]
+        used = np.unique(used[used >= 0])
+        #First color not used by the neighbours
+        free = np.flatnonzero(np.arange(len(used)) != used)
+        colors[j] = free[0] if len(free) > 0 else len(used)
+    return colors
+
+def SparseJacobian(func,y,sparsity,colors,fev=None, args=(), vectorized=False, method='forward'):
+    '''
+    Forward differentiation formula to estimate a sparse jacobian, with one evaluation of func for each group of
+    columns (see colorColumns) instead of one for each column (or with one vectorized call, see Jacobian).
+
+    Returns (J, fe_tot), J being a CSR matrix with the given sparsity pattern.
+    '''
+    fe_tot = 0
+    if(fev is None):
+        fev=func(y,args)
+        fe_tot +=1
+
+    df, fe_tot_ = differences(func, y, fev, columnGroups(len(y), colors=colors), args, vectorized, method)
+    return (assemble(df, len(y), sparsity=sparsity, colors=colors),fe_tot+fe_tot_)
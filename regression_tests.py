@@ -1,7 +1,11 @@
 from __future__ import division
 import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 import math 
+import os
 import ex_parallel
+import forward_diff
 import matplotlib.pyplot as plt
 import twelve_tests as tst
 
@@ -22,12 +26,12 @@ regressionvalues = {'midpoint explicit':[
          4.4328429816e-11,   2.2526425170e-13,   8.2156503822e-15]                      
                                          ]                    
                     ,'midpoint implicit':[
-                        [1.5293204761e-08,   1.1928156003e-08,   1.5104319287e-09,
-         8.1136216588e-13,   4.2250587027e-15,   7.5447476834e-16],
-                        [ 1.8031544714e-08,   1.8035168218e-08,   3.1238860457e-09,
-         6.0817623062e-13,   1.7484057935e-15,   2.4208695602e-15],
-                        [3.8327484742e-08,   1.1024071656e-09,   8.2266193857e-11,
-         8.5931262106e-14,   5.9952043330e-15,   1.5543122345e-15]                      
+                        [1.5293204761e-08,   1.1928156758e-08,   1.5104319287e-09,
+         8.1075858606e-13,   3.0178990734e-15,   7.5447476834e-16],
+                        [2.3715789479e-08,   1.7499246739e-08,   3.1061869339e-09,
+         3.0516405734e-13,   4.0347826003e-15,   1.9366956482e-14],
+                        [1.0448504340e-07,   1.8612626995e-09,   8.0732309726e-11,
+         1.5742962489e-13,   2.6645352591e-15,   1.1879386363e-14]
                                          ]
                     ,'midpoint semi implicit':[
                         [8.0450452184e-07,   8.0450452184e-07,   1.1962604868e-09,
@@ -63,12 +67,12 @@ regressionvaluesdense = {'midpoint explicit':[
          6.3902126450e-11,   2.5726071861e-13,   6.4646253816e-15]                        
                                          ]                    
                     ,'midpoint implicit':[
-                        [ 4.5573535834e-07,   4.5386635234e-07,   1.3496938571e-07,
-         3.7594370070e-10,   3.6022394936e-08,   6.9953683983e-09],
-                        [8.2413858176e-07,   8.2414062859e-07,   6.0333530921e-08,
-         1.2261597675e-09,   1.1225879293e-09,   3.5890791004e-09],
-                        [1.3820565861e-06,   1.3758790352e-06,   7.0553999910e-08,
-         1.1037088895e-07,   1.5887463787e-08,   2.6978897733e-09]                       
+                        [4.5573535834e-07,   4.5386635234e-07,   1.3496938571e-07,
+         3.7594378277e-10,   3.6022394936e-08,   6.9953683982e-09],
+                        [8.1783946028e-07,   8.2395134477e-07,   6.0330291525e-08,
+         1.2261497631e-09,   1.1225900654e-09,   3.5890704893e-09],
+                        [1.3680326109e-06,   1.3760729796e-06,   7.0553673929e-08,
+         1.1037111283e-07,   1.5887463484e-08,   2.4273495304e-09]
                                          ]
                     ,'midpoint semi implicit':[
                         [1.6844768967e-06,   1.6844768967e-06,   3.0290113955e-08,
@@ -206,6 +210,742 @@ def dense_tests():
     print("All tests passed")
 
 
+_mainPid = os.getpid()
+
+def f_crash(y, t):
+    #Kills the worker processes that evaluate it (not the main process)
+    if os.getpid() != _mainPid:
+        os._exit(1)
+    return -y
+
+def checkWorkerPool():
+    '''
+       Checks that reusing a long-lived pool of workers (passed explicitly or
+       through the worker_pool context manager) gives the same results as
+       creating a new pool in every solver call, and that computing the stages
+       serially (without creating shared memory files) or with dynamic or 
+       feedback scheduling gives the same results. Also checks that the workers
+       open a shared block again when its layout changes and close it when the
+       problem is released, that the dispatch overhead of a pool is measured once and
+       that the solver raises an error when a worker process dies.
+    '''
+    print("\n Executing worker pool tests")
+    sharedBuffer = ex_parallel.SharedBuffer()
+    try:
+        sharedBuffer.get(2, 4, float)
+        assert ex_parallel._getSharedArray((sharedBuffer.name, '<f8', (4, 4))).shape == (4, 4)
+        assert ex_parallel._getSharedArray((sharedBuffer.name, '<f8', (2, 8))).shape == (2, 8), \
+            "SHARED BUFFER TEST FAILED: block with another layout not opened again"
+        ex_parallel._forgetProblem(None)
+        assert not ex_parallel._workerSharedArrays, "SHARED BUFFER TEST FAILED: block kept open"
+    finally:
+        sharedBuffer.close()
+    (f,exact) = alltestfunctions[0]
+    t0, tf = 0.1, 1
+    y0 = exact(t0)
+    for method in allmethods:
+        print("\n Method: " + method)
+        ys_ref = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, nworkers=2, parallel=True)
+        mkstemp = ex_parallel.tempfile.mkstemp
+        sharedFiles = []
+        ex_parallel.tempfile.mkstemp = lambda *args, **kwargs: sharedFiles.append(args) or mkstemp(*args, **kwargs)
+        try:
+            ys, infodict = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, nworkers=2, full_output=True)
+        finally:
+            ex_parallel.tempfile.mkstemp = mkstemp
+        np.testing.assert_array_equal(ys, ys_ref, "SERIAL TEST " + method + " FAILED")
+        assert len(sharedFiles) == 0, "SERIAL TEST " + method + " FAILED: shared memory file created"
+        assert not infodict['parallel'], "SERIAL TEST " + method + " FAILED: tiny problem computed in parallel"
+        for backend in ['processes', 'threads']:
+            with ex_parallel.WorkerPool(2, backend) as pool:
+                for i in range(3):
+                    ys = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, pool=pool, parallel=True)
+                    np.testing.assert_array_equal(ys, ys_ref, "WORKER POOL TEST " + method + " " + backend + " FAILED")
+                ys, infodict = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, pool=pool, parallel=True,
+                                                                  schedule='dynamic', full_output=True)
+                np.testing.assert_array_equal(ys, ys_ref, "DYNAMIC SCHEDULE TEST " + method + " " + backend + " FAILED")
+                assert len(infodict['idle_time']) == 2, "DYNAMIC SCHEDULE TEST " + method + " " + backend + " FAILED: no idle times"
+                ys = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, pool=pool, parallel=True,
+                                                        schedule='feedback')
+                np.testing.assert_array_equal(ys, ys_ref, "FEEDBACK SCHEDULE TEST " + method + " " + backend + " FAILED")
+                #The thread workers share the blocks opened by this process
+                assert not ex_parallel._workerSharedArrays, "SHARED BUFFER TEST " + backend + " FAILED: block kept open"
+        with ex_parallel.worker_pool(2):
+            ys = ex_parallel.extrapolation_parallel(method, f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, parallel=True)
+            np.testing.assert_array_equal(ys, ys_ref, "WORKER POOL CONTEXT TEST " + method + " FAILED")
+    
+    #The dispatch overhead of a pool is only measured in the first solver call
+    with ex_parallel.WorkerPool(2) as pool:
+        funcs = []
+        poolMap = pool.map
+        pool.map = lambda func, *args, **kwargs: funcs.append(func) or poolMap(func, *args, **kwargs)
+        for i in range(3):
+            ex_parallel.extrapolation_parallel('midpoint explicit', f, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, pool=pool)
+        assert funcs.count(ex_parallel._noop) == 3, "DISPATCH OVERHEAD TEST FAILED: pool measured more than once"
+    
+    #A worker that dies makes the pool raise instead of waiting forever for its result
+    for method in ['midpoint explicit', 'euler semi implicit']:
+        pool = ex_parallel.WorkerPool(2)
+        try:
+            ex_parallel.extrapolation_parallel(method, f_crash, None, y0, [t0, tf], atol=1e-7, rtol=1e-7, pool=pool, 
+                                               parallel=True)
+            assert False, "WORKER CRASH TEST " + method + " FAILED: no error raised"
+        except RuntimeError:
+            pass
+        assert pool.closed, "WORKER CRASH TEST " + method + " FAILED: pool not closed"
+        pool.close()
+    
+    print("All tests passed")
+
+def checkWorkerAffinity():
+    '''
+       Checks that the jobs are sent to the workers that computed the last jobs with
+       the same affinity key, that no free worker waits while there are pending
+       jobs that prefer a busy worker and that affinity doesn't send a small job
+       before a larger one.
+    '''
+    print("\n Executing worker affinity tests")
+    for backend in ['processes', 'threads']:
+        with ex_parallel.WorkerPool(2, backend) as pool:
+            results = pool.map(abs, [-1, -2], affinity=['a', 'b'])
+            assert results == [1, 2], "WORKER AFFINITY TEST " + backend + " FAILED"
+            assert pool.lastWorkers == [0, 1], "WORKER AFFINITY TEST " + backend + " FAILED"
+            pool.map(abs, [-1, -2], affinity=['b', 'a'])
+            assert pool.lastWorkers == [1, 0], "WORKER AFFINITY TEST " + backend + " FAILED: affinity not respected"
+            #Both jobs prefer worker 1, the second one goes to the free worker 0 instead of waiting
+            pool.map(abs, [-1, -2], affinity=['b', 'b'])
+            assert pool.lastWorkers == [1, 0], "WORKER AFFINITY TEST " + backend + " FAILED: free worker waited"
+            #The smallest job prefers worker 0, which gets the largest one instead
+            pool.map(abs, [-1, -2, -3], affinity=['c', 'd', 'a'], costs=[3, 2, 1])
+            assert pool.lastWorkers[:2] == [0, 1], "WORKER AFFINITY TEST " + backend + " FAILED: small job first"
+    
+    print("All tests passed")
+
+def checkProblemData():
+    '''
+       Checks that the workers use the problem data registered with the problem (the
+       BRUSS2D laplacian and size, passed in args) and not the module globals they had
+       when the pool was created, which are set for another problem size.
+    '''
+    print("\n Executing problem data tests")
+    tst.initializeBRUSS2DValues(5)
+    with ex_parallel.WorkerPool(2) as pool:
+        tst.initializeBRUSS2DValues(3)
+        test = tst.BRUSS2DProblem()
+        for grad in [test.RHSGradient, None]:
+            ys_ref = ex_parallel.ex_euler_semi_implicit_parallel(test.RHSFunction, grad, test.initialValue, [0, 1.5],
+                                                                 args=test.args, rtol=1e-6, atol=1e-6, nworkers=2,
+                                                                 parallel=False)
+            ys = ex_parallel.ex_euler_semi_implicit_parallel(test.RHSFunction, grad, test.initialValue, [0, 1.5],
+                                                             args=test.args, rtol=1e-6, atol=1e-6, pool=pool, parallel=True)
+            np.testing.assert_array_equal(ys, ys_ref, "PROBLEM DATA TEST FAILED")
+    
+    print("All tests passed")
+
+def checkStepSequence():
+    '''
+       Checks the values of the StepSequence objects, that they give the same
+       results as the equivalent lambdas and that they can be pickled.
+    '''
+    import pickle
+    print("\n Executing step sequence tests")
+    assert [ex_parallel.StepSequence('harmonic', 4, -2)(i) for i in range(1,6)] == [2,6,10,14,18]
+    assert [ex_parallel.StepSequence('romberg', 2)(i) for i in range(1,6)] == [2,4,8,16,32]
+    assert [ex_parallel.StepSequence('bulirsch')(i) for i in range(1,9)] == [1,2,3,4,6,8,12,16]
+    assert [ex_parallel.StepSequence('BD1983')(i) for i in range(1,6)] == [2,6,10,14,22]
+    assert ex_parallel.StepSequence([1,3,5])(3) == 5
+    assert ex_parallel.StepSequence('harmonic', 2).work(4) == 20
+    seq = pickle.loads(pickle.dumps(ex_parallel.StepSequence('bulirsch', 2)))
+    assert [seq(i) for i in range(1,6)] == [2,4,6,8,12]
+    
+    (f,exact) = alltestfunctions[0]
+    t0, tf = 0.1, 1
+    y0 = exact(t0)
+    ys_ref = ex_parallel.ex_midpoint_explicit_parallel(f, None, y0, [t0, 0.5, tf], atol=1e-7, rtol=1e-7, seq=(lambda t: 2*t))
+    ys = ex_parallel.ex_midpoint_explicit_parallel(f, None, y0, [t0, 0.5, tf], atol=1e-7, rtol=1e-7, 
+                                                   seq=ex_parallel.StepSequence('harmonic', 2))
+    np.testing.assert_array_equal(ys, ys_ref, "STEP SEQUENCE TEST FAILED")
+    
+    print("All tests passed")
+
+def checkExtrapolationTable():
+    '''
+       Checks that the vectorized extrapolation tableau fill gives the values of the
+       Aitken-Neville formulas (symmetric and non symmetric, scalar and vector
+       entries) and that the sequence is only evaluated the first time.
+    '''
+    print("\n Executing extrapolation tableau tests")
+    calls = []
+    def seq(j):
+        calls.append(j)
+        return 2*j
+    k = 5
+    for symmetric in [False, True]:
+        for j_initshift in [0, 1]:
+            for N in [1, 3]:
+                T = np.zeros((k+1, k+1, N))
+                T[1:,1] = np.cos(np.arange(1, k+1)[:,np.newaxis]*np.arange(1, N+1))
+                T_ref = T.copy()
+                for i in range(2, k+1):
+                    for j in range(i, k+1):
+                        ratio = seq(j+j_initshift)/seq(j+j_initshift-i+1)
+                        T_ref[j,i] = T_ref[j,i-1] + (T_ref[j,i-1] - T_ref[j-1,i-1])/(ratio**2 - 1 if symmetric else ratio - 1)
+                for sequence in [seq, ex_parallel.StepSequence('harmonic', 2)]:
+                    T_test = T.copy()
+                    ex_parallel._fill_extrapolation_table(T_test, k, j_initshift, sequence, symmetric)
+                    np.testing.assert_allclose(T_test, T_ref, 1e-12, 1e-12, "EXTRAPOLATION TABLEAU TEST FAILED")
+            del calls[:]
+            ex_parallel._fill_extrapolation_table(T_test, k, j_initshift, seq, symmetric)
+            assert calls == [], "EXTRAPOLATION TABLEAU TEST FAILED: denominators not cached"
+    
+    print("All tests passed")
+
+def checkVectorized():
+    '''
+       Checks that the Jacobian estimations with a vectorized RHS (blocks of states
+       evaluated in one call) match the ones done column by column.
+    '''
+    print("\n Executing vectorized RHS tests")
+    N = 40
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csr')*N
+    calls = []
+    def f(y, t):
+        calls.append(y.shape)
+        return J00.dot(y) - y**3
+    y0 = np.cos(np.linspace(0, 2, N))
+    func = lambda y, args: f(y, 0)
+    for ml in [None, 1]:
+        J, fe_tot = forward_diff.Jacobian(func, y0.copy(), ml=ml, mu=ml)
+        del calls[:]
+        J_vec, fe_tot_vec = forward_diff.Jacobian(func, y0.copy(), ml=ml, mu=ml, vectorized=True)
+        assert len(calls) == 2 and fe_tot_vec == fe_tot, "VECTORIZED RHS TEST FAILED"
+        np.testing.assert_allclose(J_vec, J, 1e-12, 1e-12, "VECTORIZED RHS TEST FAILED")
+    sparsity, fe_tot = forward_diff.detectSparsity(func, y0.copy(), vectorized=True)
+    np.testing.assert_array_equal(sparsity.toarray(), J00.toarray() != 0, "VECTORIZED RHS TEST FAILED")
+    
+    for jac_sparsity in [None, 'auto']:
+        ys_ref = ex_parallel.ex_euler_semi_implicit_parallel(f, None, y0, [0, 0.5], rtol=1e-6, atol=1e-6, nworkers=1, 
+                                                             parallel=False, jac_sparsity=jac_sparsity)
+        ys = ex_parallel.ex_euler_semi_implicit_parallel(f, None, y0, [0, 0.5], rtol=1e-6, atol=1e-6, nworkers=1, 
+                                                         parallel=False, jac_sparsity=jac_sparsity, vectorized=True)
+        np.testing.assert_allclose(ys, ys_ref, 1e-8, 1e-12, "VECTORIZED RHS TEST FAILED")
+    
+    print("All tests passed")
+
+def checkComplexStep():
+    '''
+       Checks that the complex-step Jacobian estimations match the analytic Jacobian to
+       machine precision (dense, banded and colored sparse) and that the solver gives
+       the same solution as with the analytic Jacobian (which forward differences don't).
+    '''
+    print("\n Executing complex-step Jacobian tests")
+    N = 12
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csr')*N
+    def f(y, t):
+        return J00.dot(y) - y**3
+    def grad(y, t):
+        return J00.toarray() - np.diag(3*y**2)
+    y0 = np.cos(np.linspace(0, 2, N))
+    func = lambda y, args: f(y, 0)
+    J_exact = grad(y0, 0)
+    for vectorized in [False, True]:
+        J, fe_tot = forward_diff.Jacobian(func, y0.copy(), vectorized=vectorized, method='complex')
+        np.testing.assert_allclose(J, J_exact, 1e-13, 1e-13, "COMPLEX STEP TEST FAILED")
+        J, fe_tot = forward_diff.Jacobian(func, y0.copy(), ml=1, mu=1, vectorized=vectorized, method='complex')
+        assert fe_tot == 4, "COMPLEX STEP TEST FAILED"
+        np.testing.assert_allclose(scipy.sparse.dia_matrix((J, [1, 0, -1]), shape=(N, N)).toarray(), J_exact, 
+                                   1e-13, 1e-13, "COMPLEX STEP TEST FAILED")
+        sparsity = J00 != 0
+        J, fe_tot = forward_diff.SparseJacobian(func, y0.copy(), sparsity, forward_diff.colorColumns(sparsity), 
+                                                vectorized=vectorized, method='complex')
+        np.testing.assert_allclose(J.toarray(), J_exact, 1e-13, 1e-13, "COMPLEX STEP TEST FAILED")
+    
+    #The Jacobian is estimated in each step (not frozen), so that the solution only differs from the one with the
+    #analytic Jacobian by the estimation error
+    extrapolation = ex_parallel.__dict__['__extrapolation_parallel']
+    def solve(grad, jacSparsity=None, jacMethod='forward'):
+        addSolverParam = ex_parallel._getAdditionalSolverParameters(N, 1e-6, 1e-6, True, jacSparsity=jacSparsity,
+                                                                    jacMethod=jacMethod)
+        addSolverParam['freezeJac'] = False
+        return extrapolation(ex_parallel._euler_semiimplicit, {'J00': None}, f, grad, y0, [0, 0.5], rtol=1e-6, 
+                             atol=1e-6, seq=ex_parallel.StepSequence('harmonic', 4, -2), symmetric=False, 
+                             addSolverParam=addSolverParam, parallel=False)
+    ys_ref = solve(grad)
+    for jacSparsity in [None, 'auto']:
+        ys = solve(None, jacSparsity, 'complex')
+        np.testing.assert_allclose(ys, ys_ref, 1e-12, 1e-13, "COMPLEX STEP TEST FAILED")
+        ys = solve(None, jacSparsity, 'forward')
+        assert np.max(np.abs(ys - ys_ref)) > 1e-12, "COMPLEX STEP TEST FAILED: forward differences as exact"
+    
+    print("All tests passed")
+
+def checkParallelJacobian():
+    '''
+       Checks that the Jacobian estimations split between the workers give the same
+       solution as the serial ones, with fewer sequential function evaluations.
+    '''
+    print("\n Executing parallel Jacobian estimation tests")
+    test = tst.HIRESProblem()
+    for jac_sparsity in [None, 'auto']:
+        results = []
+        for parallel in [False, True]:
+            with ex_parallel.WorkerPool(2, 'threads') as pool:
+                results.append(ex_parallel.ex_euler_semi_implicit_parallel(test.RHSFunction, None, test.initialValue, 
+                               [0, 5.], full_output=True, rtol=1e-6, atol=1e-6, pool=pool, parallel=parallel,
+                               linear_solver='direct', jac_sparsity=jac_sparsity))
+        (ys_ref, infodict_ref), (ys, infodict) = results
+        np.testing.assert_array_equal(ys, ys_ref, "PARALLEL JACOBIAN TEST FAILED")
+        assert infodict['fe_seq'] < infodict_ref['fe_seq'], "PARALLEL JACOBIAN TEST FAILED"
+    
+    print("All tests passed")
+
+def checkStageFactorization():
+    '''
+       Checks that the semi implicit steps give the same solution with the factored
+       matrix I-step*J00 as solving the system directly, and that I-step*J00 is
+       only factored once per stage (not once per inner step).
+    '''
+    print("\n Executing stage factorization tests")
+    N = 20
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csc')*N**2
+    def f(y, t):
+        return J00.dot(y) - y**3
+    y0 = np.sin(np.pi*np.linspace(0, 1, N))
+    addSolverParam = ex_parallel._getAdditionalSolverParameters(N, 1e-6, 1e-6, True, linearSolver='direct')
+    step = 1e-2
+    for J in [J00, J00.toarray()]:
+        factor = ex_parallel._factorMatrix(J, step)
+        for method in [ex_parallel._euler_semiimplicit, ex_parallel._midpoint_semiimplicit]:
+            for previousValues in [(None, y0), (0.9*y0, y0)]:
+                y, f_yj, fe_tot, je_tot = method(f, None, previousValues, 0, None, step, (), addSolverParam, J)
+                y_factor, f_yj, fe_tot, je_tot = method(f, None, previousValues, 0, None, step, (), addSolverParam, J,
+                                                        factor=factor)
+                np.testing.assert_allclose(y_factor, y, 1e-10, 1e-12, "STAGE FACTORIZATION TEST FAILED")
+    
+    extrapolation = ex_parallel.__dict__['__extrapolation_parallel']
+    for method, symmetric, smoothing in [(ex_parallel._euler_semiimplicit, False, 'no'), 
+                                         (ex_parallel._midpoint_semiimplicit, True, 'semiimp')]:
+        addSolverParam = ex_parallel._getAdditionalSolverParameters(N, 1e-6, 1e-6, True, linearSolver='direct')
+        addSolverParam['freezeJac'] = False
+        addSolverParam['factorCache'] = 0
+        ys, infodict = extrapolation(method, {'J00': None}, f, None, y0, [0, 0.1], full_output=True, h0=0.01, p=3,
+                                     smoothing=smoothing, symmetric=symmetric, seq=ex_parallel.StepSequence('harmonic', 2),
+                                     adaptative='fixed', addSolverParam=addSolverParam, parallel=False)
+        assert infodict['lu_hits'] == 0, "STAGE FACTORIZATION TEST FAILED"
+        assert infodict['nlu'] == 3*infodict['nst'], "STAGE FACTORIZATION TEST FAILED: " + str(infodict['nlu']) + \
+            " factorizations in " + str(infodict['nst']) + " steps"
+    
+    print("All tests passed")
+
+def checkSparseFactorization():
+    '''
+       Checks that the sparse factorizations of I-step*J00 solve the systems, that
+       the structure and column ordering of a sparsity pattern are computed once
+       and reused for new steps and Jacobian values, and that they are computed
+       again when the pattern changes.
+    '''
+    print("\n Executing sparse factorization tests")
+    tst.initializeBRUSS2DValues(5)
+    test = tst.BRUSS2DProblem()
+    y0 = test.initialValue
+    J00 = scipy.sparse.csc_matrix(tst.BRUSS2Dgrad(*(y0, 0) + test.args))
+    N = J00.shape[0]
+    b = np.arange(N, dtype=float)
+    ex_parallel._sparsePattern.pattern = None
+    factor = ex_parallel._factorMatrix(J00, 1e-3)
+    pattern = ex_parallel._sparsePattern.pattern
+    perm = pattern.perm
+    assert perm is not None, "SPARSE FACTORIZATION TEST FAILED: no column ordering"
+    for J, step in [(J00, 1e-3), (J00, 0.1), (2*J00, 1e-3), (scipy.sparse.csc_matrix(tst.BRUSS2Dgrad(*(2*y0, 0) + test.args)), 0.1)]:
+        factor = ex_parallel._factorMatrix(J, step)
+        x = scipy.sparse.linalg.spsolve(scipy.sparse.identity(N, format='csc') - step*J, b)
+        np.testing.assert_allclose(ex_parallel._solveFactored(factor, b), x, 1e-10, 1e-12, 
+                                   "SPARSE FACTORIZATION TEST FAILED")
+        assert ex_parallel._sparsePattern.pattern is pattern and pattern.perm is perm, \
+            "SPARSE FACTORIZATION TEST FAILED: structure not reused"
+    
+    J = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csc')
+    factor = ex_parallel._factorMatrix(J, 0.1)
+    x = scipy.sparse.linalg.spsolve(scipy.sparse.identity(N, format='csc') - 0.1*J, b)
+    np.testing.assert_allclose(ex_parallel._solveFactored(factor, b), x, 1e-10, 1e-12, "SPARSE FACTORIZATION TEST FAILED")
+    assert ex_parallel._sparsePattern.pattern is not pattern, "SPARSE FACTORIZATION TEST FAILED: pattern not rebuilt"
+    
+    print("All tests passed")
+
+def checkFactorizationCache():
+    '''
+       Checks that the factorizations of I-step*J00 are reused between steps
+       (fixed step size and frozen Jacobian) and that the results are the same
+       as without reusing them. The cache keys include the Jacobian version, so
+       the hit rate also checks that the frozen Jacobian outlives the steps.
+    '''
+    print("\n Executing factorization cache tests")
+    extrapolation = ex_parallel.__dict__['__extrapolation_parallel']
+    test = tst.VDPOLEasyProblem()
+    for backend in ['processes', 'threads']:
+        with ex_parallel.WorkerPool(2, backend) as pool:
+            ys_ref = None
+            for factorCache in [0, 8]:
+                addSolverParam = ex_parallel._getAdditionalSolverParameters(2, 1e-6, 1e-6, True)
+                #The Jacobian of this small system would be estimated in each step (see _JacobianRefresh)
+                addSolverParam['jacRefreshCost'] = None
+                addSolverParam['factorCache'] = factorCache
+                methodargs = {'J00': None}
+                ys, infodict = extrapolation(ex_parallel._midpoint_semiimplicit, methodargs, test.RHSFunction, None, 
+                                             test.initialValue, [0, 1.], full_output=True, h0=0.05, p=3, smoothing='semiimp', 
+                                             seq=ex_parallel.StepSequence('harmonic', 4, -2), adaptative='fixed', 
+                                             addSolverParam=addSolverParam, pool=pool, parallel=True)
+                if ys_ref is None:
+                    ys_ref = ys
+                    assert infodict['lu_hits'] == 0, "FACTORIZATION CACHE TEST " + backend + " FAILED"
+                else:
+                    np.testing.assert_array_equal(ys, ys_ref, "FACTORIZATION CACHE TEST " + backend + " FAILED")
+                    assert infodict['lu_hit_rate'] > 0.5, "FACTORIZATION CACHE TEST " + backend + " FAILED: low hit rate"
+    
+    print("All tests passed")
+
+def checkPreconditioner():
+    '''
+       Checks that the preconditioned GMRES solutions of I-step*J00 x = b match
+       the direct solution, and that the iterative solver with the preconditioners
+       built in each stage solves a problem as accurately as without them.
+    '''
+    print("\n Executing preconditioner tests")
+    N = 50
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csr')*N**2
+    step = 1e-2
+    A = ex_parallel._ShiftedJacobian(J00, step)
+    b = np.linspace(0, 1, N)
+    x = A.solve(b)
+    for preconditioner in ['ilu', 'jacobi', 'auto', 
+                           lambda A: scipy.sparse.linalg.LinearOperator(A.shape, scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(A)).solve)]:
+        for J in [J00, J00.toarray()]:
+            addSolverParam = ex_parallel._getAdditionalSolverParameters(N, 1e-10, 1e-10, True, preconditioner)
+            addSolverParam['jacobiBlockSize'] = 5
+            M = ex_parallel._buildPreconditioner(J, step, addSolverParam)
+            sol, info = ex_parallel._gmres(A, b, None, addSolverParam, M)
+            assert info == 0, "PRECONDITIONER TEST " + str(preconditioner) + " FAILED: no convergence"
+            np.testing.assert_allclose(sol, x, 1e-6, 0, "PRECONDITIONER TEST " + str(preconditioner) + " FAILED")
+    
+    def f(y, t):
+        return J00.dot(y)
+    def grad(y, t):
+        return J00
+    y0 = np.sin(np.pi*np.linspace(0, 1, N))
+    ys_ref = None
+    for preconditioner in [None, 'auto']:
+        ys, infodict = ex_parallel.ex_euler_semi_implicit_parallel(f, grad, y0, [0, 0.1], full_output=True, rtol=1e-6,
+                                        atol=1e-6, nworkers=1, parallel=False, preconditioner=preconditioner)
+        if ys_ref is None:
+            ys_ref = ys
+            assert infodict['nprec'] == 0, "PRECONDITIONER TEST FAILED"
+        else:
+            np.testing.assert_allclose(ys, ys_ref, 1e-4, 1e-8, "PRECONDITIONER TEST FAILED")
+            assert infodict['nprec'] > 0, "PRECONDITIONER TEST FAILED: no preconditioner built"
+    
+    print("All tests passed")
+
+def checkMatrixFree():
+    '''
+       Checks that the semi implicit methods with a matrix-free Jacobian (Jacobian-vector
+       products estimated with the RHS) give the same solution as with the estimated Jacobian.
+    '''
+    print("\n Executing matrix-free Jacobian tests")
+    N = 50
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csr')*N**2
+    def f(y, t):
+        return J00.dot(y) + np.cos(t)
+    y0 = np.sin(np.pi*np.linspace(0, 1, N))
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel]:
+        ys_ref, infodict_ref = solver(f, None, y0, [0, 0.1], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                                      parallel=False, preconditioner=None, matrix_free=False)
+        ys, infodict = solver(f, None, y0, [0, 0.1], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                              parallel=False, matrix_free=True)
+        np.testing.assert_allclose(ys, ys_ref, 1e-3, 1e-6, "MATRIX-FREE TEST " + solver.__name__ + " FAILED")
+    
+    print("All tests passed")
+
+def checkNewton():
+    '''
+       Checks that the simplified Newton iterations of the midpoint implicit method solve
+       the stages of a stiff problem as accurately as fsolve with less function evaluations,
+       that they fail when the Jacobian is too far from the actual one and that the stages
+       are then solved with fsolve.
+    '''
+    print("\n Executing simplified Newton tests")
+    A = np.diag(-np.logspace(0, 4, 10))
+    b = np.ones(10)
+    zero_f = lambda x: x - 0.1*A.dot(x) - b
+    addSolverParam = ex_parallel._getAdditionalSolverParameters(10, 1e-6, 1e-6, True)
+    x, fe_tot, converged = ex_parallel._solve_newton(zero_f, ex_parallel._factorMatrix(A, 0.1), b, addSolverParam)
+    assert converged, "NEWTON TEST FAILED"
+    np.testing.assert_allclose(x, np.linalg.solve(np.identity(10) - 0.1*A, b), 1e-10, 1e-12, "NEWTON TEST FAILED")
+    x, fe_tot, converged = ex_parallel._solve_newton(zero_f, ex_parallel._factorMatrix(A, 0.), b, addSolverParam)
+    assert not converged, "NEWTON TEST FAILED: diverging iterations converged"
+
+    test = tst.HIRESProblem()
+    t = [test.denseOutput[0], test.denseOutput[-1]]
+    y_ref = np.loadtxt(tst.getReferenceFile(test.problemName))[-1]
+    atol = test.atolfact*1e-6
+    ys_fsolve, infodict_fsolve = ex_parallel.ex_midpoint_implicit_parallel(test.RHSFunction, None, test.initialValue, t,
+                                    rtol=1e-6, atol=atol, full_output=True, nworkers=1, parallel=False,
+                                    nonlinear_solver='fsolve')
+    ys, infodict = ex_parallel.ex_midpoint_implicit_parallel(test.RHSFunction, None, test.initialValue, t, rtol=1e-6,
+                                    atol=atol, full_output=True, nworkers=1, parallel=False)
+    assert relative_error(ys[-1], y_ref) < 5*relative_error(ys_fsolve[-1], y_ref), \
+        "NEWTON TEST FAILED: " + str(relative_error(ys[-1], y_ref))
+    assert infodict['nfe'] < infodict_fsolve['nfe'], "NEWTON TEST FAILED"
+
+    #With only one iteration most of the stages don't converge and are solved with fsolve
+    fallbacks = []
+    solve_implicit_step = ex_parallel._solve_implicit_step
+    def counted_solve_implicit_step(*args):
+        fallbacks.append(1)
+        return solve_implicit_step(*args)
+    ex_parallel._solve_implicit_step = counted_solve_implicit_step
+    try:
+        addSolverParam = ex_parallel._getAdditionalSolverParameters(len(y_ref), atol, 1e-6, True, preconditioner=None)
+        addSolverParam['matrixStepFactor'] = 0.5
+        addSolverParam['iterative'] = False
+        addSolverParam['newtonMaxIter'] = 1
+        ys = ex_parallel.__dict__['__extrapolation_parallel'](ex_parallel._midpoint_implicit, {'J00': None},
+                    test.RHSFunction, None, test.initialValue, t, rtol=1e-6, atol=atol, p=2, smoothing='gbs',
+                    symmetric=True, seq=ex_parallel.StepSequence('harmonic', 4, -2), addSolverParam=addSolverParam,
+                    nworkers=1, parallel=False)
+    finally:
+        ex_parallel._solve_implicit_step = solve_implicit_step
+    assert len(fallbacks) > 0, "NEWTON TEST FAILED: no fallback to fsolve"
+    assert relative_error(ys[-1], y_ref) < 5*relative_error(ys_fsolve[-1], y_ref), \
+        "NEWTON TEST FAILED: " + str(relative_error(ys[-1], y_ref))
+
+    print("All tests passed")
+
+def checkShiftedJacobian():
+    '''
+       Checks that the products and solves of I-step*J00 done with each Jacobian
+       backend match the ones of the explicitly built matrix, and that the midpoint
+       semi implicit method gives the same solution with a sparse and a dense Jacobian.
+    '''
+    print("\n Executing shifted Jacobian tests")
+    N = 40
+    J00 = scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1], format='csr')*N**2
+    step = 1e-2
+    A = np.identity(N) - step*J00.toarray()
+    v = np.sin(np.arange(N))
+    for J in [J00, J00.toarray(), np.matrix(J00.toarray()), ex_parallel._HessenbergJacobian(J00.toarray())]:
+        shifted = ex_parallel._ShiftedJacobian(J, step)
+        np.testing.assert_allclose(shifted.dot(v), A.dot(v), 1e-10, 1e-10, "SHIFTED JACOBIAN TEST FAILED")
+        np.testing.assert_allclose(shifted.solve(v), np.linalg.solve(A, v), 1e-8, 1e-12, "SHIFTED JACOBIAN TEST FAILED")
+    assert scipy.sparse.issparse(ex_parallel._ShiftedJacobian(J00, step).matrix()), "SHIFTED JACOBIAN TEST FAILED"
+    
+    def f(y, t):
+        return J00.dot(y)
+    y0 = np.sin(np.pi*np.linspace(0, 1, N))
+    ys = [ex_parallel.ex_midpoint_semi_implicit_parallel(f, grad, y0, [0, 0.1], rtol=1e-6, atol=1e-6, nworkers=1,
+                                                         parallel=False, linear_solver='direct')
+          for grad in [lambda y, t: J00, lambda y, t: J00.toarray()]]
+    np.testing.assert_allclose(ys[0], ys[1], 1e-8, 1e-12, "SHIFTED JACOBIAN TEST FAILED")
+    
+    print("All tests passed")
+
+def checkBanded():
+    '''
+       Checks the banded Jacobians: the forward difference estimation in band form,
+       the products and solves with I-step*J00 and that the semi implicit methods
+       give the same solution with banded Jacobians (given or estimated with fewer
+       function evaluations) as with dense ones.
+    '''
+    print("\n Executing banded Jacobian tests")
+    N = 40
+    J00 = scipy.sparse.diags([np.ones(N-2), np.ones(N-1), -3*np.ones(N), 2*np.ones(N-1)], [-2, -1, 0, 1]).toarray()*N
+    def f(y, t):
+        return J00.dot(y) - y**3
+    y0 = np.cos(np.linspace(0, 2, N))
+    J = forward_diff.Jacobian(lambda y, args: f(y, 0), y0.copy())[0]
+    ab, fe_tot = forward_diff.Jacobian(lambda y, args: f(y, 0), y0.copy(), ml=2, mu=1)
+    assert fe_tot == 5, "BANDED JACOBIAN TEST FAILED: " + str(fe_tot) + " function evaluations"
+    banded = ex_parallel._BandedJacobian(ab, 2, 1)
+    np.testing.assert_allclose(banded.tosparse().toarray(), J, 1e-12, 1e-12, "BANDED JACOBIAN TEST FAILED")
+    shifted = ex_parallel._ShiftedJacobian(banded, 0.1)
+    A = np.identity(N) - 0.1*J
+    np.testing.assert_allclose(shifted.dot(y0), A.dot(y0), 1e-12, 1e-12, "BANDED JACOBIAN TEST FAILED")
+    np.testing.assert_allclose(shifted.solve(y0), np.linalg.solve(A, y0), 1e-10, 1e-12, "BANDED JACOBIAN TEST FAILED")
+    
+    #Band form of J00 (jac[mu+i-j, j] = J00[i, j])
+    ab0 = np.array([[J00[j+k-1, j] if 0 <= j+k-1 < N else 0 for j in range(N)] for k in range(4)])
+    def grad(y, t):
+        jac = ab0.copy()
+        jac[1] -= 3*y**2
+        return jac
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel]:
+        ys_ref, infodict_ref = solver(f, None, y0, [0, 0.5], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                                      parallel=False, linear_solver='direct')
+        ys, infodict = solver(f, None, y0, [0, 0.5], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                              parallel=False, ml=2, mu=1)
+        np.testing.assert_allclose(ys, ys_ref, 1e-5, 1e-8, "BANDED JACOBIAN TEST " + solver.__name__ + " FAILED")
+        assert infodict['nfe'] < infodict_ref['nfe'], "BANDED JACOBIAN TEST " + solver.__name__ + " FAILED"
+        ys = solver(f, grad, y0, [0, 0.5], rtol=1e-6, atol=1e-6, nworkers=1, parallel=False, ml=2, mu=1)
+        np.testing.assert_allclose(ys, ys_ref, 1e-5, 1e-8, "BANDED JACOBIAN TEST " + solver.__name__ + " FAILED")
+    
+    print("All tests passed")
+
+def checkSparseJacobian():
+    '''
+       Checks the sparse Jacobian estimation: the detected sparsity pattern, the
+       column groups and the estimated values, and that the semi implicit methods
+       give the same solution with it (with fewer function evaluations) as with the
+       dense estimation.
+    '''
+    print("\n Executing sparse Jacobian tests")
+    N = 40
+    #Periodic tridiagonal Jacobian (plus the cubic term)
+    J00 = (scipy.sparse.diags([np.ones(N-1), -2*np.ones(N), np.ones(N-1)], [-1, 0, 1]) +
+           scipy.sparse.diags([np.ones(1), np.ones(1)], [-(N-1), N-1])).toarray()*N
+    def f(y, t):
+        return J00.dot(y) - y**3
+    y0 = np.cos(np.linspace(0, 2, N))
+    sparsity, fe_tot = forward_diff.detectSparsity(lambda y, args: f(y, 0), y0.copy())
+    np.testing.assert_array_equal(sparsity.toarray(), J00 != 0, "SPARSE JACOBIAN TEST FAILED: wrong sparsity")
+    colors = forward_diff.colorColumns(sparsity)
+    assert colors.max()+1 <= 4, "SPARSE JACOBIAN TEST FAILED: " + str(colors.max()+1) + " column groups"
+    for row in sparsity.toarray():
+        assert len(np.unique(colors[row])) == row.sum(), "SPARSE JACOBIAN TEST FAILED: wrong column groups"
+    J, fe_tot = forward_diff.SparseJacobian(lambda y, args: f(y, 0), y0.copy(), sparsity, colors)
+    assert fe_tot == colors.max()+2, "SPARSE JACOBIAN TEST FAILED"
+    np.testing.assert_allclose(J.toarray(), forward_diff.Jacobian(lambda y, args: f(y, 0), y0.copy())[0], 1e-12, 1e-12,
+                               "SPARSE JACOBIAN TEST FAILED")
+    
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel]:
+        ys_ref, infodict_ref = solver(f, None, y0, [0, 0.5], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                                      parallel=False, linear_solver='direct')
+        for jac_sparsity in ['auto', J00 != 0]:
+            ys, infodict = solver(f, None, y0, [0, 0.5], full_output=True, rtol=1e-6, atol=1e-6, nworkers=1,
+                                  parallel=False, linear_solver='direct', jac_sparsity=jac_sparsity)
+            np.testing.assert_allclose(ys, ys_ref, 1e-5, 1e-8, "SPARSE JACOBIAN TEST " + solver.__name__ + " FAILED")
+            assert infodict['nfe'] < infodict_ref['nfe'], "SPARSE JACOBIAN TEST " + solver.__name__ + " FAILED"
+    
+    print("All tests passed")
+
+def checkHessenberg():
+    '''
+       Checks that the semi implicit methods give the same solution when the stage
+       matrices are factored through the Hessenberg form of the Jacobian.
+    '''
+    print("\n Executing Hessenberg linear solver tests")
+    J00 = np.random.RandomState(0).randn(30, 30)
+    hessenberg = ex_parallel._HessenbergJacobian(J00)
+    b = np.arange(30.)
+    for step in [1e-3, 0.1, 10]:
+        x = np.linalg.solve(np.identity(30) - step*J00, b)
+        np.testing.assert_allclose(ex_parallel._solveFactored(hessenberg.factor(step), b), x, 1e-10, 1e-12,
+                                   "HESSENBERG TEST FAILED")
+    
+    test = tst.HIRESProblem()
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel]:
+        ys_ref = solver(test.RHSFunction, None, test.initialValue, [0, 5.], rtol=1e-6, atol=1e-6, nworkers=1,
+                        parallel=False, linear_solver='direct')
+        ys = solver(test.RHSFunction, None, test.initialValue, [0, 5.], rtol=1e-6, atol=1e-6, nworkers=1,
+                    parallel=False, linear_solver='hessenberg')
+        np.testing.assert_allclose(ys, ys_ref, 1e-6, 1e-10, "HESSENBERG TEST " + solver.__name__ + " FAILED")
+    
+    print("All tests passed")
+
+def checkBroydenUpdate():
+    '''
+       Checks that the factorizations updated with the Broyden rank-1 updates solve the
+       updated stage matrices and that the semi implicit methods with updated Jacobians
+       give the solution without estimating the Jacobian in each step.
+    '''
+    print("\n Executing Broyden Jacobian update tests")
+    rs = np.random.RandomState(0)
+    J0 = rs.randn(20, 20)
+    U, V = rs.randn(20, 3), rs.randn(20, 3)
+    b = np.arange(20.)
+    for J in [J0, scipy.sparse.csr_matrix(J0), ex_parallel._HessenbergJacobian(J0)]:
+        broyden = ex_parallel._BroydenJacobian(J, 0, U[:,:1], V[:,:1]).update(U[:,1], V[:,1]).update(U[:,2], V[:,2])
+        np.testing.assert_allclose(broyden.dot(b), (J0 + U.dot(V.T)).dot(b), 1e-10, 1e-12, "BROYDEN TEST FAILED")
+        for step in [1e-3, 0.1]:
+            x = np.linalg.solve(np.identity(20) - step*(J0 + U.dot(V.T)), b)
+            np.testing.assert_allclose(ex_parallel._solveFactored(ex_parallel._factorMatrix(broyden, step), b), x,
+                                       1e-8, 1e-10, "BROYDEN TEST FAILED")
+
+    test = tst.VDPOLProblem()
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel]:
+        ys_ref, infodict_ref = solver(test.RHSFunction, None, test.initialValue, [0, 0.5], rtol=1e-6, atol=1e-6,
+                                      full_output=True, nworkers=1, parallel=False)
+        ys, infodict = solver(test.RHSFunction, None, test.initialValue, [0, 0.5], rtol=1e-6, atol=1e-6,
+                              full_output=True, nworkers=1, parallel=False, jac_update='broyden')
+        np.testing.assert_allclose(ys, ys_ref, 1e-4, 1e-6, "BROYDEN TEST " + solver.__name__ + " FAILED")
+        assert infodict['nje'] < infodict['nst'], "BROYDEN TEST " + solver.__name__ + " FAILED"
+
+    print("All tests passed")
+
+def checkJacobianRefresh():
+    '''
+       Checks that the frozen Jacobian is estimated again on rejected steps, order drops,
+       slow Newton convergence, growing GMRES iterations, old age and when it is cheap
+       compared with the step, that small systems estimate it in each step, and that the
+       semi implicit and implicit methods reuse it without losing accuracy.
+    '''
+    print("\n Executing Jacobian refresh tests")
+    addSolverParam = ex_parallel._getAdditionalSolverParameters(2, 1e-6, 1e-6, addWork=True)
+    policy = ex_parallel._JacobianRefresh(addSolverParam)
+    assert policy.refresh(False, 1, 1, {'jac_fe': 2, 'stage_fe': 2}), "JACOBIAN REFRESH TEST FAILED"
+    assert not policy.refresh(False, 4, 4, {'jac_fe': 32, 'stage_fe': 20}), "JACOBIAN REFRESH TEST FAILED"
+    assert not policy.refresh(False, 4, 4, {'stage_fe': 31}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(False, 4, 4, {'stage_fe': 32}), "JACOBIAN REFRESH TEST FAILED"
+    policy = ex_parallel._JacobianRefresh(addSolverParam)
+    assert not policy.refresh(False, 4, 4, {'gmres_iters': 10, 'gmres_solves': 5}), "JACOBIAN REFRESH TEST FAILED"
+    assert not policy.refresh(False, 4, 5, {'gmres_iters': 15, 'gmres_solves': 5}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(False, 4, 4, {'gmres_iters': 25, 'gmres_solves': 5}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(True, 4, 4, {}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(False, 4, 3, {}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(False, 4, 4, {'newton_solves': 4, 'newton_rate': 2.}), "JACOBIAN REFRESH TEST FAILED"
+    assert policy.refresh(False, 4, 4, {'newton_solves': 4, 'newton_rate': 0.1, 'newton_fails': 1}), \
+        "JACOBIAN REFRESH TEST FAILED"
+    ages = [policy.refresh(False, 4, 4, {'newton_solves': 4, 'newton_rate': 0.1}) 
+            for i in range(addSolverParam['jacMaxAge'])]
+    assert ages == (addSolverParam['jacMaxAge']-1)*[False] + [True], "JACOBIAN REFRESH TEST FAILED"
+    
+    #The Jacobian of a small system is estimated in each step, unless the policy keeps it
+    extrapolation = ex_parallel.__dict__['__extrapolation_parallel']
+    test = tst.VDPOLEasyProblem()
+    for jacRefreshCost in [1, None]:
+        addSolverParam = ex_parallel._getAdditionalSolverParameters(2, 1e-6, 1e-6, True)
+        addSolverParam['jacRefreshCost'] = jacRefreshCost
+        ys, infodict = extrapolation(ex_parallel._euler_semiimplicit, {'J00': None}, test.RHSFunction, None,
+                                     test.initialValue, [0, 1.5], full_output=True, symmetric=False,
+                                     seq=ex_parallel.StepSequence('harmonic', 4, -2), addSolverParam=addSolverParam,
+                                     nworkers=1, parallel=False)
+        assert (infodict['nje'] == infodict['nst']) == (jacRefreshCost is not None), \
+            "JACOBIAN REFRESH TEST FAILED: " + str((jacRefreshCost, infodict['nje'], infodict['nst']))
+    
+    tst.initializeBRUSS2DValues(4)
+    test = tst.BRUSS2DProblem()
+    y_ref = ex_parallel.ex_euler_semi_implicit_parallel(test.RHSFunction, test.RHSGradient, test.initialValue, 
+                                                        [0, 1.5], args=test.args, rtol=1e-11, atol=1e-11, nworkers=1,
+                                                        parallel=False)[-1]
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel,
+                   ex_parallel.ex_midpoint_implicit_parallel]:
+        ys_grad = solver(test.RHSFunction, test.RHSGradient, test.initialValue, [0, 1.5], args=test.args, rtol=1e-6,
+                         atol=1e-6, nworkers=1, parallel=False)
+        ys, infodict = solver(test.RHSFunction, None, test.initialValue, [0, 1.5], args=test.args, rtol=1e-6,
+                              atol=1e-6, full_output=True, nworkers=1, parallel=False)
+        #The frozen Jacobian can't make the solution much worse than the one with the exact Jacobian in each step
+        assert relative_error(ys[-1], y_ref) < 5*relative_error(ys_grad[-1], y_ref), \
+            "JACOBIAN REFRESH TEST " + solver.__name__ + " FAILED: " + str(relative_error(ys[-1], y_ref))
+    
+    #The Jacobian of a larger system is kept between steps
+    tst.initializeBRUSS2DValues(6)
+    test = tst.BRUSS2DProblem()
+    for solver in [ex_parallel.ex_euler_semi_implicit_parallel, ex_parallel.ex_midpoint_semi_implicit_parallel,
+                   ex_parallel.ex_midpoint_implicit_parallel]:
+        ys, infodict = solver(test.RHSFunction, None, test.initialValue, [0, 1.5], args=test.args, rtol=1e-6,
+                              atol=1e-6, full_output=True, nworkers=1, parallel=False)
+        assert infodict['nje'] < infodict['nst'], "JACOBIAN REFRESH TEST " + solver.__name__ + " FAILED"
+    
+    print("All tests passed")
+
 def convergenceTest(method, i, test, allSteps, order, dense=False):
     '''''
        Perform a convergence test with the test problem (in test parameter) with
@@ -227,7 +967,7 @@ def convergenceTest(method, i, test, allSteps, order, dense=False):
     errorPerStep=[]
     for step in allSteps:
         #rtol and atol are not important as we are fixing the step size
-        ys, infodict = ex_parallel.extrapolation_parallel(method,test.RHSFunction, None, test.initialValue, denseOutput, atol=1e-1, 
+        ys, infodict = ex_parallel.extrapolation_parallel(method,test.RHSFunction, None, test.initialValue, denseOutput, args=test.args, atol=1e-1, 
             rtol=1e-1, mxstep=10000000, full_output=True, nworkers=4, adaptative='fixed', p=order, h0=step)        
 #         print("number steps: " + str(infodict['nst']) + " (should be " + str(denseOutput[-1]/step) + ")")
         
@@ -303,6 +1043,10 @@ def doAllConvergenceTests():
     #vdpol: 6 exception 1
     vdpolSteps6ex1 = np.concatenate((np.linspace(0.65,0.2,6), np.linspace(0.19,0.055,7)))
     
+    #vdpol: 6 exception 2 (the stages solved with Newton are so accurate that with smaller steps the dense 
+    #output error is already ~1e-11 and doesn't decrease regularly)
+    vdpolSteps6ex2 = np.concatenate((np.linspace(0.73,0.2,8), np.linspace(0.19,0.07,8)))
+    
     #This is needed because some methods converge faster than the others and some steps have to be personalized
     methodslinearstepexception = [[None,None,None],[None,None,linearSteps6ex1],[None,None,None],[None,None,linearSteps6ex2],[None,None,linearSteps6ex3]] 
     
@@ -317,7 +1061,7 @@ def doAllConvergenceTests():
     
     methodsvdpolskip = [[' ',' ',' ',' '],[' ',' ',' ','skip'],[' ',' ',' ','skip'],[' ',' ',' ','skip'],[' ',' ',' ','skip']] 
 
-    methodsvdpoldensestepexception = [[None,vdpolSteps4ex1,None,None],[None,None,None,None],[None,None,None,None],[None,vdpolSteps4ex1,vdpolSteps6ex1,None],[None,vdpolSteps4ex1,vdpolSteps6ex1,None]]
+    methodsvdpoldensestepexception = [[None,vdpolSteps4ex1,None,None],[None,None,vdpolSteps6ex2,None],[None,None,None,None],[None,vdpolSteps4ex1,vdpolSteps6ex1,None],[None,vdpolSteps4ex1,vdpolSteps6ex1,None]]
 
     methodsvdpoldenseskip = [['skip',' ',' ','skip'],['skip',' ',' ','skip'],['skip',' ',' ','skip'],[' ',' ','skip','skip'],[' ',' ',' ','skip']] 
 
@@ -590,6 +1334,26 @@ if __name__ == "__main__":
 #     non_dense_tests()
 #     dense_tests()
   
+    checkWorkerPool()
+    checkWorkerAffinity()
+    checkProblemData()
+    checkStepSequence()
+    checkExtrapolationTable()
+    checkStageFactorization()
+    checkSparseFactorization()
+    checkFactorizationCache()
+    checkParallelJacobian()
+    checkPreconditioner()
+    checkMatrixFree()
+    checkNewton()
+    checkShiftedJacobian()
+    checkBanded()
+    checkSparseJacobian()
+    checkVectorized()
+    checkComplexStep()
+    checkHessenberg()
+    checkBroydenUpdate()
+    checkJacobianRefresh()
     doAllConvergenceTests()
     checkInterpolationPolynomial()
     checkDerivativesForPolynomial()
@@ -22,10 +22,12 @@ IV.10 Numerical Experiment, Twelve Test Problems
 '''
 Each ODE problem is defined with: problemName, right hand side function (derivative function), jacobian matrix of RHS function, initial time (float), initial value (np.array),
 times at which output is wanted, atolfact absolute tolerance factor-> set to 1. as default (multiplies relative tolerance factor to make absolute tolerance more stringent), 
-atol absolute tolerance -> set to None as default (required absolute tolerance for all relative tolerances wanted).
+atol absolute tolerance -> set to None as default (required absolute tolerance for all relative tolerances wanted),
+args extra arguments of the RHS function and its jacobian -> set to () as default (the problem data, which the solvers send to their workers).
 '''
 #TODO: for each problem add plot function to plot results
-TestProblemDefinition = namedtuple("TestProblemDefinition", ["problemName","RHSFunction", "RHSGradient","initialTime","initialValue", "denseOutput", "atolfact", "atol"])
+TestProblemDefinition = namedtuple("TestProblemDefinition", ["problemName","RHSFunction", "RHSGradient","initialTime","initialValue", "denseOutput", "atolfact", "atol", "args"])
+TestProblemDefinition.__new__.__defaults__ = ((),)
 
 
 #Linear problem
@@ -202,6 +204,8 @@ def E5Problem():
 
 #BRUSS-2D problem
     
+#OBS: the RHS function and its jacobian get the problem data (A,N) through args, not from these globals:
+#the workers of a pool started before initializeBRUSS2DValues() only have the globals of that moment
 A=0
 N=15
 step=0
@@ -213,9 +217,14 @@ def initializeBRUSS2DValues(Nval):
     global A,Aperm,N,step,x,y
     N=Nval
     A=five_pt_laplacian_sparse_periodic(N,0,1)
+    step=1/(N-1)
+    x,y=BRUSS2DGrid(N)
+
+def BRUSS2DGrid(N):
     step=1/(N-1)
     x=np.multiply(step,range(N)*N)
     y=np.multiply(step,np.repeat(range(N),N))
+    return x,y
     
 
 def five_pt_laplacian_sparse_periodic(m,a,b):
@@ -240,16 +249,17 @@ def five_pt_laplacian_sparse_periodic(m,a,b):
     return A
 
 #Here we will use U to obtain the coordinates (x,y)
-def BRUSS2DInhom(t):
+def BRUSS2DInhom(t,N):
    Nsq=N**2
    fout = np.zeros(Nsq)
    if t<1.1:
        return fout
+   x,y=BRUSS2DGrid(N)
    fout = np.add(np.power(x-0.3,2),np.power(y-0.6,2))<=0.01
    fout = 5*fout
    return fout
 
-def BRUSS2Dgradnonsparse(yn,tn):
+def BRUSS2Dgradnonsparse(yn,tn,A,N):
     U=yn[0:N**2]
     V=yn[N**2:2*N**2]
     df1du = scipy.sparse.spdiags(2*U*V-4.4,0,N**2,N**2)+alpha*A
@@ -261,7 +271,7 @@ def BRUSS2Dgradnonsparse(yn,tn):
     final = scipy.sparse.hstack([left, right]).todense()
     return final
 
-def BRUSS2Dgrad(yn,tn):
+def BRUSS2Dgrad(yn,tn,A,N):
     U=yn[0:N**2]
     V=yn[N**2:2*N**2]
     df1du = scipy.sparse.spdiags(2*U*V-4.4,0,N**2,N**2)+alpha*A
@@ -273,18 +283,18 @@ def BRUSS2Dgrad(yn,tn):
     final = scipy.sparse.hstack([left, right], format='csr')
     return final
 
-def FortBRUSS2Df(y,t):
+def FortBRUSS2Df(y,t,A,N):
     '''
-    Compiled Fortran brusselator 2D RHS function (faster than python)
+    Compiled Fortran brusselator 2D RHS function (faster than python), it builds its own laplacian (A is not used)
     '''
     aux=fnbruss.fnbruss(y,t,N)
     return aux
 
-def PyBRUSS2Df(y,t):
+def PyBRUSS2Df(y,t,A,N):
     RHS = np.zeros(2*N**2)
     U=y[0:N**2]
     V=y[N**2:2*N**2]
-    RHS[0:N**2] = 1+U**2*V-4.4*U+alpha*A*U+BRUSS2DInhom(t)
+    RHS[0:N**2] = 1+U**2*V-4.4*U+alpha*A*U+BRUSS2DInhom(t,N)
     RHS[N**2:2*N**2] = 3.4*U-U**2*V+alpha*A*V
     
     return RHS
@@ -315,7 +325,7 @@ def BRUSS2DProblem():
     denseOutput = [0,1.5,tf]
     initialValue = BRUSS2DInitialValue(N)
 #     denseOutput = [0,0.5,1.,1.3,1.4,5.6,6.,6.1,6.2,10]
-    return TestProblemDefinition("BRUSS2D_"+str(N), FortBRUSS2Df, BRUSS2Dgrad, 0, initialValue, denseOutput,1.,None)
+    return TestProblemDefinition("BRUSS2D_"+str(N), FortBRUSS2Df, BRUSS2Dgrad, 0, initialValue, denseOutput,1.,None,(A,N))
 
 #KDV problem
 
@@ -352,7 +362,7 @@ def storeTestsExactSolutions():
     for test in getAllTests():
         denseOutput = test.denseOutput
         startTime = time.time()
-        exactSolution, infodict = integrate.odeint(test.RHSFunction,test.initialValue, denseOutput, Dfun=None, atol=1e-27, rtol=1e-13, mxstep=100000000, full_output = True)
+        exactSolution, infodict = integrate.odeint(test.RHSFunction,test.initialValue, denseOutput, args=test.args, Dfun=None, atol=1e-27, rtol=1e-13, mxstep=100000000, full_output = True)
         print("Store solution for " + test.problemName + "; solution: " + str(exactSolution))
         print("Time : " + str(time.time()-startTime) + " numb steps: " + str(infodict["nst"]))
         np.savetxt(getReferenceFile(test.problemName), exactSolution[1:len(exactSolution)])
@@ -375,22 +385,22 @@ def inputTuple(k,denseOutput,test,rtol,atol,firstStep,robustness,smoothing,seq,u
     test problems)
     '''
     standardTuple = {'func': test.RHSFunction, 'grad': test.RHSGradient, 'y0': test.initialValue, 't': denseOutput
-                     ,'full_output': True, 'rtol': rtol, 'atol': atol, 'h0': firstStep, 'mxstep': 10e8, 'robustness': robustness,
+                     ,'args': test.args,'full_output': True, 'rtol': rtol, 'atol': atol, 'h0': firstStep, 'mxstep': 10e8, 'robustness': robustness,
                      'smoothing': smoothing,'seq':seq}#, 'nworkers': 1}    
     
     if not useGrad:
         standardTuple['grad'] = None
     
     standardOldTuple = {'func': test.RHSFunction, 'y0': test.initialValue, 't': denseOutput
-                     ,'full_output': True, 'rtol': rtol, 'atol': atol, 'h0': firstStep, 'mxstep': 10e8}
+                     ,'args': test.args,'full_output': True, 'rtol': rtol, 'atol': atol, 'h0': firstStep, 'mxstep': 10e8}
     
     if(useOptimal):
         midimplicitTuple = standardTuple.copy()
-        midimplicitTuple.update({'smoothing': 'gbs','seq':(lambda t: 2*(2*t-1))})
+        midimplicitTuple.update({'smoothing': 'gbs','seq':ex_parallel.StepSequence('harmonic', 4, -2)})
         midsemiimplicitTuple = standardTuple.copy()
-        midsemiimplicitTuple.update({'smoothing': 'semiimp' ,'seq':(lambda t: 2*(2*t-1))})
+        midsemiimplicitTuple.update({'smoothing': 'semiimp' ,'seq':ex_parallel.StepSequence('harmonic', 4, -2)})
         eulersemiimplicitTuple = standardTuple.copy()
-        eulersemiimplicitTuple.update({'smoothing': 'no','seq':(lambda t: 2*(2*t-1))})
+        eulersemiimplicitTuple.update({'smoothing': 'no','seq':ex_parallel.StepSequence('harmonic', 4, -2)})
 #         eulersemiimplicitTuple.update({'smoothing': 'no','seq':seq})
 
         optimalTuples =[
@@ -457,12 +467,9 @@ def comparisonTest():
     useGrad = False
     workers=[1,1,2,2]
 
-    def BD1983(t):
-        #First value of the sequence not used
-        seq=[0,2,6,10,14,22,34,50,70,98,138,194]
-        return seq[t]
+    BD1983 = ex_parallel.StepSequence('BD1983')
     
-    seqs = {'2(2t-1)':(lambda t: 2*t)}#,'t+1':(lambda t: t+1)}#,'B&D1983':BD1983,'None':None}#, }
+    seqs = {'2(2t-1)':ex_parallel.StepSequence('harmonic', 2)}#,'t+1':ex_parallel.StepSequence('harmonic', 1, 1)}#,'B&D1983':BD1983,'None':None}#, }
     firstStep=0.0005
     for test in getAllTests():
         testProblemResult = []
@@ -505,7 +512,7 @@ def comparisonTest():
                                     else:
                                         grad = None
                                     startTime = time.time()
-                                    ys, infodict = solverFunction(test.RHSFunction,test.initialValue, denseOutput, Dfun= grad, atol=atol, rtol=rtol, mxstep=100000000, full_output = True)
+                                    ys, infodict = solverFunction(test.RHSFunction,test.initialValue, denseOutput, args=test.args, Dfun= grad, atol=atol, rtol=rtol, mxstep=100000000, full_output = True)
                                     finalTime = time.time()
 
                                     mean_order = 0
@@ -567,6 +574,49 @@ def comparisonTest():
            
     return resultDict , labels
 
+def jacobianUpdateComparison(tol=1.e-6):
+    '''
+    Compares estimating the Jacobian in each step (frozen until it is outdated for the BRUSS2D problem, see 
+    ex_parallel._JacobianRefresh) with updating it with Broyden's rank-1 updates (jac_update='broyden'): number of
+    Jacobian estimations saved against the extra rejected steps (and function evaluations) they cause.
+    '''
+    initializeBRUSS2DValues(10)
+    tests = [VDPOLProblem(), HIRESProblem(), BRUSS2DProblem()]
+    solverFunctions = [
+        ex_parallel.ex_euler_semi_implicit_parallel
+        ,
+        ex_parallel.ex_midpoint_semi_implicit_parallel
+        ]
+    labelsFunction=[
+        "Semi Eul"
+        ,
+        "SemiImp Midpoint"
+        ]
+    resultDict={}
+    for test in tests:
+        y_ref = np.loadtxt(getReferenceFile(test.problemName))[-1]
+        denseOutput = [test.denseOutput[0], test.denseOutput[-1]]
+        if(test.atol is None):
+            atol=test.atolfact*tol
+        else:
+            atol = test.atol
+        print(test.problemName + " rtol: " + str(tol) + " atol: " + str(atol))
+        for k in range(len(solverFunctions)):
+            for jacUpdate in [None, 'broyden']:
+                startTime = time.time()
+                ys, infodict = solverFunctions[k](test.RHSFunction, None, test.initialValue, denseOutput, 
+                                                  args=test.args, rtol=tol, atol=atol, full_output=True, nworkers=1, parallel=False,
+                                                  jac_update=jacUpdate)
+                finalTime = time.time()
+                relative_error = np.linalg.norm(ys[-1]-y_ref)/np.linalg.norm(y_ref)
+                result = [finalTime-startTime, relative_error, infodict["nfe"], infodict["nst"], infodict["nrej"], 
+                          infodict["nje"]]
+                resultDict[(test.problemName, labelsFunction[k], jacUpdate)] = result
+                print("Done: " + labelsFunction[k] + ", jac update=" + str(jacUpdate) + " time: " + str(result[0]) + 
+                      " rel error: " + str(result[1]) + " func eval: " + str(result[2]) + " num steps: " + str(result[3]) + 
+                      " rejected steps: " + str(result[4]) + " jac eval: " + str(result[5]))
+    return resultDict
+
 def ploteigenvalues(allvaps, testName, tol):
     allvapsreal = [k.real for k in allvaps]
     allvapsim = [k.imag for k in allvaps]
@@ -701,6 +751,7 @@ if __name__ == "__main__":
     #If exact solution hasn't been yet calculated uncomment first line
 #     storeTestsExactSolutions()
     resultDict, labels = comparisonTest()
+    jacobianUpdateComparison()
 #     plotResults(resultDict, labels)
     print "done"
     